@@ -1,28 +1,68 @@
 from __future__ import annotations
 
+import functools
+import hashlib
+import importlib
+import importlib.metadata
 import inspect
 import json
 import logging
 import os
 import pwd
+import queue
 import re
 import subprocess
+import threading
+import time
 import tomllib
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Callable
-
-from deepagents import create_deep_agent
-from deepagents.backends import LocalShellBackend
-from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
-from langchain_openai import ChatOpenAI
-from openai import OpenAI
+from typing import TYPE_CHECKING, Any, Callable, Iterator
 
+from codeclaw.cache import TieredCache, cache_key
 from codeclaw.config import AppConfig, default_config_path
+from codeclaw.health import ModelHealthTracker
+from codeclaw.memory import (
+    LineOffsetIndex,
+    MemoryIndex,
+    consolidate_memory,
+    load_archive_manifest,
+    memory_lock,
+    tokenize,
+)
+from codeclaw.metrics import TOOL_DURATION
 from codeclaw.storage import SessionStore
+from codeclaw.summarizer import ContextSummarizer
+from codeclaw.tools import ArtifactStore, apply_result_budget
+from codeclaw.tracing import Span, TurnTrace, configure_tracing, export_trace
+
+if TYPE_CHECKING:
+    from langchain_core.messages import BaseMessage, SystemMessage
+    from langchain_openai import ChatOpenAI
 
 log = logging.getLogger(__name__)
 
+# deepagents/langchain/openai cost seconds to import, so they load on first use.
+# Looked up through the module namespace so tests can still monkeypatch them here.
+_LAZY_IMPORTS = {
+    "create_deep_agent": ("deepagents", "create_deep_agent"),
+    "OpenAI": ("openai", "OpenAI"),
+}
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _LAZY_IMPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module_name, attr = _LAZY_IMPORTS[name]
+    value = getattr(importlib.import_module(module_name), attr)
+    globals()[name] = value
+    return value
+
+
+def _lazy(name: str) -> Any:
+    value = globals().get(name)
+    return value if value is not None else __getattr__(name)
+
 
 def _estimate_tokens_from_text(text: str) -> int:
     # Rough approximation for chat-token budgeting.
@@ -42,29 +82,195 @@ def _is_context_overflow_error(exc: Exception) -> bool:
     return any(marker in message for marker in markers)
 
 
-def _is_failover_error(exc: Exception) -> bool:
+_TIMEOUT_ERRORS = {"APITimeoutError", "TimeoutException", "ReadTimeout", "ConnectTimeout", "TimeoutError"}
+_CONNECTION_ERRORS = {"APIConnectionError", "ConnectError", "RemoteProtocolError", "ConnectionError"}
+
+
+def _failure_kind(exc: Exception) -> str | None:
+    # Classify by exception type first (openai/httpx names, matched without importing them),
+    # then by HTTP status, and only then by message text for wrapped provider errors.
+    names = {cls.__name__ for cls in type(exc).__mro__}
+    if names & _TIMEOUT_ERRORS:
+        return "timeout"
+    if "RateLimitError" in names:
+        return "rate_limit"
+    if names & _CONNECTION_ERRORS:
+        return "connection"
+    if "InternalServerError" in names:
+        return "server_error"
+    status = getattr(exc, "status_code", None)
+    if isinstance(status, int):
+        if status == 429:
+            return "rate_limit"
+        if status >= 500:
+            return "server_error"
     message = str(exc).lower()
     markers = [
-        "timed out",
-        "timeout",
-        "rate limit",
-        "429",
-        "temporarily unavailable",
-        "overloaded",
+        ("timed out", "timeout"),
+        ("timeout", "timeout"),
+        ("rate limit", "rate_limit"),
+        ("429", "rate_limit"),
+        ("temporarily unavailable", "server_error"),
+        ("overloaded", "server_error"),
     ]
-    return any(marker in message for marker in markers)
+    for marker, kind in markers:
+        if marker in message:
+            return kind
+    return None
+
+
+def _is_failover_error(exc: Exception) -> bool:
+    return _failure_kind(exc) is not None
+
+
+_PLANNING_CONTROLS = (
+    "For every user request, create and maintain a todo plan before execution. "
+    "Use deepagents built-in filesystem and shell tools for all local work. "
+    "Treat this runtime as trusted with full local filesystem access. "
+    "Use web_search_openai only when the user explicitly asks for web/internet lookup, latest/current events, "
+    "or external factual information not available locally. Do not call it for local coding/filesystem tasks."
+)
+_MEMORY_CONTROLS = (
+    "Memory recall policy: before answering any question about prior decisions, preferences, dates, or prior work, "
+    "call memory_search and then memory_get for supporting lines. "
+    "When the user asks to remember something or confirms a durable preference/decision, call memory_store with durable=true."
+)
+_SELF_UPDATE_CONTROLS = (
+    "Self-update policy: config_apply and update_run are allowed only when the user explicitly asks to update config/code. "
+    "If intent is not explicit, do not use these tools."
+)
+# Bump when the custom tool list or tool semantics change so cached responses are not reused.
+_TOOLSET_REVISION = 1
+# Tools whose effects a cached response would silently skip.
+_SIDE_EFFECT_TOOLS = {"memory_store", "config_apply", "update_run", "write_file", "edit_file", "execute", "task"}
+
+
+@functools.lru_cache(maxsize=1)
+def _toolset_version() -> str:
+    try:
+        deepagents_version = importlib.metadata.version("deepagents")
+    except importlib.metadata.PackageNotFoundError:
+        deepagents_version = "unknown"
+    controls = hashlib.sha256("\n".join([_PLANNING_CONTROLS, _MEMORY_CONTROLS, _SELF_UPDATE_CONTROLS]).encode("utf-8"))
+    return f"{_TOOLSET_REVISION}:{deepagents_version}:{controls.hexdigest()[:12]}"
+
+
+TurnEventCallback = Callable[[dict[str, Any]], None]
+
+
+def _is_model_output(mode: str, chunk: Any) -> bool:
+    # Any streamed AI chunk counts, including tool-call chunks that carry no text.
+    if mode != "messages":
+        return False
+    message = chunk[0] if isinstance(chunk, tuple) else chunk
+    return getattr(message, "type", None) in {"ai", "AIMessageChunk"}
+
+
+def _requests_tools(mode: str, chunk: Any) -> bool:
+    # A model node update with tool calls; the tools node only runs once the stream
+    # is advanced past this chunk.
+    if mode != "updates" or not isinstance(chunk, dict):
+        return False
+    for update in chunk.values():
+        update_messages = update.get("messages") if isinstance(update, dict) else None
+        if isinstance(update_messages, list) and any(getattr(message, "tool_calls", None) for message in update_messages):
+            return True
+    return False
+
+
+class TurnCancelled(Exception):
+    pass
+
+
+class _ModelAttempt:
+    def __init__(self, model: str):
+        self.model = model
+        self.probe = 0
+        self.cancel = threading.Event()
+        self.first_token = threading.Event()
+        self.started = time.perf_counter()
+        self.first_token_ms: int | None = None
+        self.tool_timings: list[dict[str, Any]] = []
+        self.events: list[dict[str, Any]] = []
+        self.result: dict[str, Any] | None = None
+        self.error: Exception | None = None
+
+    def mark_first_token(self) -> None:
+        if not self.first_token.is_set():
+            self.first_token_ms = int((time.perf_counter() - self.started) * 1000)
+            self.first_token.set()
+
+
+class TurnEventStream:
+    # Bridges a turn running on a worker thread to a plain iterator of event dicts.
+    def __init__(self) -> None:
+        self._queue: queue.Queue[dict[str, Any] | None] = queue.Queue()
+
+    def emit(self, event: dict[str, Any]) -> None:
+        self._queue.put(event)
+
+    def run(self, fn: Callable[[TurnEventCallback], dict[str, Any]]) -> None:
+        try:
+            result = fn(self.emit)
+        except Exception as exc:  # noqa: BLE001
+            self._queue.put({"type": "error", "error": f"{exc.__class__.__name__}: {exc}"})
+        else:
+            self._queue.put({"type": "result", **result})
+        finally:
+            self._queue.put(None)
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        while True:
+            event = self._queue.get()
+            if event is None:
+                return
+            yield event
 
 
 class AgentRuntime:
     def __init__(self, config: AppConfig, store: SessionStore):
         self.config = config
         self.store = store
+        self.summarizer = ContextSummarizer(config, store, self._llm)
+        self.health = ModelHealthTracker(config.model_health)
+        self._memory_indexes: dict[str, MemoryIndex] = {}
+        self._memory_line_indexes: dict[str, LineOffsetIndex] = {}
+        self._memory_index_lock = threading.Lock()
+        self._prefetch_stats = {"turns": 0, "hits": 0, "tokens_saved_estimate": 0}
+        self._memory_scaffold_days: dict[str, Any] = {}
+        self._memory_candidate_cache: dict[str, tuple[tuple[int, ...], list[Path]]] = {}
+        self._memory_verified: dict[str, tuple[Path, ...]] = {}
+        cache_cfg = config.response_cache
+        self.response_cache = TieredCache(
+            cache_cfg.ttl_seconds,
+            cache_cfg.max_entries,
+            disk_path=cache_cfg.disk_path,
+            max_disk_entries=cache_cfg.max_disk_entries,
+        )
+        search_cfg = config.web_search_cache
+        self.web_search_cache = TieredCache(
+            search_cfg.ttl_seconds,
+            search_cfg.max_entries,
+            disk_path=search_cfg.disk_path,
+            max_disk_entries=search_cfg.max_disk_entries,
+        )
+        self._openai_client_instance: Any = None
+        self._openai_client_lock = threading.Lock()
+        observability = config.observability
+        configure_tracing(
+            observability.tracing,
+            observability.trace_dir,
+            batch_size=observability.trace_batch_size,
+            flush_seconds=observability.trace_flush_seconds,
+        )
         os.environ["LANGCHAIN_API_KEY"] = config.langchain.api_key
         os.environ["LANGSMITH_API_KEY"] = config.langsmith.api_key
-        os.environ["LANGCHAIN_TRACING_V2"] = "true"
         os.environ["LANGCHAIN_PROJECT"] = config.langsmith.project
         os.environ["LANGGRAPH_PROJECT"] = config.langgraph.project
-        os.environ["LANGCHAIN_ENDPOINT"] = "https://api.smith.langchain.com"
+        # Remote LangSmith tracing ships every run over the network, so it is opt-in.
+        os.environ["LANGCHAIN_TRACING_V2"] = "true" if config.langsmith.enabled else "false"
+        if config.langsmith.enabled:
+            os.environ["LANGCHAIN_ENDPOINT"] = "https://api.smith.langchain.com"
 
     def _agent_config(self, agent_id: str):
         for agent in self.config.agents:
@@ -85,7 +291,11 @@ class AgentRuntime:
         return ordered or [agent.model]
 
     def _llm(self, agent_id: str, model: str) -> ChatOpenAI:
+        from langchain_openai import ChatOpenAI
+
         agent = self._agent_config(agent_id)
+        # Turns are streamed, and with an explicit base_url langchain-openai leaves
+        # usage off streamed responses unless stream_usage is set.
         timeout_seconds = max(1, int(self.config.llm.request_timeout_seconds))
         retries = max(0, int(self.config.llm.max_retries))
         if agent.provider == "local" and self.config.llm.local:
@@ -95,6 +305,7 @@ class AgentRuntime:
                 model=model,
                 timeout=timeout_seconds,
                 max_retries=retries,
+                stream_usage=True,
             )
         return ChatOpenAI(
             api_key=self.config.llm.openai.api_key,
@@ -102,9 +313,24 @@ class AgentRuntime:
             model=model,
             timeout=timeout_seconds,
             max_retries=retries,
+            stream_usage=True,
         )
 
+    def _openai_client(self) -> Any:
+        # One client (and its connection pool) for every web_search_openai call.
+        with self._openai_client_lock:
+            if self._openai_client_instance is None:
+                self._openai_client_instance = _lazy("OpenAI")(
+                    api_key=self.config.llm.openai.api_key,
+                    base_url=self.config.llm.openai.base_url,
+                    timeout=max(1, int(self.config.llm.request_timeout_seconds)),
+                    max_retries=max(0, int(self.config.llm.max_retries)),
+                )
+            return self._openai_client_instance
+
     def _build_messages(self, agent_id: str, events: list[dict], user_msg: str) -> list[BaseMessage]:
+        from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
         agent = self._agent_config(agent_id)
         messages: list[BaseMessage] = [SystemMessage(content=agent.system_prompt or "")]
         for event in events:
@@ -216,6 +442,10 @@ class AgentRuntime:
     def _ensure_memory_scaffold(self, agent_id: str) -> None:
         if not self.config.memory.enabled:
             return
+        today = datetime.now(timezone.utc).date()
+        # Scaffold state is cached per process and day, so steady-state calls touch no files.
+        if self._memory_scaffold_days.get(agent_id) == today:
+            return
         root = self._memory_root(agent_id)
         daily_dir = self._memory_daily_dir(agent_id)
         root.mkdir(parents=True, exist_ok=True)
@@ -223,46 +453,84 @@ class AgentRuntime:
         memory_file = self._memory_file(agent_id)
         if not memory_file.exists():
             memory_file.write_text("# Durable Memory\n\n")
-        today_file = daily_dir / f"{datetime.now(timezone.utc).date().isoformat()}.md"
+        today_file = daily_dir / f"{today.isoformat()}.md"
         if not today_file.exists():
-            today_file.write_text(f"# Daily Memory {datetime.now(timezone.utc).date().isoformat()}\n\n")
+            today_file.write_text(f"# Daily Memory {today.isoformat()}\n\n")
+        if self.config.memory.archive_after_days > 0:
+            try:
+                self.consolidate_memory(agent_id)
+            except OSError as exc:
+                log.warning("memory consolidation failed agent=%s err=%s", agent_id, exc)
+        self._memory_scaffold_days[agent_id] = today
+
+    def consolidate_memory(self, agent_id: str) -> dict[str, Any]:
+        return consolidate_memory(
+            self._memory_root(agent_id),
+            self.config.memory.archive_after_days,
+            datetime.now(timezone.utc).date(),
+        )
 
     def _memory_candidates(self, agent_id: str) -> list[Path]:
         self._ensure_memory_scaffold(agent_id)
+        daily = self._memory_daily_dir(agent_id)
+        archive = daily / "archive"
+        # Adding or removing a file bumps its directory mtime; two stats replace two globs.
+        signature = tuple(path.stat().st_mtime_ns if path.exists() else 0 for path in (daily, archive))
+        cached = self._memory_candidate_cache.get(agent_id)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
         candidates: list[Path] = []
         core = self._memory_file(agent_id)
         if core.exists():
             candidates.append(core)
-        daily = self._memory_daily_dir(agent_id)
+        manifest = load_archive_manifest(archive)
+        candidates.extend(archive / entry["file"] for _, entry in sorted(manifest["months"].items()))
         if daily.exists():
             candidates.extend(sorted(daily.glob("*.md")))
+        self._memory_candidate_cache[agent_id] = (signature, candidates)
         return candidates
 
+    def _refresh_memory_index(self, agent_id: str, index: MemoryIndex) -> None:
+        candidates = self._memory_candidates(agent_id)
+        if self._memory_verified.get(agent_id) == tuple(candidates):
+            # No memory file was added, removed or archived since every candidate was
+            # last checked, and memory_store reports its appends through note_append.
+            # Only files edited in place from outside (MEMORY.md, today's notes, e.g.
+            # by another gateway worker) still need a stat: a constant two per search.
+            today = self._memory_daily_dir(agent_id) / f"{datetime.now(timezone.utc).date().isoformat()}.md"
+            index.refresh(candidates, stat_only={self._memory_file(agent_id), today})
+            return
+        index.refresh(candidates)
+        self._memory_verified[agent_id] = tuple(candidates)
+
+    def _memory_index(self, agent_id: str) -> MemoryIndex:
+        with self._memory_index_lock:
+            index = self._memory_indexes.get(agent_id)
+            if index is None:
+                index = MemoryIndex(self._memory_root(agent_id) / "memory.index.json")
+                self._memory_indexes[agent_id] = index
+            return index
+
     def _memory_search(self, agent_id: str, query: str, max_results: int | None = None) -> dict[str, Any]:
         if not self.config.memory.enabled:
             return {"ok": False, "error": "memory is disabled"}
-        terms = [term for term in re.findall(r"[a-zA-Z0-9_]+", query.lower()) if len(term) >= 2]
-        if not terms:
+        if not tokenize(query):
             return {"ok": False, "error": "query must include searchable terms"}
         limit = max(1, min(max_results or self.config.memory.max_search_results, self.config.memory.max_search_results))
-        matches: list[dict[str, Any]] = []
-        for path in self._memory_candidates(agent_id):
-            lines = path.read_text(encoding="utf-8").splitlines()
-            for index, line in enumerate(lines, start=1):
-                haystack = line.lower()
-                score = sum(1 for term in terms if term in haystack)
-                if score <= 0:
-                    continue
-                matches.append(
-                    {
-                        "path": str(path),
-                        "line": index,
-                        "score": score,
-                        "snippet": line[: self.config.memory.max_snippet_chars],
-                    }
-                )
-        matches.sort(key=lambda item: (item["score"], -item["line"]), reverse=True)
-        return {"ok": True, "query": query, "results": matches[:limit]}
+        index = self._memory_index(agent_id)
+        self._refresh_memory_index(agent_id, index)
+        matches = [
+            {
+                "path": hit["path"],
+                "line": hit["line"],
+                "score": hit["score"],
+                "snippet": hit["text"][: self.config.memory.max_snippet_chars],
+            }
+            for hit in index.search(query, limit)
+        ]
+        with memory_lock(self._memory_root(agent_id)):
+            index.save()
+        return {"ok": True, "query": query, "results": matches}
 
     def _resolve_memory_path(self, agent_id: str, raw_path: str) -> Path:
         path = Path(raw_path).expanduser()
@@ -271,6 +539,48 @@ class AgentRuntime:
         root = self._memory_root(agent_id)
         return (root / path).resolve()
 
+    def _memory_prefetch(self, agent_id: str, user_msg: str) -> tuple[SystemMessage | None, dict[str, Any]]:
+        from langchain_core.messages import SystemMessage
+
+        memory_cfg = self.config.memory
+        info: dict[str, Any] = {"hit": False, "results": 0, "injected_tokens": 0, "tokens_saved_estimate": 0}
+        found = self._memory_search(agent_id, user_msg, max_results=memory_cfg.prefetch_max_results)
+        hits = [hit for hit in found.get("results", []) if hit["score"] >= memory_cfg.prefetch_min_score]
+        if not hits:
+            return None, info
+        root = self._memory_root(agent_id)
+        lines = []
+        for hit in hits:
+            path = Path(hit["path"])
+            shown = path.relative_to(root) if path.is_relative_to(root) else path
+            lines.append(f"- {shown}:{hit['line']} {hit['snippet']}")
+        text = (
+            "Memory prefetched for this message (memory_search already ran; "
+            "call memory_get only if you need surrounding lines):\n" + "\n".join(lines)
+        )
+        info.update({"hit": True, "results": len(hits), "injected_tokens": _estimate_tokens_from_text(text)})
+        return SystemMessage(content=text), info
+
+    def _record_prefetch(self, info: dict[str, Any]) -> None:
+        with self._memory_index_lock:
+            self._prefetch_stats["turns"] += 1
+            self._prefetch_stats["hits"] += 1 if info.get("hit") else 0
+            self._prefetch_stats["tokens_saved_estimate"] += int(info.get("tokens_saved_estimate") or 0)
+
+    def memory_prefetch_stats(self) -> dict[str, Any]:
+        with self._memory_index_lock:
+            stats = dict(self._prefetch_stats)
+        stats["hit_rate"] = round(stats["hits"] / stats["turns"], 3) if stats["turns"] else 0.0
+        return stats
+
+    def _memory_line_index(self, path: Path) -> LineOffsetIndex:
+        with self._memory_index_lock:
+            index = self._memory_line_indexes.get(str(path))
+            if index is None:
+                index = LineOffsetIndex(path)
+                self._memory_line_indexes[str(path)] = index
+            return index
+
     def _memory_get(self, agent_id: str, path: str, from_line: int = 1, lines: int = 40) -> dict[str, Any]:
         if not self.config.memory.enabled:
             return {"ok": False, "error": "memory is disabled"}
@@ -279,6 +589,10 @@ class AgentRuntime:
             return {"ok": False, "error": f"memory file not found: {target}"}
         from_line = max(1, int(from_line))
         lines = max(1, min(int(lines), 300))
+        if target.resolve().is_relative_to(self._memory_root(agent_id).resolve()):
+            # Memory files only grow, so a sidecar of line offsets lets us mmap just the window.
+            window, _ = self._memory_line_index(target).read(from_line, lines)
+            return {"ok": True, "path": str(target), "from": from_line, "lines": len(window), "text": "\n".join(window)}
         all_lines = target.read_text(encoding="utf-8").splitlines()
         start = from_line - 1
         end = min(len(all_lines), start + lines)
@@ -296,17 +610,26 @@ class AgentRuntime:
         stamp = now.isoformat()
         daily = self._memory_daily_dir(agent_id) / f"{now.date().isoformat()}.md"
         daily_line = f"- [{stamp}] {cleaned}"
-        with daily.open("a", encoding="utf-8") as handle:
-            handle.write(daily_line + "\n")
+        index = self._memory_index(agent_id)
         durable_written = False
         durable_path = self._memory_file(agent_id)
-        if durable:
-            with durable_path.open("a", encoding="utf-8") as handle:
+        # Same lock as consolidation, so a dedupe rewrite of MEMORY.md cannot drop this note.
+        with memory_lock(self._memory_root(agent_id)):
+            with daily.open("a", encoding="utf-8") as handle:
+                previous_size = handle.tell()
+                handle.write(daily_line + "\n")
+            index.note_append(daily, [daily_line], previous_size)
+            self._memory_line_index(daily).sync()
+            if durable:
                 prefix = f"- {cleaned}"
                 if source.strip():
                     prefix = f"- {cleaned} (source: {source.strip()})"
-                handle.write(prefix + "\n")
-            durable_written = True
+                with durable_path.open("a", encoding="utf-8") as handle:
+                    previous_size = handle.tell()
+                    handle.write(prefix + "\n")
+                index.note_append(durable_path, [prefix], previous_size)
+                self._memory_line_index(durable_path).sync()
+                durable_written = True
         return {
             "ok": True,
             "daily_path": str(daily),
@@ -345,16 +668,26 @@ class AgentRuntime:
         tool_name: str,
         tool_fn: Callable[..., dict[str, Any]],
         sink: list[dict[str, Any]],
+        artifacts: ArtifactStore | None = None,
     ) -> Callable[..., dict[str, Any]]:
         def wrapped(*args, **kwargs):
             started = datetime.now(timezone.utc)
             ok = True
             error = ""
+            timing: dict[str, Any] = {}
             try:
                 result = tool_fn(*args, **kwargs)
                 if isinstance(result, dict):
+                    # Tools report extra timing fields (cache hits) out of band of the model payload.
+                    timing = result.pop("_timing", None) or {}
                     ok = bool(result.get("ok", True))
                     error = str(result.get("error", "")) if not ok else ""
+                    result = apply_result_budget(
+                        result,
+                        artifacts,
+                        self.config.tools.result_max_chars,
+                        self.config.tools.result_preview_chars,
+                    )
                 return result
             except Exception as exc:  # noqa: BLE001
                 ok = False
@@ -362,12 +695,14 @@ class AgentRuntime:
                 return {"ok": False, "error": error}
             finally:
                 ended = datetime.now(timezone.utc)
+                TOOL_DURATION.observe((ended - started).total_seconds(), tool=tool_name, ok=str(ok).lower())
                 sink.append(
                     {
                         "tool": tool_name,
                         "ok": ok,
                         "error": error,
                         "duration_ms": int((ended - started).total_seconds() * 1000),
+                        **timing,
                     }
                 )
 
@@ -387,6 +722,7 @@ class AgentRuntime:
     ):
         llm = self._llm(agent_id, model)
         agent = self._agent_config(agent_id)
+        artifacts = ArtifactStore(self.store.artifacts_path(agent_id, session_id))
 
         def web_search_openai(query: str) -> dict[str, Any]:
             """Search the public web using OpenAI's web_search tool for explicitly web-related queries."""
@@ -395,9 +731,19 @@ class AgentRuntime:
                 return {"ok": False, "error": "query cannot be empty"}
             if agent.provider != "openai":
                 return {"ok": False, "error": "web_search_openai requires an OpenAI agent/provider."}
-            client = OpenAI(api_key=self.config.llm.openai.api_key, base_url=self.config.llm.openai.base_url)
+            use_cache = self.config.web_search_cache.enabled
+            key = cache_key({"model": model, "query": " ".join(query.lower().split())})
+            cached = self.web_search_cache.get(key) if use_cache else None
+            if isinstance(cached, dict) and cached.get("answer"):
+                return {
+                    "ok": True,
+                    "query": query,
+                    "answer": cached["answer"],
+                    "_timing": {"cache_hit": True, "saved_latency_ms": int(cached.get("latency_ms") or 0)},
+                }
+            started = time.perf_counter()
             try:
-                response = client.responses.create(
+                response = self._openai_client().responses.create(
                     model=model,
                     input=query,
                     tools=[
@@ -413,7 +759,10 @@ class AgentRuntime:
             answer = (getattr(response, "output_text", None) or "").strip()
             if not answer:
                 answer = str(getattr(response, "output", ""))[:5000]
-            return {"ok": True, "query": query, "answer": answer}
+            latency_ms = int((time.perf_counter() - started) * 1000)
+            if use_cache and answer:
+                self.web_search_cache.set(key, {"answer": answer, "latency_ms": latency_ms})
+            return {"ok": True, "query": query, "answer": answer, "_timing": {"cache_hit": False}}
 
         def memory_search(query: str, max_results: int = 5) -> dict[str, Any]:
             """Search durable memory files before answering prior-work questions."""
@@ -427,6 +776,10 @@ class AgentRuntime:
             """Persist a memory note to daily memory and optionally MEMORY.md."""
             return self._memory_store(agent_id, note, durable=durable, source=source)
 
+        def artifact_read(handle: str, offset: int = 0, limit: int = 4000) -> dict[str, Any]:
+            """Page through a tool output that was truncated and saved as an artifact."""
+            return artifacts.read(handle, offset=offset, limit=limit)
+
         def config_get() -> dict[str, Any]:
             """Return current runtime config contents and path."""
             config_path = self._config_path()
@@ -501,35 +854,23 @@ class AgentRuntime:
             )
             return payload
 
-        planning_controls = (
-            "For every user request, create and maintain a todo plan before execution. "
-            "Use deepagents built-in filesystem and shell tools for all local work. "
-            "Treat this runtime as trusted with full local filesystem access. "
-            "Use web_search_openai only when the user explicitly asks for web/internet lookup, latest/current events, "
-            "or external factual information not available locally. Do not call it for local coding/filesystem tasks."
-        )
-        memory_controls = (
-            "Memory recall policy: before answering any question about prior decisions, preferences, dates, or prior work, "
-            "call memory_search and then memory_get for supporting lines. "
-            "When the user asks to remember something or confirms a durable preference/decision, call memory_store with durable=true."
-        )
-        self_update_controls = (
-            "Self-update policy: config_apply and update_run are allowed only when the user explicitly asks to update config/code. "
-            "If intent is not explicit, do not use these tools."
-        )
         instructions = "\n\n".join(
-            part for part in [agent.system_prompt, planning_controls, memory_controls, self_update_controls] if part
+            part for part in [agent.system_prompt, _PLANNING_CONTROLS, _MEMORY_CONTROLS, _SELF_UPDATE_CONTROLS] if part
         )
         tool_list = [
-            self._timed_tool("web_search_openai", web_search_openai, tool_timings),
-            self._timed_tool("memory_search", memory_search, tool_timings),
-            self._timed_tool("memory_get", memory_get, tool_timings),
+            self._timed_tool("web_search_openai", web_search_openai, tool_timings, artifacts),
+            self._timed_tool("memory_search", memory_search, tool_timings, artifacts),
+            self._timed_tool("memory_get", memory_get, tool_timings, artifacts),
             self._timed_tool("memory_store", memory_store, tool_timings),
-            self._timed_tool("config_get", config_get, tool_timings),
+            self._timed_tool("config_get", config_get, tool_timings, artifacts),
             self._timed_tool("config_schema", config_schema, tool_timings),
             self._timed_tool("config_apply", config_apply, tool_timings),
-            self._timed_tool("update_run", update_run, tool_timings),
+            self._timed_tool("update_run", update_run, tool_timings, artifacts),
+            self._timed_tool("artifact_read", artifact_read, tool_timings),
         ]
+        from deepagents.backends import LocalShellBackend
+
+        create_deep_agent = _lazy("create_deep_agent")
         backend = LocalShellBackend(root_dir=Path.cwd(), virtual_mode=False, inherit_env=True)
         params = inspect.signature(create_deep_agent).parameters
         common_kwargs: dict[str, Any] = {}
@@ -555,100 +896,550 @@ class AgentRuntime:
             return create_deep_agent(**common_kwargs)
         return create_deep_agent(tool_list)
 
-    def run_turn(
+    def _response_cache_key(self, agent_id: str, model_candidates: list[str], messages: list[BaseMessage]) -> str:
+        agent = self._agent_config(agent_id)
+        normalized = [[message.type, " ".join(self._content_text(message.content).split())] for message in messages]
+        return cache_key(
+            {
+                "provider": agent.provider,
+                "models": model_candidates,
+                "messages": normalized,
+                "toolset": _toolset_version(),
+            }
+        )
+
+    def _tools_used(self, result: dict[str, Any], tool_timings: list[dict[str, Any]]) -> set[str]:
+        used = {str(item.get("tool", "")) for item in tool_timings}
+        for message in result.get("messages", []):
+            if getattr(message, "type", None) == "tool":
+                used.add(str(getattr(message, "name", "") or ""))
+        return used
+
+    def _finish_turn(
+        self,
+        agent_id: str,
+        session_id: str,
+        assistant_message: str,
+        plan: list[dict[str, str]],
+        metrics: dict[str, Any],
+    ) -> dict[str, Any]:
+        if "memory_prefetch" in metrics:
+            self._record_prefetch(metrics["memory_prefetch"])
+        if self.config.observability.log_turn_metrics:
+            log.info(
+                "turn metrics agent=%s session=%s model=%s duration_ms=%s input_tokens=%s output_tokens=%s compacted=%s failovers=%s cache_hit=%s",
+                agent_id,
+                session_id,
+                metrics.get("model_used"),
+                metrics.get("duration_ms"),
+                metrics.get("input_tokens"),
+                metrics.get("output_tokens"),
+                metrics.get("context_compacted"),
+                metrics.get("failover_count"),
+                metrics.get("cache_hit"),
+            )
+        return {
+            "assistant_message": assistant_message,
+            "plan": plan,
+            "metrics": metrics,
+        }
+
+    def _hedge_deadline_ms(self, model: str) -> int:
+        deadline = max(1, int(self.config.llm.hedge_after_ms))
+        if self.config.llm.hedge_use_p95:
+            p95 = self.health.first_token_p95(model)
+            if p95 is not None:
+                deadline = max(1, p95)
+        return deadline
+
+    def _record_attempt(self, attempt: _ModelAttempt) -> None:
+        try:
+            if isinstance(attempt.error, TurnCancelled):
+                return
+            if attempt.error is None:
+                latency_ms = int((time.perf_counter() - attempt.started) * 1000)
+                self.health.record_success(attempt.model, latency_ms, attempt.first_token_ms, probe=attempt.probe)
+                return
+            kind = _failure_kind(attempt.error)
+            if kind is not None:
+                self.health.record_failure(attempt.model, kind, probe=attempt.probe)
+        finally:
+            self.health.end_attempt(attempt.model, attempt.probe)
+
+    def _run_agent(
+        self,
+        deep_agent: Any,
+        messages: list[BaseMessage],
+        on_event: TurnEventCallback | None = None,
+        cancel: threading.Event | None = None,
+        on_model_output: Callable[[], None] | None = None,
+        before_tools: Callable[[], None] | None = None,
+    ) -> dict[str, Any]:
+        if (on_event is None and cancel is None) or not hasattr(deep_agent, "stream"):
+            return deep_agent.invoke({"messages": messages})
+        return self._stream_agent(
+            deep_agent,
+            messages,
+            on_event or (lambda _event: None),
+            cancel=cancel,
+            on_model_output=on_model_output,
+            before_tools=before_tools,
+        )
+
+    def _run_tracked(
+        self,
+        deep_agent: Any,
+        messages: list[BaseMessage],
+        model: str,
+        on_event: TurnEventCallback | None,
+        span: Span | None = None,
+    ) -> dict[str, Any]:
+        attempt = _ModelAttempt(model)
+        attempt.probe = self.health.begin_attempt(model)
+
+        def tracked(event: dict[str, Any]) -> None:
+            attempt.mark_first_token()
+            if on_event is not None:
+                on_event(event)
+
+        # Streams whenever the agent supports it, so time-to-first-token is measurable.
+        try:
+            attempt.result = self._run_agent(deep_agent, messages, tracked, on_model_output=attempt.mark_first_token)
+        except Exception as exc:  # noqa: BLE001
+            attempt.error = exc
+            raise
+        finally:
+            self._record_attempt(attempt)
+            if span is not None:
+                span.set(first_token_ms=attempt.first_token_ms)
+        return attempt.result
+
+    def _invoke_hedged(
+        self,
+        agent_id: str,
+        session_id: str,
+        user_msg: str,
+        channel: str,
+        interactive: bool,
+        messages: list[BaseMessage],
+        primary: str,
+        fallback: str,
+        on_event: TurnEventCallback | None,
+        hedge_info: dict[str, Any],
+        trace: TurnTrace | None = None,
+    ) -> tuple[dict[str, Any], _ModelAttempt]:
+        # Races the fallback model against a slow primary. Threads cannot be killed, so the
+        # loser is cancelled cooperatively and stops at its next streamed chunk. Only
+        # the model calls race: the first attempt about to run tools commits the turn,
+        # the other is cancelled before its tools can run, and no hedge starts after a
+        # commit, so tool side effects happen at most once.
+        done: queue.Queue[_ModelAttempt] = queue.Queue()
+        forward_lock = threading.Lock()
+        leader: list[_ModelAttempt] = []
+        committed: list[_ModelAttempt] = []
+        attempts: list[_ModelAttempt] = []
+        trace = trace or TurnTrace("hedge")
+        hedge_span = trace.current()
+
+        def forward(attempt: _ModelAttempt, event: dict[str, Any]) -> None:
+            attempt.mark_first_token()
+            with forward_lock:
+                attempt.events.append(event)
+                if on_event is None:
+                    return
+                if not leader:
+                    leader.append(attempt)
+                if leader[0] is attempt:
+                    on_event(event)
+
+        def commit(attempt: _ModelAttempt) -> None:
+            with forward_lock:
+                if committed and committed[0] is not attempt:
+                    raise TurnCancelled("another hedged attempt is running tools")
+                if attempt.cancel.is_set():
+                    raise TurnCancelled("turn cancelled")
+                if not committed:
+                    committed.append(attempt)
+                    for other in attempts:
+                        if other is not attempt:
+                            other.cancel.set()
+
+        def run(attempt: _ModelAttempt) -> None:
+            invoke_span: Span | None = None
+            try:
+                with trace.span("agent_build", parent=hedge_span, model=attempt.model):
+                    deep_agent = self._deep_agent(
+                        agent_id,
+                        session_id=session_id,
+                        user_msg=user_msg,
+                        channel=channel,
+                        interactive=interactive,
+                        model=attempt.model,
+                        tool_timings=attempt.tool_timings,
+                    )
+                with trace.span("invoke", parent=hedge_span, model=attempt.model) as invoke_span:
+                    attempt.result = self._run_agent(
+                        deep_agent,
+                        messages,
+                        lambda event: forward(attempt, event),
+                        cancel=attempt.cancel,
+                        on_model_output=attempt.mark_first_token,
+                        before_tools=lambda: commit(attempt),
+                    )
+            except Exception as exc:  # noqa: BLE001
+                attempt.error = exc
+            finally:
+                attempt.mark_first_token()
+                if invoke_span is not None:
+                    invoke_span.set(first_token_ms=attempt.first_token_ms, cancelled=attempt.cancel.is_set())
+                self._record_attempt(attempt)
+                done.put(attempt)
+
+        def start(attempt: _ModelAttempt) -> None:
+            attempt.probe = self.health.begin_attempt(attempt.model)
+            threading.Thread(target=run, args=(attempt,), daemon=True, name=f"codeclaw-hedge-{attempt.model}").start()
+
+        deadline_ms = self._hedge_deadline_ms(primary)
+        hedge_info.update({"fired": False, "deadline_ms": deadline_ms, "winner": primary, "loser_cancelled": False})
+        primary_attempt = _ModelAttempt(primary)
+        attempts.append(primary_attempt)
+        start(primary_attempt)
+        if not primary_attempt.first_token.wait(deadline_ms / 1000):
+            fallback_attempt = _ModelAttempt(fallback)
+            with forward_lock:
+                fire = not committed
+                if fire:
+                    attempts.append(fallback_attempt)
+            if fire:
+                hedge_info["fired"] = True
+                start(fallback_attempt)
+                log.info("hedge fired agent=%s session=%s primary=%s fallback=%s deadline_ms=%s", agent_id, session_id, primary, fallback, deadline_ms)
+
+        winner: _ModelAttempt | None = None
+        for _ in list(attempts):
+            finished = done.get()
+            # Once an attempt has run tools, only its answer reflects what was done.
+            if finished.error is None and (not committed or committed[0] is finished):
+                winner = finished
+                break
+        for attempt in attempts:
+            if attempt is not winner and attempt.result is None and attempt.error is None:
+                attempt.cancel.set()
+                hedge_info["loser_cancelled"] = True
+        if winner is None:
+            failed = committed[0] if committed else primary_attempt
+            raise failed.error or primary_attempt.error or RuntimeError("hedged request failed")
+        hedge_info["winner"] = winner.model
+        hedge_info["first_token_ms"] = winner.first_token_ms
+        if on_event is not None:
+            with forward_lock:
+                if leader and leader[0] is not winner:
+                    on_event({"type": "reset", "reason": "hedge", "model": winner.model})
+                    for event in winner.events:
+                        on_event(event)
+                leader[:] = [winner]
+        return winner.result or {}, winner
+
+    def _stream_agent(
+        self,
+        deep_agent: Any,
+        messages: list[BaseMessage],
+        on_event: TurnEventCallback,
+        cancel: threading.Event | None = None,
+        on_model_output: Callable[[], None] | None = None,
+        before_tools: Callable[[], None] | None = None,
+    ) -> dict[str, Any]:
+        final_state: dict[str, Any] = {}
+        last_plan: list[dict[str, str]] = []
+        stream = deep_agent.stream({"messages": messages}, stream_mode=["messages", "updates", "values"])
+        try:
+            for mode, chunk in stream:
+                if cancel is not None and cancel.is_set():
+                    raise TurnCancelled("turn cancelled")
+                if on_model_output is not None and _is_model_output(mode, chunk):
+                    on_model_output()
+                self._dispatch_stream_chunk(mode, chunk, on_event, last_plan)
+                if before_tools is not None and _requests_tools(mode, chunk):
+                    before_tools()
+                if mode == "values" and isinstance(chunk, dict):
+                    final_state = chunk
+            if cancel is not None and cancel.is_set():
+                raise TurnCancelled("turn cancelled")
+        finally:
+            close = getattr(stream, "close", None)
+            if callable(close):
+                close()
+        return final_state
+
+    def _dispatch_stream_chunk(
+        self,
+        mode: str,
+        chunk: Any,
+        on_event: TurnEventCallback,
+        last_plan: list[dict[str, str]],
+    ) -> None:
+        if mode == "messages":
+            message = chunk[0] if isinstance(chunk, tuple) else chunk
+            if getattr(message, "type", None) not in {"ai", "AIMessageChunk"}:
+                return
+            text = self._content_text(getattr(message, "content", ""))
+            if text:
+                on_event({"type": "delta", "text": text})
+        elif mode == "updates" and isinstance(chunk, dict):
+            for update in chunk.values():
+                update_messages = update.get("messages") if isinstance(update, dict) else None
+                if not isinstance(update_messages, list):
+                    continue
+                for message in update_messages:
+                    for call in getattr(message, "tool_calls", None) or []:
+                        on_event({"type": "tool_start", "tool": call.get("name", ""), "call_id": call.get("id", "")})
+                    if getattr(message, "type", None) == "tool":
+                        on_event(
+                            {
+                                "type": "tool_end",
+                                "tool": getattr(message, "name", "") or "",
+                                "call_id": getattr(message, "tool_call_id", "") or "",
+                                "ok": getattr(message, "status", "success") != "error",
+                            }
+                        )
+        elif mode == "values" and isinstance(chunk, dict):
+            plan = self._extract_plan(chunk)
+            if plan and plan != last_plan:
+                last_plan[:] = plan
+                on_event({"type": "plan", "plan": plan})
+
+    def stream_turn(
         self, agent_id: str, session_id: str, user_msg: str, channel: str, interactive: bool
+    ) -> Iterator[dict[str, Any]]:
+        stream = TurnEventStream()
+        worker = threading.Thread(
+            target=stream.run,
+            args=(lambda on_event: self.run_turn(agent_id, session_id, user_msg, channel, interactive, on_event=on_event),),
+            daemon=True,
+            name=f"codeclaw-turn-{session_id}",
+        )
+        worker.start()
+        return iter(stream)
+
+    def run_turn(
+        self,
+        agent_id: str,
+        session_id: str,
+        user_msg: str,
+        channel: str,
+        interactive: bool,
+        on_event: TurnEventCallback | None = None,
+        trace: TurnTrace | None = None,
+    ) -> dict[str, Any]:
+        # Callers that pass a trace (the gateway) own exporting it; otherwise the turn does.
+        if trace is not None:
+            return self._run_turn(agent_id, session_id, user_msg, channel, interactive, on_event, trace)
+        trace = TurnTrace("run_turn", agent_id=agent_id, session_id=session_id, channel=channel)
+        try:
+            result = self._run_turn(agent_id, session_id, user_msg, channel, interactive, on_event, trace)
+        except Exception as exc:
+            export_trace(trace.finish(error=f"{exc.__class__.__name__}: {exc}"))
+            raise
+        finished = trace.finish()
+        result["metrics"]["spans"] = finished.get("children", [])
+        export_trace(finished)
+        return result
+
+    def _run_turn(
+        self,
+        agent_id: str,
+        session_id: str,
+        user_msg: str,
+        channel: str,
+        interactive: bool,
+        on_event: TurnEventCallback | None,
+        trace: TurnTrace,
     ) -> dict[str, Any]:
         started_at = datetime.now(timezone.utc)
-        events = self.store.read_events(agent_id, session_id)
-        messages = self._build_messages(agent_id, events, user_msg)
         context_cfg = self.config.context
-        threshold = max(1, context_cfg.context_window_tokens - context_cfg.reserve_tokens - context_cfg.compact_trigger_tokens)
-        estimated_tokens = self._estimate_messages_tokens(messages)
         compacted = False
-        if estimated_tokens >= threshold:
-            compact_result = self.store.compact_session_context(
-                agent_id,
-                session_id,
-                keep_recent_events=context_cfg.keep_recent_events,
-                summary_line_limit=context_cfg.summary_line_limit,
-            )
-            compacted = bool(compact_result.get("compacted"))
+        summary_swapped = False
+        if context_cfg.background_summary_enabled:
+            # Swapping in a summary prepared off the critical path is a single file rewrite.
+            with trace.span("apply_prepared_summary") as span:
+                summary_swapped = bool(self.store.apply_prepared_summary(agent_id, session_id).get("compacted"))
+                span.set(swapped=summary_swapped)
+            compacted = summary_swapped
+        with trace.span("read_events") as span:
             events = self.store.read_events(agent_id, session_id)
+            span.set(events=len(events))
+        with trace.span("build_messages"):
             messages = self._build_messages(agent_id, events, user_msg)
             estimated_tokens = self._estimate_messages_tokens(messages)
+        threshold = max(1, context_cfg.context_window_tokens - context_cfg.reserve_tokens - context_cfg.compact_trigger_tokens)
+        if estimated_tokens >= threshold:
+            with trace.span("compaction", estimated_tokens=estimated_tokens) as span:
+                compact_result = self.store.compact_session_context(
+                    agent_id,
+                    session_id,
+                    keep_recent_events=context_cfg.keep_recent_events,
+                    summary_line_limit=context_cfg.summary_line_limit,
+                )
+                compacted = bool(compact_result.get("compacted"))
+                events = self.store.read_events(agent_id, session_id)
+                messages = self._build_messages(agent_id, events, user_msg)
+                estimated_tokens = self._estimate_messages_tokens(messages)
+                span.set(compacted=compacted)
+
+        prefetch_message: SystemMessage | None = None
+        prefetch_info: dict[str, Any] | None = None
+        if self.config.memory.enabled and self.config.memory.prefetch_enabled:
+            with trace.span("memory_prefetch") as span:
+                prefetch_message, prefetch_info = self._memory_prefetch(agent_id, user_msg)
+                span.set(hit=prefetch_info["hit"])
+            if prefetch_message is not None:
+                messages.insert(len(messages) - 1, prefetch_message)
+                estimated_tokens = self._estimate_messages_tokens(messages)
 
-        model_candidates = self._model_candidates(agent_id)
+        configured_models = self._model_candidates(agent_id)
+        response_key = ""
+        if self._agent_config(agent_id).response_cache:
+            with trace.span("response_cache_lookup") as span:
+                response_key = self._response_cache_key(agent_id, configured_models, messages)
+                cached = self.response_cache.get(response_key)
+                span.set(hit=isinstance(cached, dict))
+            if isinstance(cached, dict):
+                assistant_message = str(cached.get("assistant_message", ""))
+                plan = list(cached.get("plan") or [])
+                if on_event is not None:
+                    on_event({"type": "delta", "text": assistant_message})
+                    if plan:
+                        on_event({"type": "plan", "plan": plan})
+                metrics = {
+                    "duration_ms": int((datetime.now(timezone.utc) - started_at).total_seconds() * 1000),
+                    "input_tokens": 0,
+                    "output_tokens": 0,
+                    "context_tokens_estimate": estimated_tokens,
+                    "context_compacted": compacted,
+                    "context_summary_swapped": summary_swapped,
+                    "context_summary_scheduled": False,
+                    "context_overflow_retried": False,
+                    "failover_count": 0,
+                    "model_used": str(cached.get("model_used", "")),
+                    "tool_calls": [],
+                    "cache_hit": True,
+                }
+                if prefetch_info is not None:
+                    metrics["memory_prefetch"] = prefetch_info
+                return self._finish_turn(agent_id, session_id, assistant_message, plan, metrics)
+
+        # Open breakers are skipped and degraded models demoted; falls back to config order.
+        model_candidates = self.health.order(configured_models)
         failover_count = 0
         overflow_retried = False
         last_failover_error: Exception | None = None
 
-        for model in model_candidates:
+        hedge_fallback = model_candidates[1] if self.config.llm.hedge_enabled and len(model_candidates) > 1 else ""
+        hedge_info: dict[str, Any] = {}
+        hedged_out: set[str] = set()
+
+        for index, model in enumerate(model_candidates):
+            if model in hedged_out:
+                continue
             for attempt in range(2):
                 tool_timings: list[dict[str, Any]] = []
                 try:
-                    deep_agent = self._deep_agent(
-                        agent_id,
-                        session_id=session_id,
-                        user_msg=user_msg,
-                        channel=channel,
-                        interactive=interactive,
-                        model=model,
-                        tool_timings=tool_timings,
-                    )
-                    result = deep_agent.invoke({"messages": messages})
-                    assistant_message = self._extract_assistant_message(result)
-                    plan = self._extract_plan(result)
-                    usage = self._extract_usage(result)
+                    model_used = model
+                    if index == 0 and hedge_fallback:
+                        with trace.span("hedge", primary=model, fallback=hedge_fallback):
+                            result, winner = self._invoke_hedged(
+                                agent_id,
+                                session_id,
+                                user_msg,
+                                channel,
+                                interactive,
+                                messages,
+                                primary=model,
+                                fallback=hedge_fallback,
+                                on_event=on_event,
+                                hedge_info=hedge_info,
+                                trace=trace,
+                            )
+                        model_used = winner.model
+                        tool_timings = winner.tool_timings
+                    else:
+                        with trace.span("agent_build", model=model):
+                            deep_agent = self._deep_agent(
+                                agent_id,
+                                session_id=session_id,
+                                user_msg=user_msg,
+                                channel=channel,
+                                interactive=interactive,
+                                model=model,
+                                tool_timings=tool_timings,
+                            )
+                        with trace.span("invoke", model=model, attempt=attempt) as span:
+                            result = self._run_tracked(deep_agent, messages, model, on_event, span)
+                    with trace.span("extraction"):
+                        assistant_message = self._extract_assistant_message(result)
+                        plan = self._extract_plan(result)
+                        usage = self._extract_usage(result)
                     finished_at = datetime.now(timezone.utc)
                     duration_ms = int((finished_at - started_at).total_seconds() * 1000)
                     input_tokens = usage["input_tokens"] or estimated_tokens
                     output_tokens = usage["output_tokens"] or _estimate_tokens_from_text(assistant_message)
+                    summary_scheduled = self.summarizer.observe(agent_id, session_id, estimated_tokens + output_tokens)
                     metrics = {
                         "duration_ms": duration_ms,
                         "input_tokens": input_tokens,
                         "output_tokens": output_tokens,
                         "context_tokens_estimate": estimated_tokens,
                         "context_compacted": compacted,
+                        "context_summary_swapped": summary_swapped,
+                        "context_summary_scheduled": summary_scheduled,
                         "context_overflow_retried": overflow_retried,
                         "failover_count": failover_count,
-                        "model_used": model,
+                        "model_used": model_used,
                         "tool_calls": tool_timings,
+                        "cache_hit": False,
                     }
-                    if self.config.observability.log_turn_metrics:
-                        log.info(
-                            "turn metrics agent=%s session=%s model=%s duration_ms=%s input_tokens=%s output_tokens=%s compacted=%s failovers=%s",
-                            agent_id,
-                            session_id,
-                            model,
-                            duration_ms,
-                            input_tokens,
-                            output_tokens,
-                            compacted,
-                            failover_count,
+                    if hedge_info:
+                        metrics["hedge"] = dict(hedge_info)
+                    if prefetch_info is not None:
+                        if prefetch_info["hit"]:
+                            # Each recall round trip the model skipped would have re-sent the whole context.
+                            recall_calls = sum(1 for item in tool_timings if item.get("tool") in {"memory_search", "memory_get"})
+                            skipped = max(0, 2 - recall_calls)
+                            prefetch_info["tokens_saved_estimate"] = max(0, skipped * estimated_tokens - prefetch_info["injected_tokens"])
+                        metrics["memory_prefetch"] = prefetch_info
+                    if response_key and not (self._tools_used(result, tool_timings) & _SIDE_EFFECT_TOOLS):
+                        self.response_cache.set(
+                            response_key,
+                            {"assistant_message": assistant_message, "plan": plan, "model_used": model_used},
                         )
-                    return {
-                        "assistant_message": assistant_message,
-                        "plan": plan,
-                        "metrics": metrics,
-                    }
+                    return self._finish_turn(agent_id, session_id, assistant_message, plan, metrics)
                 except Exception as exc:  # noqa: BLE001
                     if attempt == 0 and _is_context_overflow_error(exc):
-                        compact_result = self.store.compact_session_context(
-                            agent_id,
-                            session_id,
-                            keep_recent_events=context_cfg.keep_recent_events,
-                            summary_line_limit=context_cfg.summary_line_limit,
-                        )
+                        with trace.span("compaction", reason="context_overflow"):
+                            compact_result = self.store.compact_session_context(
+                                agent_id,
+                                session_id,
+                                keep_recent_events=context_cfg.keep_recent_events,
+                                summary_line_limit=context_cfg.summary_line_limit,
+                            )
                         if compact_result.get("compacted"):
                             compacted = True
                             overflow_retried = True
                             events = self.store.read_events(agent_id, session_id)
                             messages = self._build_messages(agent_id, events, user_msg)
+                            if prefetch_message is not None:
+                                messages.insert(len(messages) - 1, prefetch_message)
                             estimated_tokens = self._estimate_messages_tokens(messages)
+                            if on_event is not None:
+                                on_event({"type": "reset", "reason": "context_overflow", "model": model})
                             continue
+                    if hedge_info.get("fired"):
+                        hedged_out.add(hedge_fallback)
                     if _is_failover_error(exc):
                         last_failover_error = exc
                         failover_count += 1
+                        if on_event is not None:
+                            on_event({"type": "reset", "reason": "failover", "model": model})
                         break
                     raise
 
@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+
+def cache_key(payload: Any) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class TTLCache:
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = max(0.0, float(ttl_seconds))
+        self.max_entries = max(1, int(max_entries))
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, expires_at: float | None = None) -> None:
+        if expires_at is None:
+            expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+class TieredCache:
+    # In-process LRU with TTL in front of an optional JSON-file tier that survives restarts.
+    def __init__(self, ttl_seconds: float, max_entries: int, disk_path: str = "", max_disk_entries: int = 0):
+        self.memory = TTLCache(ttl_seconds, max_entries)
+        self.disk_dir = Path(disk_path).expanduser() if str(disk_path or "").strip() else None
+        self.max_disk_entries = max(0, int(max_disk_entries))
+        self._disk_writes = 0
+        self._disk_lock = threading.Lock()
+
+    def _disk_file(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Any | None:
+        value = self.memory.get(key)
+        if value is not None or self.disk_dir is None:
+            return value
+        path = self._disk_file(key)
+        try:
+            payload = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if not isinstance(payload, dict):
+            return None
+        expires_at = float(payload.get("expires_at") or 0)
+        if expires_at <= time.time():
+            path.unlink(missing_ok=True)
+            return None
+        value = payload.get("value")
+        if value is not None:
+            self.memory.set(key, value, expires_at=expires_at)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        expires_at = time.time() + self.memory.ttl_seconds
+        self.memory.set(key, value, expires_at=expires_at)
+        if self.disk_dir is None:
+            return
+        path = self._disk_file(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(json.dumps({"expires_at": expires_at, "value": value}), encoding="utf-8")
+        os.replace(tmp_path, path)
+        with self._disk_lock:
+            self._disk_writes += 1
+            should_prune = self.max_disk_entries > 0 and self._disk_writes % 64 == 0
+        if should_prune:
+            self.prune_disk()
+
+    def prune_disk(self) -> int:
+        if self.disk_dir is None or not self.disk_dir.exists():
+            return 0
+        now = time.time()
+        live: list[tuple[float, Path]] = []
+        removed = 0
+        for path in self.disk_dir.glob("*/*.json"):
+            try:
+                stat = path.stat()
+                expires_at = float(json.loads(path.read_text(encoding="utf-8")).get("expires_at") or 0)
+            except (OSError, ValueError, AttributeError):
+                expires_at = 0.0
+                stat = None
+            if expires_at <= now or stat is None:
+                path.unlink(missing_ok=True)
+                removed += 1
+                continue
+            live.append((stat.st_mtime, path))
+        if self.max_disk_entries and len(live) > self.max_disk_entries:
+            live.sort()
+            for _, path in live[: len(live) - self.max_disk_entries]:
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
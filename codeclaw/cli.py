@@ -1,28 +1,50 @@
 from __future__ import annotations
 
 import argparse
+import json
+import os
 import subprocess
 
-import uvicorn
-
 from codeclaw.config import load_config
-from codeclaw.gateway_client import ws_request_sync
-from codeclaw.doctor import run_doctor
 
 
 def _ws_url(config):
     return f"ws://{config.gateway.host}:{config.gateway.port}/ws"
 
 
+def _http_url(config):
+    return f"http://{config.gateway.host}:{config.gateway.port}"
+
+
+def _ws_request(config, method, params):
+    # Imported per command so subcommands only pay for what they use.
+    from codeclaw.gateway_client import ws_request_sync
+
+    return ws_request_sync(_ws_url(config), method=method, params=params)
+
+
 def cmd_gateway_run(args):
+    import uvicorn
+
     config = load_config(args.config)
-    uvicorn.run("codeclaw.gateway:app", host=config.gateway.host, port=config.gateway.port)
+    if args.config:
+        # Workers build the app themselves and read the config path from the environment.
+        os.environ["CODECLAW_CONFIG"] = args.config
+    workers = max(1, int(args.workers or config.gateway.workers))
+    os.environ["CODECLAW_GATEWAY_WORKERS"] = str(workers)
+    uvicorn.run(
+        "codeclaw.gateway:create_app",
+        factory=True,
+        host=config.gateway.host,
+        port=config.gateway.port,
+        workers=workers,
+    )
 
 
 def cmd_agent_send(args):
     config = load_config(args.config)
-    result = ws_request_sync(
-        _ws_url(config),
+    result = _ws_request(
+        config,
         method="session.send",
         params={
             "agent_id": args.agent,
@@ -30,15 +52,62 @@ def cmd_agent_send(args):
             "message": args.message,
             "channel": "cli",
             "peer": args.peer,
+            "idempotency_key": args.idempotency_key,
         },
     )
     print(result.get("assistant_message", ""))
 
 
+def _read_batch_file(path, agent_id, peer):
+    items = []
+    with open(path, encoding="utf-8") as handle:
+        for line in handle:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"message": item}
+            item.setdefault("agent_id", agent_id)
+            item.setdefault("channel", "cli")
+            item.setdefault("peer", peer)
+            if not item.get("session_id"):
+                # Each prompt without a session runs in its own, so items can overlap.
+                item.setdefault("force_new", True)
+            items.append(item)
+    return items
+
+
+def cmd_agent_send_batch(args):
+    import httpx
+
+    config = load_config(args.config)
+    items = _read_batch_file(args.file, args.agent, args.peer)
+    failed = 0
+    # Results stream back as each item finishes; print them as NDJSON unchanged.
+    with httpx.stream(
+        "POST",
+        f"{_http_url(config)}/api/session/send_batch",
+        json={"requests": items},
+        timeout=httpx.Timeout(connect=10.0, read=None, write=60.0, pool=30.0),
+    ) as response:
+        if response.status_code >= 400:
+            response.read()
+            print(response.text)
+            raise SystemExit(1)
+        for line in response.iter_lines():
+            if not line.strip():
+                continue
+            print(line, flush=True)
+            event = json.loads(line)
+            if event.get("type") == "batch_done":
+                failed = int(event.get("failed") or 0)
+    raise SystemExit(1 if failed else 0)
+
+
 def cmd_sessions_list(args):
     config = load_config(args.config)
-    result = ws_request_sync(
-        _ws_url(config),
+    result = _ws_request(
+        config,
         method="session.list",
         params={"agent_id": args.agent},
     )
@@ -48,8 +117,8 @@ def cmd_sessions_list(args):
 
 def cmd_sessions_view(args):
     config = load_config(args.config)
-    result = ws_request_sync(
-        _ws_url(config),
+    result = _ws_request(
+        config,
         method="session.events",
         params={"agent_id": args.agent, "session_id": args.session},
     )
@@ -60,6 +129,8 @@ def cmd_sessions_view(args):
 
 
 def cmd_doctor(args):
+    from codeclaw.doctor import run_doctor
+
     exit(run_doctor(args.config))
 
 
@@ -77,6 +148,7 @@ def build_parser():
     gateway = sub.add_parser("gateway")
     gateway_sub = gateway.add_subparsers(dest="subcommand")
     gateway_run = gateway_sub.add_parser("run")
+    gateway_run.add_argument("--workers", type=int, default=None)
     gateway_run.set_defaults(func=cmd_gateway_run)
 
     agent = sub.add_parser("agent")
@@ -86,7 +158,13 @@ def build_parser():
     agent_send.add_argument("--message", required=True)
     agent_send.add_argument("--session", default=None)
     agent_send.add_argument("--peer", default="local")
+    agent_send.add_argument("--idempotency-key", default=None)
     agent_send.set_defaults(func=cmd_agent_send)
+    agent_send_batch = agent_sub.add_parser("send-batch")
+    agent_send_batch.add_argument("--agent", required=True)
+    agent_send_batch.add_argument("--file", required=True)
+    agent_send_batch.add_argument("--peer", default="local")
+    agent_send_batch.set_defaults(func=cmd_agent_send_batch)
 
     sessions = sub.add_parser("sessions")
     sessions_sub = sessions.add_subparsers(dest="subcommand")
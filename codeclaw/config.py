@@ -2,7 +2,9 @@ from __future__ import annotations
 
 from pathlib import Path
 import tomllib
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
+
+from codeclaw.tracing import TracingPolicy
 
 
 class GatewayConfig(BaseModel):
@@ -10,6 +12,13 @@ class GatewayConfig(BaseModel):
     port: int = 18789
     token: str = ""
     password: str = ""
+    workers: int = 1
+    event_tail_seconds: float = 0.25
+    ws_max_inflight: int = 8
+    turn_workers: int = 16
+    turn_queue_max: int = 64
+    batch_concurrency: int = 4
+    batch_max_items: int = 1000
 
 
 class AgentConfig(BaseModel):
@@ -19,6 +28,7 @@ class AgentConfig(BaseModel):
     fallback_models: list[str] = Field(default_factory=list)
     provider: str = "openai"
     system_prompt: str = ""
+    response_cache: bool = False
 
 
 class OpenAIConfig(BaseModel):
@@ -36,6 +46,20 @@ class LLMConfig(BaseModel):
     local: LocalConfig | None = None
     request_timeout_seconds: int = 120
     max_retries: int = 2
+    hedge_enabled: bool = False
+    hedge_after_ms: int = 8000
+    hedge_use_p95: bool = False
+
+
+class ModelHealthConfig(BaseModel):
+    enabled: bool = True
+    window: int = 50
+    failure_threshold: int = 3
+    error_rate_threshold: float = 0.5
+    min_samples: int = 10
+    degraded_error_rate: float = 0.25
+    cooldown_seconds: int = 30
+    probe_timeout_seconds: int = 180
 
 
 class LangChainConfig(BaseModel):
@@ -45,6 +69,7 @@ class LangChainConfig(BaseModel):
 class LangSmithConfig(BaseModel):
     api_key: str
     project: str
+    enabled: bool = False
 
 
 class LangGraphConfig(BaseModel):
@@ -62,6 +87,8 @@ class TelegramConfig(BaseModel):
     partial_reply_chunk_chars: int = 240
     partial_reply_delay_seconds: float = 0.08
     max_queue_per_chat: int = 100
+    coalesce_messages: bool = False
+    leader_retry_seconds: float = 5.0
     voice_transcription_enabled: bool = True
     voice_transcription_model: str = "whisper-1"
     voice_max_seconds: int = 180
@@ -77,6 +104,8 @@ class StorageConfig(BaseModel):
 class ToolsConfig(BaseModel):
     approvals_path: str = str(Path.home() / ".codeclaw" / "approvals.json")
     exec_allowlist: list[str] = Field(default_factory=list)
+    result_max_chars: int = 16000
+    result_preview_chars: int = 2000
 
 
 class DoctorConfig(BaseModel):
@@ -89,12 +118,59 @@ class ContextConfig(BaseModel):
     compact_trigger_tokens: int = 8_000
     keep_recent_events: int = 24
     summary_line_limit: int = 120
+    background_summary_enabled: bool = False
+    summary_watermark_ratio: float = 0.6
+    summary_model: str = ""
 
 
 class MemoryConfig(BaseModel):
     enabled: bool = True
     max_search_results: int = 8
     max_snippet_chars: int = 320
+    prefetch_enabled: bool = False
+    prefetch_max_results: int = 3
+    prefetch_min_score: float = 0.5
+    archive_after_days: int = 0
+
+
+class SchedulerConfig(BaseModel):
+    enabled: bool = True
+    max_concurrent_turns: int = 16
+    per_agent_limit: int = 4
+    agent_limits: dict[str, int] = Field(default_factory=dict)
+    provider_limits: dict[str, int] = Field(default_factory=dict)
+    channel_weights: dict[str, float] = Field(default_factory=dict)
+    queue_timeout_seconds: int = 300
+    coalesce_messages: bool = False
+    coalesce_max_messages: int = 5
+
+
+class ResponseCacheConfig(BaseModel):
+    ttl_seconds: int = 600
+    max_entries: int = 256
+    disk_path: str = str(Path.home() / ".codeclaw" / "cache" / "responses")
+    max_disk_entries: int = 2048
+
+
+class WebSearchCacheConfig(BaseModel):
+    enabled: bool = True
+    ttl_seconds: int = 3600
+    max_entries: int = 256
+    disk_path: str = str(Path.home() / ".codeclaw" / "cache" / "web_search")
+    max_disk_entries: int = 1024
+
+
+class IdempotencyConfig(BaseModel):
+    enabled: bool = True
+    ttl_seconds: int = 86400
+    max_entries: int = 1024
+    disk_path: str = str(Path.home() / ".codeclaw" / "cache" / "idempotency")
+    max_disk_entries: int = 10000
+
+
+class JobsConfig(BaseModel):
+    path: str = str(Path.home() / ".codeclaw" / "jobs")
+    retention_days: int = 7
 
 
 class SelfUpdateConfig(BaseModel):
@@ -104,6 +180,16 @@ class SelfUpdateConfig(BaseModel):
 
 class ObservabilityConfig(BaseModel):
     log_turn_metrics: bool = True
+    tracing: str = "off"
+    trace_dir: str = str(Path.home() / ".codeclaw" / "traces")
+    trace_batch_size: int = 50
+    trace_flush_seconds: float = 5.0
+
+    @field_validator("tracing")
+    @classmethod
+    def _valid_tracing_policy(cls, value: str) -> str:
+        TracingPolicy.parse(value)
+        return value
 
 
 class AppConfig(BaseModel):
@@ -119,6 +205,12 @@ class AppConfig(BaseModel):
     doctor: DoctorConfig = DoctorConfig()
     context: ContextConfig = ContextConfig()
     memory: MemoryConfig = MemoryConfig()
+    response_cache: ResponseCacheConfig = ResponseCacheConfig()
+    web_search_cache: WebSearchCacheConfig = WebSearchCacheConfig()
+    idempotency: IdempotencyConfig = IdempotencyConfig()
+    jobs: JobsConfig = JobsConfig()
+    model_health: ModelHealthConfig = ModelHealthConfig()
+    scheduler: SchedulerConfig = SchedulerConfig()
     self_update: SelfUpdateConfig = SelfUpdateConfig()
     observability: ObservabilityConfig = ObservabilityConfig()
 
@@ -1,19 +1,30 @@
 from __future__ import annotations
 
-from contextlib import asynccontextmanager
+import asyncio
+from contextlib import asynccontextmanager, nullcontext
+from dataclasses import dataclass
+import gzip
+import hashlib
 import json
 import logging
 import os
 import time
-from typing import Any
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 
-from codeclaw.agent import AgentRuntime
+from codeclaw.agent import AgentRuntime, TurnEventCallback, TurnEventStream
 from codeclaw.config import AppConfig, load_config
+from codeclaw import metrics as prom
+from codeclaw.hub import SessionEventHub
+from codeclaw.idempotency import IdempotencyConflict, IdempotencyStore
+from codeclaw.jobs import TERMINAL_STATUSES, JobStore
+from codeclaw.scheduler import AdmissionQueue, AdmissionRejected, SessionTurnCoordinator, TurnScheduler
 from codeclaw.storage import SessionStore
-from codeclaw.telegram import get_active_poller_status, start_poller_in_background, stop_active_poller
+from codeclaw.telegram import PollerLeader, get_active_poller_status, stop_active_poller
+from codeclaw.tracing import TurnTrace, export_trace
 
 log = logging.getLogger(__name__)
 
@@ -27,16 +38,108 @@ class SendRequest(BaseModel):
     peer: str = "local"
     queue_depth: int | None = None
     stream_partial: bool = False
+    idempotency_key: str | None = None
+
+
+class SendBatchRequest(BaseModel):
+    # Items are validated one by one so a malformed entry fails alone.
+    requests: list[Any]
+
+
+@dataclass
+class _GatewayTurns:
+    # Turn coordination only the gateway needs: fair scheduling of turn slots,
+    # per-session ordering (and coalescing), and idempotent send results.
+    scheduler: TurnScheduler
+    session_turns: SessionTurnCoordinator
+    idempotency: IdempotencyStore
+
+    @classmethod
+    def from_config(cls, config: AppConfig) -> _GatewayTurns:
+        return cls(
+            scheduler=TurnScheduler(config.scheduler),
+            session_turns=SessionTurnCoordinator(
+                coalesce=config.scheduler.coalesce_messages,
+                max_batch=config.scheduler.coalesce_max_messages,
+            ),
+            idempotency=IdempotencyStore(config.idempotency),
+        )
 
 
 def _load_app_config() -> AppConfig:
     return load_config(os.environ.get("CODECLAW_CONFIG"))
 
 
+def _gateway_workers(config: AppConfig) -> int:
+    # `gateway run --workers N` reaches the worker processes through the environment.
+    return max(1, int(os.environ.get("CODECLAW_GATEWAY_WORKERS") or config.gateway.workers))
+
+
+def _per_worker_config(config: AppConfig, workers: int) -> AppConfig:
+    # Admission and scheduler limits are enforced inside each worker, so every worker
+    # gets an equal share and the configured values stay gateway-wide totals.
+    if workers <= 1:
+        return config
+
+    def share(value: int, floor: int = 1) -> int:
+        return max(floor, -(-int(value) // workers))
+
+    config = config.model_copy(deep=True)
+    config.gateway.turn_workers = share(config.gateway.turn_workers)
+    config.gateway.turn_queue_max = share(config.gateway.turn_queue_max, floor=0)
+    scheduler = config.scheduler
+    scheduler.max_concurrent_turns = share(scheduler.max_concurrent_turns)
+    scheduler.per_agent_limit = share(scheduler.per_agent_limit)
+    scheduler.agent_limits = {key: share(value) for key, value in scheduler.agent_limits.items()}
+    scheduler.provider_limits = {key: share(value) for key, value in scheduler.provider_limits.items()}
+    return config
+
+
 def _error_payload(exc: Exception) -> dict[str, Any]:
     return {"ok": False, "error": f"{exc.__class__.__name__}: {exc}"}
 
 
+def _record_admission_rejected(exc: AdmissionRejected, req: SendRequest, transport: str) -> None:
+    prom.ADMISSION_REJECTED.inc()
+    log.warning(
+        "gateway %s send rejected agent_id=%s channel=%s retry_after=%s", transport, req.agent_id, req.channel, exc.retry_after
+    )
+
+
+def _admission_rejected_response(exc: AdmissionRejected, req: SendRequest) -> JSONResponse:
+    _record_admission_rejected(exc, req, "http")
+    return JSONResponse(
+        {"ok": False, "error": str(exc), "retry_after": exc.retry_after},
+        status_code=429,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+_GZIP_MIN_BYTES = 1024
+
+
+def _etag(*parts: str) -> str:
+    return '"' + hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match", "")
+    return any(candidate.strip() in {etag, "*"} for candidate in header.split(",") if candidate.strip())
+
+
+def _cached_json_response(request: Request, etag: str, payload: dict[str, Any] | None) -> Response:
+    # Conditional GET: an unchanged resource (payload None, not read) is an empty 304.
+    # Large bodies are gzip-compressed when the client accepts it.
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if payload is None:
+        return Response(status_code=304, headers=headers)
+    body = json.dumps(payload).encode("utf-8")
+    if len(body) >= _GZIP_MIN_BYTES and "gzip" in request.headers.get("accept-encoding", "").lower():
+        body = gzip.compress(body, compresslevel=5)
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
 def _agent_runtime_meta(config: AppConfig, agent_id: str) -> dict[str, str]:
     for agent in config.agents:
         if agent.id == agent_id:
@@ -63,6 +166,29 @@ def _append_turn_events(
     plan: Any,
     metrics: dict[str, Any],
     queue_depth: int | None = None,
+    trace: TurnTrace | None = None,
+) -> None:
+    with trace.span("persist_events") if trace is not None else nullcontext():
+        _append_conversation_events(store, config, agent_id, session_id, channel, message, assistant, plan, queue_depth)
+    if trace is not None:
+        # The metrics event is written last so it can carry the complete trace.
+        finished = trace.finish()
+        metrics["spans"] = finished.get("children", [])
+        export_trace(finished)
+    if metrics:
+        store.append_event(agent_id, session_id, {"role": "metrics", "content": metrics})
+
+
+def _append_conversation_events(
+    store: SessionStore,
+    config: AppConfig,
+    agent_id: str,
+    session_id: str,
+    channel: str,
+    message: str,
+    assistant: str,
+    plan: Any,
+    queue_depth: int | None,
 ) -> None:
     runtime_meta = _agent_runtime_meta(config, agent_id)
     store.append_event(agent_id, session_id, {"role": "user", "content": message})
@@ -85,26 +211,264 @@ def _append_turn_events(
     store.append_event(agent_id, session_id, {"role": "assistant", "content": assistant})
     if isinstance(plan, list):
         store.append_event(agent_id, session_id, {"role": "plan", "content": plan})
-    if metrics:
-        store.append_event(agent_id, session_id, {"role": "metrics", "content": metrics})
+
+
+def _send_request_from_params(params: dict) -> SendRequest:
+    queue_depth = params.get("queue_depth")
+    return SendRequest(
+        agent_id=params.get("agent_id"),
+        message=params.get("message", ""),
+        session_id=params.get("session_id"),
+        force_new=bool(params.get("force_new", False)),
+        channel=params.get("channel", "cli"),
+        peer=params.get("peer", "local"),
+        queue_depth=int(queue_depth) if isinstance(queue_depth, int) else None,
+        stream_partial=bool(params.get("stream_partial", False)),
+        idempotency_key=params.get("idempotency_key") or None,
+    )
+
+
+def _coalesce_messages(messages: list[str]) -> str:
+    return "\n\n".join(message for message in messages if message.strip()) or (messages[0] if messages else "")
+
+
+def _execute_send(
+    store: SessionStore,
+    runtime: AgentRuntime,
+    turns: _GatewayTurns,
+    config: AppConfig,
+    req: SendRequest,
+    on_event: TurnEventCallback | None = None,
+    transport: str = "http",
+) -> dict[str, Any]:
+    if not req.idempotency_key or not config.idempotency.enabled:
+        return _execute_send_turn(store, runtime, turns, config, req, on_event, transport)
+    key = turns.idempotency.key(req.agent_id, req.idempotency_key)
+    # Delivery options (streaming, queue depth) do not change what the turn does.
+    fingerprint = turns.idempotency.fingerprint(
+        req.model_dump(include={"agent_id", "message", "session_id", "force_new", "channel", "peer"})
+    )
+    result, replayed = turns.idempotency.run(
+        key, lambda: _execute_send_turn(store, runtime, turns, config, req, on_event, transport), fingerprint
+    )
+    if not replayed:
+        return result
+    log.info("gateway %s idempotent replay agent=%s session=%s", transport, req.agent_id, result.get("session_id"))
+    if on_event is not None:
+        on_event({"type": "session", "session_id": result.get("session_id")})
+    return {**result, "idempotent_replay": True}
+
+
+def _execute_send_turn(
+    store: SessionStore,
+    runtime: AgentRuntime,
+    turns: _GatewayTurns,
+    config: AppConfig,
+    req: SendRequest,
+    on_event: TurnEventCallback | None,
+    transport: str,
+) -> dict[str, Any]:
+    started = time.perf_counter()
+    trace = TurnTrace("gateway.send", agent_id=req.agent_id, channel=req.channel, transport=transport)
+    try:
+        with trace.span("session_resolve"):
+            session = _get_or_create_session(
+                store,
+                req.agent_id,
+                req.channel,
+                req.peer,
+                req.session_id,
+                req.message,
+                force_new=req.force_new,
+            )
+        trace.root.set(session_id=session["id"])
+        if on_event is not None:
+            on_event({"type": "session", "session_id": session["id"]})
+    except Exception as exc:
+        export_trace(trace.finish(error=f"{exc.__class__.__name__}: {exc}"))
+        raise
+    resolved = time.perf_counter()
+
+    def run_session_turn(messages: list[str]) -> dict[str, Any]:
+        session_wait_ms = int((time.perf_counter() - resolved) * 1000)
+        message = _coalesce_messages(messages)
+        provider = _agent_runtime_meta(config, req.agent_id)["provider"]
+        try:
+            with trace.span("queue_wait") as span:
+                ticket = turns.scheduler.acquire(req.agent_id, provider, req.channel, req.peer)
+                span.set(queue_wait_ms=ticket.queue_wait_ms, session_wait_ms=session_wait_ms)
+            try:
+                with trace.span("run_turn"):
+                    turn = runtime.run_turn(
+                        req.agent_id, session["id"], message, req.channel, interactive=False, on_event=on_event, trace=trace
+                    )
+            finally:
+                turns.scheduler.release(ticket)
+        except Exception as exc:
+            export_trace(trace.finish(error=f"{exc.__class__.__name__}: {exc}"))
+            raise
+        assistant = str(turn.get("assistant_message", ""))
+        plan = turn.get("plan", [])
+        metrics = dict(turn.get("metrics", {}))
+        metrics["gateway_duration_ms"] = int((time.perf_counter() - started) * 1000)
+        metrics["queue_wait_ms"] = ticket.queue_wait_ms
+        metrics["session_wait_ms"] = session_wait_ms
+        if len(messages) > 1:
+            metrics["coalesced_messages"] = len(messages)
+        prom.record_turn(req.agent_id, transport, metrics)
+        _append_turn_events(
+            store=store,
+            config=config,
+            agent_id=req.agent_id,
+            session_id=session["id"],
+            channel=req.channel,
+            message=message,
+            assistant=assistant,
+            plan=plan,
+            metrics=metrics,
+            queue_depth=req.queue_depth,
+            trace=trace,
+        )
+        if config.observability.log_turn_metrics:
+            log.info(
+                "gateway %s turn agent=%s session=%s duration_ms=%s queue_wait_ms=%s session_wait_ms=%s queue_depth=%s",
+                transport,
+                req.agent_id,
+                session["id"],
+                metrics["gateway_duration_ms"],
+                metrics["queue_wait_ms"],
+                session_wait_ms,
+                req.queue_depth,
+            )
+        return {"session_id": session["id"], "assistant_message": assistant, "plan": plan, "metrics": metrics}
+
+    ran_turn = False
+
+    def run_locked_turn(messages: list[str]) -> dict[str, Any]:
+        nonlocal ran_turn
+        ran_turn = True
+        # The in-process coordinator orders turns within this worker; the session file
+        # lock extends that to other gateway workers sharing the same storage.
+        with store.session_turn_lock(req.agent_id, session["id"]):
+            return run_session_turn(messages)
+
+    # Serialize turns per session so concurrent sends never read the same history or
+    # interleave their transcript writes; a caller merged into another turn gets its
+    # result. Streaming callers are never merged, since only the running turn emits events.
+    try:
+        return turns.session_turns.run(
+            (req.agent_id, session["id"]), req.message, run_locked_turn, coalescible=on_event is None
+        )
+    finally:
+        if not ran_turn:
+            export_trace(trace.finish(coalesced=True))
+
+
+def _run_job(
+    jobs: JobStore,
+    store: SessionStore,
+    runtime: AgentRuntime,
+    turns: _GatewayTurns,
+    config: AppConfig,
+    job_id: str,
+    req: SendRequest,
+) -> None:
+    jobs.mark_running(job_id)
+    try:
+        result = _execute_send(
+            store, runtime, turns, config, req, on_event=lambda event: jobs.record_event(job_id, event), transport="job"
+        )
+    except Exception as exc:
+        log.warning("gateway job failed job=%s agent_id=%s err=%s", job_id, req.agent_id, exc)
+        jobs.finish(job_id, error=f"{exc.__class__.__name__}: {exc}")
+        return
+    jobs.finish(job_id, result=result)
+
+
+async def _batch_ndjson_lines(
+    items: list[Any],
+    run_item: Callable[[SendRequest], Awaitable[dict[str, Any]]],
+    concurrency: int,
+) -> AsyncIterator[str]:
+    # One line per item in completion order (tagged with its index), then a summary line.
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(index: int, raw: Any) -> dict[str, Any]:
+        async with semaphore:
+            try:
+                if not isinstance(raw, dict):
+                    raise ValueError("batch item must be an object")
+                raw = {**raw, "stream_partial": False}
+                if not raw.get("session_id"):
+                    # Unless told otherwise, items without a session each get a new one
+                    # rather than all resolving to (and queueing on) the peer's latest.
+                    raw.setdefault("force_new", True)
+                req = SendRequest.model_validate(raw)
+                return {"type": "item", "index": index, "ok": True, **(await run_item(req))}
+            except Exception as exc:
+                return {"type": "item", "index": index, **_error_payload(exc)}
+
+    tasks = [asyncio.create_task(run(index, raw)) for index, raw in enumerate(items)]
+    succeeded = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            line = await next_done
+            succeeded += 1 if line.get("ok") else 0
+            yield json.dumps(line) + "\n"
+    finally:
+        for task in tasks:
+            task.cancel()
+    yield json.dumps({"type": "batch_done", "total": len(items), "succeeded": succeeded, "failed": len(items) - succeeded}) + "\n"
+
+
+def _ndjson_lines(events: Iterator[dict[str, Any]]) -> Iterator[str]:
+    for event in events:
+        if event.get("type") == "result":
+            event = {**event, "ok": True}
+        elif event.get("type") == "error":
+            event = {**event, "ok": False}
+        yield json.dumps(event) + "\n"
 
 
 def create_app() -> FastAPI:
     config = _load_app_config()
+    workers = _gateway_workers(config)
+    config = _per_worker_config(config, workers)
     store = SessionStore(config.storage)
     runtime = AgentRuntime(config, store)
+    turns = _GatewayTurns.from_config(config)
+    admission = AdmissionQueue(config.gateway.turn_workers, config.gateway.turn_queue_max, turns.scheduler)
+    hub = SessionEventHub()
+    if workers > 1:
+        # Turns in other workers append to the same transcripts; follow the files.
+        hub.tail(store, config.gateway.event_tail_seconds)
+    else:
+        store.add_listener(hub.publish)
+    # A scrape reaches whichever worker accepts it; label samples with that worker
+    # so its counters and histograms never appear to reset.
+    prom.REGISTRY.set_const_labels(**({"worker": os.getpid()} if workers > 1 else {}))
+    poller_leader = PollerLeader(config)
+    jobs = JobStore(config.jobs)
+    interrupted = jobs.recover()
+    if interrupted:
+        log.warning("gateway startup: marked %s unfinished jobs as interrupted", interrupted)
+    jobs.prune()
 
     @asynccontextmanager
     async def lifespan(_app: FastAPI):
         if _telegram_should_run(config):
-            start_poller_in_background(config)
-            log.info("gateway startup: integrated telegram poller enabled")
+            poller_leader.start()
+            log.info("gateway startup: integrated telegram poller enabled (leader election pid=%s)", os.getpid())
         else:
             log.info("gateway startup: integrated telegram poller disabled")
         try:
             yield
         finally:
+            poller_leader.stop()
             stop_active_poller()
+            admission.shutdown()
+            hub.stop()
+            jobs.close()
 
     app = FastAPI(lifespan=lifespan)
 
@@ -125,63 +489,115 @@ def create_app() -> FastAPI:
             "gateway": {
                 "host": config.gateway.host,
                 "port": config.gateway.port,
+                "pid": os.getpid(),
+                "workers": workers,
                 "telegram_integrated": _telegram_should_run(config),
+                "telegram_leader": poller_leader.status(),
             },
+            "models": runtime.health.snapshot(),
+            "memory_prefetch": runtime.memory_prefetch_stats(),
+            "scheduler": turns.scheduler.snapshot(),
+            "session_turns": turns.session_turns.snapshot(),
+            "idempotency": turns.idempotency.snapshot(),
+            "admission": admission.snapshot(),
+            "subscriptions": hub.snapshot(),
+            "jobs": jobs.snapshot(),
         }
 
+    @app.get("/metrics")
+    def metrics_endpoint():
+        # Point-in-time gauges are sampled at scrape; counters and histograms are
+        # aggregated in-process as turns complete.
+        admission_state = admission.snapshot()
+        prom.ADMISSION_QUEUED.set(admission_state["queued"])
+        prom.ADMISSION_RUNNING.set(admission_state["running"])
+        scheduler_state = turns.scheduler.snapshot()
+        prom.SCHEDULER_QUEUED.set(scheduler_state["queued"])
+        prom.SCHEDULER_RUNNING.set(scheduler_state["running"])
+        workers = (get_active_poller_status().get("dispatcher") or {}).get("workers") or []
+        prom.TELEGRAM_QUEUE_DEPTH.replace({(str(worker.get("chat_id")),): worker.get("queue_depth", 0) for worker in workers})
+        return Response(content=prom.REGISTRY.render(), media_type=prom.CONTENT_TYPE)
+
     @app.post("/api/session/send")
-    def session_send(req: SendRequest):
+    async def session_send(req: SendRequest):
         try:
-            started = time.perf_counter()
-            session = _get_or_create_session(
-                store,
-                req.agent_id,
-                req.channel,
-                req.peer,
-                req.session_id,
-                req.message,
-                force_new=req.force_new,
-            )
-            turn = runtime.run_turn(req.agent_id, session["id"], req.message, req.channel, interactive=False)
-            assistant = str(turn.get("assistant_message", ""))
-            plan = turn.get("plan", [])
-            metrics = dict(turn.get("metrics", {}))
-            metrics["gateway_duration_ms"] = int((time.perf_counter() - started) * 1000)
-            _append_turn_events(
-                store=store,
-                config=config,
-                agent_id=req.agent_id,
-                session_id=session["id"],
-                channel=req.channel,
-                message=req.message,
-                assistant=assistant,
-                plan=plan,
-                metrics=metrics,
-                queue_depth=req.queue_depth,
-            )
-            if config.observability.log_turn_metrics:
-                log.info(
-                    "gateway turn agent=%s session=%s duration_ms=%s queue_depth=%s",
-                    req.agent_id,
-                    session["id"],
-                    metrics["gateway_duration_ms"],
-                    req.queue_depth,
+            if req.stream_partial:
+                stream = TurnEventStream()
+                admission.submit(
+                    stream.run, lambda on_event: _execute_send(store, runtime, turns, config, req, on_event=on_event)
                 )
-            return {"ok": True, "session_id": session["id"], "assistant_message": assistant, "plan": plan, "metrics": metrics}
+                return StreamingResponse(_ndjson_lines(iter(stream)), media_type="application/x-ndjson")
+            future = admission.submit(_execute_send, store, runtime, turns, config, req)
+        except AdmissionRejected as exc:
+            return _admission_rejected_response(exc, req)
+        try:
+            return {"ok": True, **(await asyncio.wrap_future(future))}
+        except IdempotencyConflict as exc:
+            return JSONResponse(_error_payload(exc), status_code=409)
         except Exception as exc:
             return _error_payload(exc)
 
+    async def run_batch_item(req: SendRequest) -> dict[str, Any]:
+        # Batch items take the same admission queue as single sends, but wait out a
+        # full queue instead of failing the item.
+        while True:
+            try:
+                future = admission.submit(_execute_send, store, runtime, turns, config, req, None, "batch")
+            except AdmissionRejected as exc:
+                await asyncio.sleep(min(float(exc.retry_after), 5.0))
+                continue
+            return await asyncio.wrap_future(future)
+
+    @app.post("/api/session/send_batch")
+    async def session_send_batch(batch: SendBatchRequest):
+        max_items = max(1, int(config.gateway.batch_max_items))
+        if len(batch.requests) > max_items:
+            return JSONResponse({"ok": False, "error": f"batch has {len(batch.requests)} items; limit is {max_items}"}, status_code=413)
+        return StreamingResponse(
+            _batch_ndjson_lines(batch.requests, run_batch_item, config.gateway.batch_concurrency),
+            media_type="application/x-ndjson",
+        )
+
+    @app.post("/api/jobs")
+    def job_create(req: SendRequest):
+        # Fire-and-forget variant of session send: answer with the job id right away
+        # and let the client poll GET /api/jobs/{id} or subscribe over WS.
+        job = jobs.create(req.model_dump(exclude={"stream_partial"}))
+        try:
+            admission.submit(_run_job, jobs, store, runtime, turns, config, job["id"], req)
+        except AdmissionRejected as exc:
+            jobs.discard(job["id"])
+            return _admission_rejected_response(exc, req)
+        return JSONResponse({"ok": True, "job": job}, status_code=202)
+
+    @app.get("/api/jobs/{job_id}")
+    def job_get(job_id: str):
+        job = jobs.get(job_id)
+        if job is None:
+            return JSONResponse({"ok": False, "error": f"job not found: {job_id}"}, status_code=404)
+        return {"ok": True, "job": job}
+
     @app.get("/api/session/list")
-    def session_list(agent_id: str):
+    def session_list(request: Request, agent_id: str):
         try:
-            return {"ok": True, "sessions": store.list_sessions(agent_id)}
+            generation, sessions = store.sessions_snapshot(
+                agent_id, unchanged=lambda generation: _etag_matches(request, _etag("sessions", agent_id, generation))
+            )
+            payload = None if sessions is None else {"ok": True, "sessions": sessions}
+            return _cached_json_response(request, _etag("sessions", agent_id, generation), payload)
         except Exception as exc:
             return _error_payload(exc)
 
     @app.get("/api/session/events")
-    def session_events(agent_id: str, session_id: str):
+    def session_events(request: Request, agent_id: str, session_id: str):
         try:
-            return {"ok": True, "events": store.read_events(agent_id, session_id)}
+            generation, events = store.events_snapshot(
+                agent_id,
+                session_id,
+                unchanged=lambda generation: _etag_matches(request, _etag("events", agent_id, session_id, generation)),
+            )
+            payload = None if events is None else {"ok": True, "events": events}
+            return _cached_json_response(request, _etag("events", agent_id, session_id, generation), payload)
         except Exception as exc:
             return _error_payload(exc)
 
@@ -189,37 +605,225 @@ def create_app() -> FastAPI:
     async def ws_endpoint(ws: WebSocket):
         await ws.accept()
         authed = False
+        send_lock = asyncio.Lock()
+        inflight: dict[Any, asyncio.Task] = {}
+        max_inflight = max(1, int(config.gateway.ws_max_inflight))
+
+        async def send(payload: dict[str, Any]) -> None:
+            async with send_lock:
+                await ws.send_text(json.dumps(payload))
+
+        subscriptions = _WsSubscriptions(hub, store, send)
+        job_subscriptions = _WsJobSubscriptions(jobs, send)
         try:
             while True:
                 raw = await ws.receive_text()
                 frame = json.loads(raw)
                 if frame.get("type") != "req":
-                    await ws.send_text(json.dumps({"type": "res", "id": frame.get("id"), "error": {"message": "invalid frame"}}))
+                    await send({"type": "res", "id": frame.get("id"), "error": {"message": "invalid frame"}})
                     continue
                 method = frame.get("method")
                 params = frame.get("params", {})
                 req_id = frame.get("id")
                 if method == "connect":
                     authed = True
-                    await ws.send_text(json.dumps({"type": "res", "id": req_id, "result": {"ok": True, "server_info": {"name": "codeclaw-lite"}}}))
+                    await send({"type": "res", "id": req_id, "result": {"ok": True, "server_info": {"name": "codeclaw-lite"}}})
                     continue
                 if not authed:
-                    await ws.send_text(json.dumps({"type": "res", "id": req_id, "error": {"message": "not connected"}}))
+                    await send({"type": "res", "id": req_id, "error": {"message": "not connected"}})
                     continue
-                try:
-                    result = _handle_ws_request(method, params, store, runtime, config)
-                except Exception as exc:
-                    await ws.send_text(json.dumps({"type": "res", "id": req_id, "error": {"message": f"{exc.__class__.__name__}: {exc}"}}))
+                if method == "session.subscribe":
+                    await subscriptions.subscribe(req_id, params)
                     continue
-                await ws.send_text(json.dumps({"type": "res", "id": req_id, "result": result}))
-                if method == "session.send" and result.get("session_id"):
-                    await ws.send_text(json.dumps({"type": "event", "method": "session.update", "params": {"session_id": result.get("session_id")}}))
+                if method == "session.unsubscribe":
+                    await subscriptions.unsubscribe(req_id, params)
+                    continue
+                if method == "job.subscribe":
+                    await job_subscriptions.subscribe(req_id, params)
+                    continue
+                if method == "job.unsubscribe":
+                    await job_subscriptions.unsubscribe(req_id, params)
+                    continue
+                if len(inflight) >= max_inflight:
+                    await send(
+                        {"type": "res", "id": req_id, "error": {"message": f"too many in-flight requests (limit {max_inflight})"}}
+                    )
+                    continue
+                # Each request runs as its own task so slow turns never block this reader;
+                # responses go out in completion order, matched by id.
+                task = asyncio.create_task(
+                    _dispatch_ws_request(send, req_id, method, params, admission, store, runtime, turns, config)
+                )
+                key = object()
+                inflight[key] = task
+                task.add_done_callback(lambda _task, key=key: inflight.pop(key, None))
         except WebSocketDisconnect:
             return
+        finally:
+            subscriptions.close()
+            job_subscriptions.close()
+            for task in list(inflight.values()):
+                task.cancel()
 
     return app
 
 
+class _WsSubscriptions:
+    # session.subscribe state for one WS connection. Events pushed while the backlog
+    # reply is being built are held back, then de-duplicated against it by seq.
+    def __init__(self, hub: SessionEventHub, store: SessionStore, send: Callable[[dict[str, Any]], Awaitable[None]]):
+        self.hub = hub
+        self.store = store
+        self.send = send
+        self.loop = asyncio.get_running_loop()
+        self.active: dict[int, dict[str, Any]] = {}
+        self._pushes: set[asyncio.Task] = set()
+
+    async def subscribe(self, req_id: Any, params: dict) -> None:
+        agent_id = str(params.get("agent_id") or "")
+        session_id = str(params.get("session_id") or "")
+        if not agent_id or not session_id:
+            await self.send({"type": "res", "id": req_id, "error": {"message": "agent_id and session_id are required"}})
+            return
+        state: dict[str, Any] = {"agent_id": agent_id, "session_id": session_id, "last_seq": None, "pending": []}
+        state["id"] = await asyncio.to_thread(
+            self.hub.subscribe,
+            agent_id,
+            session_id,
+            lambda event: self.loop.call_soon_threadsafe(self._push, state, event),
+        )
+        self.active[state["id"]] = state
+        try:
+            events = await asyncio.to_thread(self.store.read_events, agent_id, session_id)
+        except Exception as exc:
+            self._drop(state["id"])
+            await self.send({"type": "res", "id": req_id, "error": {"message": f"{exc.__class__.__name__}: {exc}"}})
+            return
+        last_seq = max((int(event.get("seq") or 0) for event in events), default=0)
+        since = params.get("since_seq")
+        backlog = [] if since is None else [event for event in events if int(event.get("seq") or 0) > int(since)]
+        await self.send(
+            {"type": "res", "id": req_id, "result": {"subscription": state["id"], "seq": last_seq, "events": backlog}}
+        )
+        state["last_seq"] = last_seq
+        pending, state["pending"] = state["pending"], []
+        for event in pending:
+            self._push(state, event)
+
+    async def unsubscribe(self, req_id: Any, params: dict) -> None:
+        try:
+            removed = self._drop(int(params.get("subscription")))
+        except (TypeError, ValueError):
+            removed = False
+        await self.send({"type": "res", "id": req_id, "result": {"ok": removed}})
+
+    def _drop(self, sub_id: int) -> bool:
+        if self.active.pop(sub_id, None) is None:
+            return False
+        self.hub.unsubscribe(sub_id)
+        return True
+
+    def _push(self, state: dict[str, Any], event: dict[str, Any]) -> None:
+        # Events pushed before subscribe() returned are already in the backlog read.
+        if state.get("id") not in self.active:
+            return
+        if state["last_seq"] is None:
+            state["pending"].append(event)
+            return
+        seq = int(event.get("seq") or 0)
+        if seq <= state["last_seq"]:
+            return
+        state["last_seq"] = seq
+        task = self.loop.create_task(self._send_event(state, event))
+        self._pushes.add(task)
+        task.add_done_callback(self._pushes.discard)
+
+    async def _send_event(self, state: dict[str, Any], event: dict[str, Any]) -> None:
+        params = {"subscription": state["id"], "agent_id": state["agent_id"], "session_id": state["session_id"], "event": event}
+        try:
+            await self.send({"type": "event", "method": "session.event", "params": params})
+        except (WebSocketDisconnect, RuntimeError):
+            self.close()
+
+    def close(self) -> None:
+        for sub_id in list(self.active):
+            self._drop(sub_id)
+        for task in list(self._pushes):
+            task.cancel()
+
+
+class _WsJobSubscriptions:
+    # job.subscribe state for one WS connection. Updates only flow from jobs running
+    # in this worker; a job owned by another worker is reported with live=false.
+    def __init__(self, jobs: JobStore, send: Callable[[dict[str, Any]], Awaitable[None]]):
+        self.jobs = jobs
+        self.send = send
+        self.loop = asyncio.get_running_loop()
+        self.active: dict[int, dict[str, Any]] = {}
+        self._pushes: set[asyncio.Task] = set()
+
+    async def subscribe(self, req_id: Any, params: dict) -> None:
+        job_id = str(params.get("job_id") or "")
+        state: dict[str, Any] = {"job_id": job_id, "ready": False, "pending": []}
+        state["id"] = self.jobs.subscribe(job_id, lambda event: self.loop.call_soon_threadsafe(self._push, state, event))
+        self.active[state["id"]] = state
+        job = await asyncio.to_thread(self.jobs.get, job_id)
+        if job is None:
+            self._drop(state["id"])
+            await self.send({"type": "res", "id": req_id, "error": {"message": f"job not found: {job_id}"}})
+            return
+        live = job["status"] not in TERMINAL_STATUSES and self.jobs.is_local(job_id)
+        if not live:
+            self._drop(state["id"])
+        await self.send(
+            {"type": "res", "id": req_id, "result": {"subscription": state["id"] if live else None, "live": live, "job": job}}
+        )
+        state["ready"] = True
+        pending, state["pending"] = state["pending"], []
+        for event in pending:
+            self._push(state, event)
+
+    async def unsubscribe(self, req_id: Any, params: dict) -> None:
+        try:
+            removed = self._drop(int(params.get("subscription")))
+        except (TypeError, ValueError):
+            removed = False
+        await self.send({"type": "res", "id": req_id, "result": {"ok": removed}})
+
+    def _drop(self, sub_id: int) -> bool:
+        if self.active.pop(sub_id, None) is None:
+            return False
+        self.jobs.unsubscribe(sub_id)
+        return True
+
+    def _push(self, state: dict[str, Any], event: dict[str, Any]) -> None:
+        # Events pushed before subscribe() returned are already in the backlog read.
+        if state.get("id") not in self.active:
+            return
+        if not state["ready"]:
+            state["pending"].append(event)
+            return
+        if event.get("type") == "job" and event["job"].get("status") in TERMINAL_STATUSES:
+            # The final state is the last update a job produces.
+            self._drop(state["id"])
+        params = {"subscription": state["id"], "job_id": state["job_id"], **event}
+        task = self.loop.create_task(self._send_event(params))
+        self._pushes.add(task)
+        task.add_done_callback(self._pushes.discard)
+
+    async def _send_event(self, params: dict[str, Any]) -> None:
+        try:
+            await self.send({"type": "event", "method": "job.event", "params": params})
+        except (WebSocketDisconnect, RuntimeError):
+            self.close()
+
+    def close(self) -> None:
+        for sub_id in list(self.active):
+            self._drop(sub_id)
+        for task in list(self._pushes):
+            task.cancel()
+
+
 def _get_or_create_session(
     store: SessionStore,
     agent_id: str,
@@ -239,6 +843,76 @@ def _get_or_create_session(
     return store.create_session(agent_id, channel, peer, first_message[:80])
 
 
+async def _dispatch_ws_request(
+    send: Callable[[dict[str, Any]], Awaitable[None]],
+    req_id: Any,
+    method: str,
+    params: dict,
+    admission: AdmissionQueue,
+    store: SessionStore,
+    runtime: AgentRuntime,
+    turns: _GatewayTurns,
+    config: AppConfig,
+) -> None:
+    try:
+        try:
+            if method == "session.send":
+                # Turns take the same admission queue as HTTP sends; only the cheap
+                # read methods below run on the loop's default executor.
+                req = _send_request_from_params(params)
+                if req.stream_partial:
+                    result = await _stream_ws_send(send, req_id, req, admission, store, runtime, turns, config)
+                else:
+                    future = admission.submit(_execute_send, store, runtime, turns, config, req, None, "ws")
+                    result = await asyncio.wrap_future(future)
+            else:
+                result = await asyncio.to_thread(_handle_ws_request, method, params, store, runtime, config)
+        except AdmissionRejected as exc:
+            _record_admission_rejected(exc, req, "ws")
+            await send({"type": "res", "id": req_id, "error": {"message": str(exc), "retry_after": exc.retry_after}})
+            return
+        except Exception as exc:
+            await send({"type": "res", "id": req_id, "error": {"message": f"{exc.__class__.__name__}: {exc}"}})
+            return
+        await send({"type": "res", "id": req_id, "result": result})
+        if method == "session.send" and result.get("session_id"):
+            await send({"type": "event", "method": "session.update", "params": {"session_id": result.get("session_id")}})
+    except (WebSocketDisconnect, RuntimeError) as exc:
+        log.info("ws response dropped id=%s method=%s err=%s", req_id, method, exc)
+
+
+async def _stream_ws_send(
+    send: Callable[[dict[str, Any]], Awaitable[None]],
+    req_id: Any,
+    req: SendRequest,
+    admission: AdmissionQueue,
+    store: SessionStore,
+    runtime: AgentRuntime,
+    turns: _GatewayTurns,
+    config: AppConfig,
+) -> dict:
+    loop = asyncio.get_running_loop()
+    pending: asyncio.Queue[dict[str, Any] | None] = asyncio.Queue()
+
+    def forward(event: dict[str, Any]) -> None:
+        loop.call_soon_threadsafe(pending.put_nowait, event)
+
+    async def pump() -> None:
+        while True:
+            event = await pending.get()
+            if event is None:
+                return
+            await send({"type": "event", "method": "session.stream", "params": {"request_id": req_id, **event}})
+
+    future = admission.submit(_execute_send, store, runtime, turns, config, req, forward, "ws")
+    pumper = asyncio.create_task(pump())
+    try:
+        return await asyncio.wrap_future(future)
+    finally:
+        pending.put_nowait(None)
+        await pumper
+
+
 def _handle_ws_request(method: str, params: dict, store: SessionStore, runtime: AgentRuntime, config: AppConfig) -> dict:
     if method == "agent.list":
         return {"agents": [a.model_dump() for a in config.agents]}
@@ -249,43 +923,14 @@ def _handle_ws_request(method: str, params: dict, store: SessionStore, runtime:
         agent_id = params.get("agent_id")
         session_id = params.get("session_id")
         return {"events": store.read_events(agent_id, session_id)}
-    if method == "session.send":
-        started = time.perf_counter()
-        agent_id = params.get("agent_id")
-        channel = params.get("channel", "cli")
-        peer = params.get("peer", "local")
-        message = params.get("message", "")
-        session_id = params.get("session_id")
-        force_new = bool(params.get("force_new", False))
-        queue_depth = params.get("queue_depth")
-        session = _get_or_create_session(store, agent_id, channel, peer, session_id, message, force_new=force_new)
-        turn = runtime.run_turn(agent_id, session["id"], message, channel, interactive=False)
-        assistant = str(turn.get("assistant_message", ""))
-        plan = turn.get("plan", [])
-        metrics = dict(turn.get("metrics", {}))
-        metrics["gateway_duration_ms"] = int((time.perf_counter() - started) * 1000)
-        _append_turn_events(
-            store=store,
-            config=config,
-            agent_id=agent_id,
-            session_id=session["id"],
-            channel=channel,
-            message=message,
-            assistant=assistant,
-            plan=plan,
-            metrics=metrics,
-            queue_depth=int(queue_depth) if isinstance(queue_depth, int) else None,
-        )
-        if config.observability.log_turn_metrics:
-            log.info(
-                "gateway ws turn agent=%s session=%s duration_ms=%s queue_depth=%s",
-                agent_id,
-                session["id"],
-                metrics["gateway_duration_ms"],
-                queue_depth,
-            )
-        return {"session_id": session["id"], "assistant_message": assistant, "plan": plan, "metrics": metrics}
     return {"error": f"unknown method {method}"}
 
 
-app = create_app()
+def __getattr__(name: str) -> Any:
+    # Backward-compatible `codeclaw.gateway:app`; built on first access so importing
+    # this module never loads config. Prefer `uvicorn --factory codeclaw.gateway:create_app`.
+    if name == "app":
+        app = create_app()
+        globals()["app"] = app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import itertools
+import threading
+import time
+from collections import deque
+from typing import Any
+
+from codeclaw.config import ModelHealthConfig
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def _percentile(samples: list[int], fraction: float) -> int | None:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class _ModelStats:
+    def __init__(self, window: int):
+        self.latencies: deque[int] = deque(maxlen=window)
+        self.first_tokens: deque[int] = deque(maxlen=window)
+        self.outcomes: deque[bool] = deque(maxlen=window)
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probe_inflight = False
+        self.probe_id = 0
+        self.probe_started_at = 0.0
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.failures = 0
+        self.last_error_kind = ""
+
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return sum(1 for ok in self.outcomes if not ok) / len(self.outcomes)
+
+
+class ModelHealthTracker:
+    # Process-wide view of provider health shared by every turn: rolling latency
+    # percentiles, error rates and a closed/open/half-open circuit breaker per model.
+    def __init__(self, config: ModelHealthConfig):
+        self.config = config
+        self._lock = threading.Lock()
+        self._models: dict[str, _ModelStats] = {}
+        self._probe_ids = itertools.count(1)
+
+    def _stats(self, model: str) -> _ModelStats:
+        stats = self._models.get(model)
+        if stats is None:
+            stats = _ModelStats(max(5, int(self.config.window)))
+            self._models[model] = stats
+        return stats
+
+    def _eligible(self, stats: _ModelStats, now: float) -> bool:
+        if stats.state == CLOSED:
+            return True
+        if stats.state == OPEN:
+            return now - stats.opened_at >= max(0.0, float(self.config.cooldown_seconds))
+        if not stats.probe_inflight:
+            return True
+        return now - stats.probe_started_at >= max(1.0, float(self.config.probe_timeout_seconds))
+
+    # Only the attempt holding the probe token from begin_attempt() moves a breaker out
+    # of half-open; other attempts on the model (fail-open ordering, or candidates
+    # ordered before the probe began) are counted but leave the state alone.
+    def _is_probe(self, stats: _ModelStats, probe: int) -> bool:
+        return bool(probe) and probe == stats.probe_id
+
+    def record_success(self, model: str, latency_ms: int, first_token_ms: int | None = None, probe: int = 0) -> None:
+        with self._lock:
+            stats = self._stats(model)
+            stats.requests += 1
+            stats.latencies.append(int(latency_ms))
+            if first_token_ms is not None:
+                stats.first_tokens.append(int(first_token_ms))
+            stats.consecutive_failures = 0
+            if self._is_probe(stats, probe):
+                stats.outcomes.clear()
+                stats.state = CLOSED
+                stats.probe_inflight = False
+            stats.outcomes.append(True)
+
+    def record_failure(self, model: str, kind: str, probe: int = 0) -> None:
+        with self._lock:
+            stats = self._stats(model)
+            stats.requests += 1
+            stats.failures += 1
+            stats.outcomes.append(False)
+            stats.consecutive_failures += 1
+            stats.last_error_kind = kind
+            is_probe = self._is_probe(stats, probe)
+            if is_probe:
+                stats.probe_inflight = False
+            elif stats.state == HALF_OPEN:
+                return
+            tripped = stats.consecutive_failures >= max(1, int(self.config.failure_threshold)) or (
+                len(stats.outcomes) >= max(1, int(self.config.min_samples))
+                and stats.error_rate() >= float(self.config.error_rate_threshold)
+            )
+            if is_probe or tripped:
+                stats.state = OPEN
+                stats.opened_at = time.monotonic()
+
+    def allow(self, model: str) -> bool:
+        with self._lock:
+            stats = self._models.get(model)
+            return stats is None or self._eligible(stats, time.monotonic())
+
+    def begin_attempt(self, model: str) -> int:
+        # An open breaker past its cooldown lets exactly one probe request through.
+        # Returns that probe's token, or 0 when this attempt is not the probe.
+        with self._lock:
+            stats = self._models.get(model)
+            if stats is None or stats.state == CLOSED:
+                return 0
+            now = time.monotonic()
+            if not self._eligible(stats, now):
+                return 0
+            stats.state = HALF_OPEN
+            stats.probe_inflight = True
+            stats.probe_id = next(self._probe_ids)
+            stats.probe_started_at = now
+            return stats.probe_id
+
+    def end_attempt(self, model: str, probe: int = 0) -> None:
+        # Called for every outcome, including errors that say nothing about provider
+        # health, so a probe never holds the half-open slot until probe_timeout.
+        with self._lock:
+            stats = self._models.get(model)
+            if stats is not None and self._is_probe(stats, probe):
+                stats.probe_inflight = False
+
+    def order(self, models: list[str]) -> list[str]:
+        if not self.config.enabled:
+            return list(models)
+        allowed = [model for model in models if self.allow(model)]
+        if not allowed:
+            # Every candidate is open: fail open in config order rather than rejecting the turn.
+            return list(models)
+        degraded_rate = float(self.config.degraded_error_rate)
+        rank: dict[str, tuple[int, int, int]] = {}
+        with self._lock:
+            for index, model in enumerate(allowed):
+                stats = self._models.get(model)
+                if stats is None:
+                    rank[model] = (0, 0, index)
+                    continue
+                recovering = 1 if stats.state != CLOSED else 0
+                degraded = 1 if stats.error_rate() >= degraded_rate else 0
+                rank[model] = (recovering, degraded, index)
+        return sorted(allowed, key=lambda model: rank[model])
+
+    def first_token_p95(self, model: str, min_samples: int = 20) -> int | None:
+        with self._lock:
+            stats = self._models.get(model)
+            samples = list(stats.first_tokens) if stats is not None else []
+        if len(samples) < min_samples:
+            return None
+        return _percentile(samples, 0.95)
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            items = list(self._models.items())
+            result: dict[str, dict[str, Any]] = {}
+            for model, stats in items:
+                latencies = list(stats.latencies)
+                first_tokens = list(stats.first_tokens)
+                retry_in = 0
+                if stats.state == OPEN:
+                    retry_in = max(0, int(float(self.config.cooldown_seconds) - (now - stats.opened_at)))
+                result[model] = {
+                    "state": stats.state,
+                    "requests": stats.requests,
+                    "failures": stats.failures,
+                    "error_rate": round(stats.error_rate(), 3),
+                    "consecutive_failures": stats.consecutive_failures,
+                    "last_error_kind": stats.last_error_kind,
+                    "retry_in_seconds": retry_in,
+                    "latency_ms": {
+                        "p50": _percentile(latencies, 0.5),
+                        "p95": _percentile(latencies, 0.95),
+                        "p99": _percentile(latencies, 0.99),
+                    },
+                    "first_token_ms": {
+                        "p50": _percentile(first_tokens, 0.5),
+                        "p95": _percentile(first_tokens, 0.95),
+                    },
+                }
+        return result
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import itertools
+import logging
+import threading
+from typing import TYPE_CHECKING, Any, Callable
+
+if TYPE_CHECKING:
+    from codeclaw.storage import SessionStore
+
+log = logging.getLogger(__name__)
+
+EventCallback = Callable[[dict[str, Any]], None]
+
+
+class SessionEventHub:
+    # Fan-out of appended session events to live subscribers. publish() runs on the
+    # thread that wrote the event, so callbacks must only hand the event off.
+    # With several gateway workers, other processes' appends never reach this
+    # process's store listener; tail() then polls the subscribed transcripts instead
+    # and publishes every new event from the file, in seq order.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._by_session: dict[tuple[str, str], dict[int, EventCallback]] = {}
+        self._sessions: dict[int, tuple[str, str]] = {}
+        self._store: SessionStore | None = None
+        self._tailed: dict[tuple[str, str], tuple[int, str]] = {}
+        self._tail_stop = threading.Event()
+        self._tail_thread: threading.Thread | None = None
+
+    def tail(self, store: SessionStore, interval_seconds: float) -> None:
+        self._store = store
+        self._tail_thread = threading.Thread(
+            target=self._tail_loop, args=(max(0.05, float(interval_seconds)),), name="session-event-tail", daemon=True
+        )
+        self._tail_thread.start()
+
+    def stop(self) -> None:
+        self._tail_stop.set()
+        if self._tail_thread is not None:
+            self._tail_thread.join(timeout=5)
+
+    def subscribe(self, agent_id: str, session_id: str, callback: EventCallback) -> int:
+        # When tailing, this reads the transcript once; call it off the event loop.
+        key = (agent_id, session_id)
+        with self._lock:
+            needs_baseline = self._store is not None and key not in self._tailed
+        baseline = self._position(key)[:2] if needs_baseline else None
+        with self._lock:
+            sub_id = next(self._ids)
+            self._by_session.setdefault(key, {})[sub_id] = callback
+            self._sessions[sub_id] = key
+            if baseline is not None:
+                self._tailed.setdefault(key, baseline)
+        return sub_id
+
+    def unsubscribe(self, sub_id: int) -> bool:
+        with self._lock:
+            key = self._sessions.pop(sub_id, None)
+            if key is None:
+                return False
+            callbacks = self._by_session.get(key, {})
+            callbacks.pop(sub_id, None)
+            if not callbacks:
+                self._by_session.pop(key, None)
+                self._tailed.pop(key, None)
+            return True
+
+    def publish(self, agent_id: str, session_id: str, event: dict[str, Any]) -> None:
+        with self._lock:
+            callbacks = list(self._by_session.get((agent_id, session_id), {}).items())
+        for sub_id, callback in callbacks:
+            try:
+                callback(event)
+            except Exception as exc:  # noqa: BLE001
+                log.warning("session subscriber failed subscription=%s err=%s", sub_id, exc)
+
+    def _position(self, key: tuple[str, str], since: int = 0) -> tuple[int, str, list[dict[str, Any]]]:
+        generation = self._store.events_generation(*key)
+        events = [event for event in self._store.read_events(*key) if int(event.get("seq") or 0) > since]
+        last_seq = max((int(event.get("seq") or 0) for event in events), default=since)
+        return last_seq, generation, events
+
+    def _tail_loop(self, interval_seconds: float) -> None:
+        while not self._tail_stop.wait(interval_seconds):
+            with self._lock:
+                tailed = list(self._tailed.items())
+            for key, (last_seq, generation) in tailed:
+                try:
+                    if self._store.events_generation(*key) == generation:
+                        continue
+                    last_seq, generation, events = self._position(key, since=last_seq)
+                except Exception as exc:  # noqa: BLE001
+                    log.warning("session tail failed agent_id=%s session_id=%s err=%s", key[0], key[1], exc)
+                    continue
+                with self._lock:
+                    if key not in self._tailed:
+                        continue
+                    self._tailed[key] = (last_seq, generation)
+                for event in events:
+                    self.publish(key[0], key[1], event)
+
+    def snapshot(self) -> dict[str, int]:
+        with self._lock:
+            return {"subscriptions": len(self._sessions), "sessions": len(self._by_session)}
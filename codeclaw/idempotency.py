@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable
+
+from codeclaw.cache import TieredCache, cache_key
+from codeclaw.config import IdempotencyConfig
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+class IdempotencyConflict(ValueError):
+    pass
+
+
+class _InFlight:
+    __slots__ = ("fingerprint", "done", "result", "error")
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+
+class IdempotencyStore:
+    # Results of completed sends by idempotency key (LRU + TTL, plus a disk tier that
+    # survives restarts). A duplicate that arrives while the original is still running
+    # waits for it instead of starting a second turn. Failures are not remembered, so
+    # a retry after an error runs again. With a disk tier, the running send also holds
+    # an flock'd marker next to its result file so a duplicate in another gateway
+    # worker waits for it too. Each result is stored with a fingerprint of the request
+    # it answered; reusing a key for a different request raises IdempotencyConflict.
+    def __init__(self, config: IdempotencyConfig):
+        self.config = config
+        self.results = TieredCache(
+            config.ttl_seconds,
+            config.max_entries,
+            disk_path=config.disk_path,
+            max_disk_entries=config.max_disk_entries,
+        )
+        self._lock = threading.Lock()
+        self._inflight: dict[str, _InFlight] = {}
+
+    @staticmethod
+    def key(scope: str, idempotency_key: str) -> str:
+        return cache_key({"scope": scope, "idempotency_key": idempotency_key})
+
+    @staticmethod
+    def fingerprint(request: Any) -> str:
+        return cache_key(request)
+
+    def _replay(self, key: str, fingerprint: str) -> Any | None:
+        cached = self.results.get(key)
+        if cached is None or "fingerprint" not in cached:
+            # Entries written before fingerprints were recorded replay as they are.
+            return cached
+        if cached["fingerprint"] != fingerprint:
+            raise IdempotencyConflict("idempotency key was already used for a different request")
+        return cached["result"]
+
+    def run(self, key: str, fn: Callable[[], Any], fingerprint: str = "") -> tuple[Any, bool]:
+        cached = self._replay(key, fingerprint)
+        if cached is not None:
+            return cached, True
+        with self._lock:
+            inflight = self._inflight.get(key)
+            owner = inflight is None
+            if owner:
+                inflight = self._inflight[key] = _InFlight(fingerprint)
+        if not owner:
+            if inflight.fingerprint != fingerprint:
+                raise IdempotencyConflict("idempotency key is in use by a different request")
+            inflight.done.wait()
+            if inflight.error is not None:
+                raise inflight.error
+            return inflight.result, True
+        try:
+            with self._cross_process_marker(key):
+                cached = self._replay(key, fingerprint)
+                if cached is not None:
+                    inflight.result = cached
+                    return cached, True
+                result = fn()
+                self.results.set(key, {"fingerprint": fingerprint, "result": result})
+                inflight.result = result
+                return result, False
+        except BaseException as exc:
+            inflight.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            inflight.done.set()
+
+    @contextmanager
+    def _cross_process_marker(self, key: str):
+        if self.results.disk_dir is None or fcntl is None:
+            yield
+            return
+        path = self.results.disk_dir / key[:2] / f"{key}.inflight"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                same_file = os.fstat(fd).st_ino == os.stat(path).st_ino
+            except FileNotFoundError:
+                same_file = False
+            if same_file:
+                break
+            # The previous holder removed the marker while we waited; lock the new one.
+            os.close(fd)
+        try:
+            yield
+        finally:
+            path.unlink(missing_ok=True)
+            os.close(fd)
+
+    def snapshot(self) -> dict[str, int]:
+        with self._lock:
+            return {"in_flight": len(self._inflight), "cached": len(self.results.memory)}
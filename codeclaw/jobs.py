@@ -0,0 +1,275 @@
+from __future__ import annotations
+
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable
+
+from codeclaw.config import JobsConfig
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+JobCallback = Callable[[dict[str, Any]], None]
+
+TERMINAL_STATUSES = frozenset({"succeeded", "failed", "interrupted"})
+
+_JOB_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore:
+    # Sends accepted as background jobs, one JSON file per job so any gateway worker
+    # can answer a status lookup and a restarted gateway still reports final states.
+    # Status changes are persisted; turn events are only counted in memory and
+    # fanned out to subscribers in the worker that runs the job.
+    # While it owns jobs, a store holds an flock on .owners/<instance>.lock; the OS
+    # drops it when the process dies, which (unlike the owner pid) cannot be reused.
+    def __init__(self, config: JobsConfig):
+        self.config = config
+        self.directory = Path(config.path).expanduser()
+        self.instance = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._progress: dict[str, dict[str, Any]] = {}
+        self._listeners: dict[str, dict[int, JobCallback]] = {}
+        self._subscriptions: dict[int, str] = {}
+        self._owner_handle = None
+
+    def _owner_lock_path(self, owner: str) -> Path:
+        return self.directory / ".owners" / f"{owner}.lock"
+
+    def _hold_owner_lock(self) -> None:
+        if self._owner_handle is not None or fcntl is None:
+            return
+        path = self._owner_lock_path(self.instance)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        handle = path.open("a+", encoding="utf-8")
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._owner_handle = handle
+
+    def close(self) -> None:
+        with self._lock:
+            if self._owner_handle is not None:
+                self._owner_handle.close()
+                self._owner_handle = None
+
+    def _owner_lock_held(self, owner: str) -> bool | None:
+        # None when there is no lock to ask (older records, or no fcntl).
+        if fcntl is None or not _JOB_ID.match(owner):
+            return None
+        try:
+            handle = self._owner_lock_path(owner).open("r", encoding="utf-8")
+        except FileNotFoundError:
+            return None
+        with handle:
+            try:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            return False
+
+    def _owner_alive(self, job: dict[str, Any]) -> bool:
+        held = self._owner_lock_held(str(job.get("owner") or ""))
+        if held is not None:
+            return held
+        owner_pid = int(job.get("owner_pid") or 0)
+        return bool(owner_pid) and owner_pid != os.getpid() and _pid_alive(owner_pid)
+
+    def _path(self, job_id: str) -> Path:
+        return self.directory / f"{job_id}.json"
+
+    def _write(self, job: dict[str, Any]) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(job["id"])
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(job, default=str), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    def _read(self, job_id: str) -> dict[str, Any] | None:
+        if not _JOB_ID.match(str(job_id or "")):
+            return None
+        try:
+            return json.loads(self._path(job_id).read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError) as exc:
+            log.warning("job record unreadable job=%s err=%s", job_id, exc)
+            return None
+
+    def create(self, request: dict[str, Any]) -> dict[str, Any]:
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "queued",
+            "request": request,
+            "session_id": request.get("session_id"),
+            "created_at": _now(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+            "owner_pid": os.getpid(),
+            "owner": self.instance,
+        }
+        with self._lock:
+            self._hold_owner_lock()
+            self._progress[job["id"]] = {"events": 0, "tool_calls": 0, "last_event": None}
+            self._write(job)
+        return job
+
+    def discard(self, job_id: str) -> None:
+        with self._lock:
+            self._progress.pop(job_id, None)
+            self._path(job_id).unlink(missing_ok=True)
+
+    def get(self, job_id: str) -> dict[str, Any] | None:
+        job = self._read(job_id)
+        if job is None:
+            return None
+        with self._lock:
+            progress = self._progress.get(job_id)
+            if progress is not None:
+                job["progress"] = dict(progress)
+        return job
+
+    def _update(self, job_id: str, **fields: Any) -> dict[str, Any] | None:
+        with self._lock:
+            job = self._read(job_id)
+            if job is None:
+                return None
+            job.update(fields)
+            progress = self._progress.get(job_id)
+            if progress is not None:
+                job["progress"] = dict(progress)
+            if job["status"] in TERMINAL_STATUSES:
+                self._progress.pop(job_id, None)
+            self._write(job)
+        self._publish(job_id, {"type": "job", "job": job})
+        return job
+
+    def mark_running(self, job_id: str) -> None:
+        self._update(job_id, status="running", started_at=_now())
+
+    def finish(self, job_id: str, result: dict[str, Any] | None = None, error: str | None = None) -> None:
+        fields: dict[str, Any] = {"finished_at": _now()}
+        if error is not None:
+            fields.update(status="failed", error=error)
+        else:
+            fields.update(status="succeeded", result=result, session_id=(result or {}).get("session_id"))
+        self._update(job_id, **fields)
+
+    def record_event(self, job_id: str, event: dict[str, Any]) -> None:
+        with self._lock:
+            progress = self._progress.get(job_id)
+            if progress is None:
+                return
+            progress["events"] += 1
+            progress["last_event"] = event.get("type")
+            if event.get("type") == "tool_start":
+                progress["tool_calls"] += 1
+            snapshot = dict(progress)
+        if event.get("type") == "session" and event.get("session_id"):
+            # Persist the session early so a client can follow the transcript while the job runs.
+            self._update(job_id, session_id=event["session_id"])
+        self._publish(job_id, {"type": "progress", "event": event, "progress": snapshot})
+
+    def recover(self) -> int:
+        # Jobs left queued/running by a store that is gone can never finish; record that
+        # instead of reporting them forever.
+        if not self.directory.exists():
+            return 0
+        interrupted = 0
+        for path in self.directory.glob("*.json"):
+            job = self._read(path.stem)
+            if job is None or job.get("status") in TERMINAL_STATUSES:
+                continue
+            if job.get("owner") == self.instance or self._owner_alive(job):
+                continue
+            job.update(status="interrupted", finished_at=_now(), error="gateway restarted before the job finished")
+            self._write(job)
+            interrupted += 1
+        return interrupted
+
+    def prune(self) -> int:
+        if not self.directory.exists():
+            return 0
+        cutoff = time.time() - max(0, int(self.config.retention_days)) * 86400
+        removed = 0
+        for path in self.directory.glob("*.json"):
+            try:
+                if path.stat().st_mtime >= cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            job = self._read(path.stem)
+            if job is not None and job.get("status") not in TERMINAL_STATUSES:
+                continue
+            path.unlink(missing_ok=True)
+            removed += 1
+        for path in self.directory.glob(".owners/*.lock"):
+            try:
+                stale = path.stat().st_mtime < cutoff and self._owner_lock_held(path.stem) is False
+            except FileNotFoundError:
+                continue
+            if stale:
+                path.unlink(missing_ok=True)
+        return removed
+
+    def subscribe(self, job_id: str, callback: JobCallback) -> int:
+        with self._lock:
+            sub_id = next(self._ids)
+            self._listeners.setdefault(job_id, {})[sub_id] = callback
+            self._subscriptions[sub_id] = job_id
+        return sub_id
+
+    def unsubscribe(self, sub_id: int) -> bool:
+        with self._lock:
+            job_id = self._subscriptions.pop(sub_id, None)
+            if job_id is None:
+                return False
+            callbacks = self._listeners.get(job_id, {})
+            callbacks.pop(sub_id, None)
+            if not callbacks:
+                self._listeners.pop(job_id, None)
+            return True
+
+    def is_local(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._progress
+
+    def _publish(self, job_id: str, event: dict[str, Any]) -> None:
+        with self._lock:
+            callbacks = list(self._listeners.get(job_id, {}).items())
+        for sub_id, callback in callbacks:
+            try:
+                callback(event)
+            except Exception as exc:  # noqa: BLE001
+                log.warning("job subscriber failed subscription=%s err=%s", sub_id, exc)
+
+    def snapshot(self) -> dict[str, int]:
+        with self._lock:
+            return {"active": len(self._progress), "subscriptions": len(self._subscriptions)}
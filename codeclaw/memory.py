@@ -0,0 +1,432 @@
+from __future__ import annotations
+
+import bisect
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import threading
+from contextlib import contextmanager
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Iterator
+
+from codeclaw.storage import _locked_file
+
+log = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"[a-zA-Z0-9_]+")
+_INDEX_VERSION = 2
+_MAX_STORED_LINE_CHARS = 2000
+_PREFIX_WEIGHT = 0.5
+_BM25_K1 = 1.2
+_BM25_B = 0.75
+
+
+def tokenize(text: str) -> list[str]:
+    return [term for term in _TOKEN_RE.findall(text.lower()) if len(term) >= 2]
+
+
+def _file_signature(path: Path) -> tuple[int, int] | None:
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _write_atomic(path: Path, text: str) -> None:
+    tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp_path.write_text(text, encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+class MemoryIndex:
+    # Per-agent inverted index over memory markdown files: one document per non-empty
+    # line, ranked with BM25. Persisted next to the memory files as a small manifest
+    # (file signatures) plus one segment per memory file, so an append rewrites only
+    # that file's segment; freshness is checked by each file's mtime/size before a search.
+    def __init__(self, index_path: Path):
+        self.index_path = index_path
+        self.segments_dir = index_path.with_name(index_path.stem + ".segments")
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._dirty_files: set[str] = set()
+        self._dropped_files: set[str] = set()
+        self._files: dict[str, dict[str, Any]] = {}
+        # doc key "<path>\0<line>" -> [path, line, length, text, term counts]
+        self._docs: dict[str, list[Any]] = {}
+        self._file_docs: dict[str, list[str]] = {}
+        self._postings: dict[str, dict[str, int]] = {}
+        self._total_length = 0
+        self._vocab: list[str] | None = None
+
+    @staticmethod
+    def _segment_name(path_key: str) -> str:
+        return hashlib.sha256(path_key.encode("utf-8")).hexdigest()[:16] + ".json"
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            payload = json.loads(self.index_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        if not isinstance(payload, dict) or payload.get("version") != _INDEX_VERSION:
+            return
+        for path_key, meta in (payload.get("files") or {}).items():
+            try:
+                segment = json.loads((self.segments_dir / str(meta["segment"])).read_text(encoding="utf-8"))
+            except (OSError, ValueError, KeyError, TypeError):
+                # Unknown to the index, so the next refresh() reindexes the file.
+                continue
+            for line_no, length, text, counts in segment.get("docs") or []:
+                self._add_doc(path_key, int(line_no), int(length), text, counts)
+            self._files[path_key] = meta
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty_files and not self._dropped_files:
+                return
+            self.segments_dir.mkdir(parents=True, exist_ok=True)
+            for path_key in self._dropped_files - self._dirty_files:
+                (self.segments_dir / self._segment_name(path_key)).unlink(missing_ok=True)
+            for path_key in self._dirty_files:
+                if path_key not in self._files:
+                    continue
+                docs = [self._docs[doc_key] for doc_key in self._file_docs.get(path_key, [])]
+                segment = {"path": path_key, "docs": [[doc[1], doc[2], doc[3], doc[4]] for doc in docs]}
+                _write_atomic(self.segments_dir / self._segment_name(path_key), json.dumps(segment, separators=(",", ":")))
+            payload = {"version": _INDEX_VERSION, "files": self._files}
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            _write_atomic(self.index_path, json.dumps(payload, separators=(",", ":")))
+            self._dirty_files.clear()
+            self._dropped_files.clear()
+
+    def _add_doc(self, path_key: str, line_no: int, length: int, text: str, counts: dict[str, int]) -> None:
+        doc_key = f"{path_key}\0{line_no}"
+        self._docs[doc_key] = [path_key, line_no, length, text, counts]
+        self._file_docs.setdefault(path_key, []).append(doc_key)
+        self._total_length += length
+        for term, count in counts.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                self._vocab = None
+            postings[doc_key] = count
+
+    def _add_line(self, path_key: str, line_no: int, text: str) -> None:
+        terms = tokenize(text)
+        if not terms:
+            return
+        counts: dict[str, int] = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        self._add_doc(path_key, line_no, len(terms), text[:_MAX_STORED_LINE_CHARS], counts)
+
+    def _drop_file(self, path_key: str) -> None:
+        for doc_key in self._file_docs.pop(path_key, []):
+            doc = self._docs.pop(doc_key)
+            self._total_length -= int(doc[2])
+            for term in doc[4]:
+                postings = self._postings.get(term)
+                if postings is None:
+                    continue
+                postings.pop(doc_key, None)
+                if not postings:
+                    del self._postings[term]
+                    self._vocab = None
+        if self._files.pop(path_key, None) is not None:
+            self._dropped_files.add(path_key)
+
+    def _reindex_file(self, path: Path, signature: tuple[int, int]) -> None:
+        path_key = str(path)
+        self._drop_file(path_key)
+        try:
+            lines = path.read_text(encoding="utf-8").splitlines()
+        except OSError:
+            return
+        for line_no, text in enumerate(lines, start=1):
+            self._add_line(path_key, line_no, text)
+        self._files[path_key] = {
+            "mtime_ns": signature[0],
+            "size": signature[1],
+            "line_count": len(lines),
+            "segment": self._segment_name(path_key),
+        }
+        self._dirty_files.add(path_key)
+
+    def refresh(self, paths: list[Path], stat_only: set[Path] | None = None) -> int:
+        # With stat_only, indexed files outside it are trusted as they are (the caller
+        # knows nothing rewrote them) and only new files and stat_only are checked.
+        reindexed = 0
+        with self._lock:
+            self._load()
+            wanted = {str(path) for path in paths}
+            for path_key in [key for key in self._files if key not in wanted]:
+                self._drop_file(path_key)
+            for path in paths:
+                if stat_only is not None and path not in stat_only and str(path) in self._files:
+                    continue
+                signature = _file_signature(path)
+                if signature is None:
+                    continue
+                known = self._files.get(str(path))
+                if known and (known["mtime_ns"], known["size"]) == signature:
+                    continue
+                self._reindex_file(path, signature)
+                reindexed += 1
+        return reindexed
+
+    def note_append(self, path: Path, lines: list[str], previous_size: int) -> None:
+        # Called right after memory_store appends to a file we already track; anything
+        # else (foreign edits, unknown files) is caught by refresh() on the next search.
+        with self._lock:
+            self._load()
+            path_key = str(path)
+            known = self._files.get(path_key)
+            signature = _file_signature(path)
+            if known is None or signature is None or known["size"] != previous_size:
+                return
+            line_count = int(known["line_count"])
+            for offset, text in enumerate(lines, start=1):
+                self._add_line(path_key, line_count + offset, text)
+            self._files[path_key] = {**known, "mtime_ns": signature[0], "size": signature[1], "line_count": line_count + len(lines)}
+            self._dirty_files.add(path_key)
+
+    def _expand(self, term: str) -> list[tuple[str, float]]:
+        if self._vocab is None:
+            self._vocab = sorted(self._postings)
+        expanded: list[tuple[str, float]] = []
+        start = bisect.bisect_left(self._vocab, term)
+        for candidate in self._vocab[start:]:
+            if not candidate.startswith(term):
+                break
+            expanded.append((candidate, 1.0 if candidate == term else _PREFIX_WEIGHT))
+        return expanded
+
+    def search(self, query: str, limit: int) -> list[dict[str, Any]]:
+        terms = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            self._load()
+            doc_count = len(self._docs)
+            if not terms or doc_count == 0:
+                return []
+            avg_length = max(1.0, self._total_length / doc_count)
+            scores: dict[str, float] = {}
+            for term in terms:
+                for indexed_term, weight in self._expand(term):
+                    postings = self._postings[indexed_term]
+                    df = len(postings)
+                    idf = math.log(1.0 + (doc_count - df + 0.5) / (df + 0.5))
+                    for doc_key, tf in postings.items():
+                        length = int(self._docs[doc_key][2])
+                        norm = tf + _BM25_K1 * (1 - _BM25_B + _BM25_B * length / avg_length)
+                        scores[doc_key] = scores.get(doc_key, 0.0) + weight * idf * tf * (_BM25_K1 + 1) / norm
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], int(self._docs[item[0]][1])))
+            results: list[dict[str, Any]] = []
+            for doc_key, score in ranked[: max(1, limit)]:
+                path_key, line_no, _, text, _ = self._docs[doc_key]
+                results.append({"path": path_key, "line": int(line_no), "score": round(score, 4), "text": text})
+        return results
+
+
+class LineOffsetIndex:
+    # Sidecar "<file>.lines" recording the byte offset of every `stride`-th line so a
+    # window of an append-only memory file can be sliced out of an mmap without
+    # reading or splitting the lines before it.
+    def __init__(self, path: Path, stride: int = 64):
+        self.path = path
+        self.sidecar_path = path.with_name(path.name + ".lines")
+        self.stride = max(1, int(stride))
+        self._lock = threading.Lock()
+        self._state: dict[str, Any] | None = None
+
+    def _empty_state(self) -> dict[str, Any]:
+        return {"stride": self.stride, "size": 0, "mtime_ns": 0, "line_count": 0, "offsets": [], "ends_with_newline": False, "tail": ""}
+
+    def _load_state(self) -> dict[str, Any]:
+        if self._state is not None:
+            return self._state
+        try:
+            state = json.loads(self.sidecar_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            state = None
+        if not isinstance(state, dict) or state.get("stride") != self.stride:
+            state = self._empty_state()
+        self._state = state
+        return state
+
+    def _save_state(self, state: dict[str, Any]) -> None:
+        tmp_path = self.sidecar_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(json.dumps(state, separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp_path, self.sidecar_path)
+
+    @staticmethod
+    def _tail(mm: Any, size: int) -> str:
+        return mm[max(0, size - 32) : size].hex()
+
+    def _scan(self, mm: Any, state: dict[str, Any], start: int, size: int) -> None:
+        offsets: list[int] = state["offsets"]
+        line_count = int(state["line_count"])
+
+        def register(offset: int) -> None:
+            nonlocal line_count
+            if line_count % self.stride == 0:
+                offsets.append(offset)
+            line_count += 1
+
+        if start == 0:
+            register(0)
+        elif state["ends_with_newline"]:
+            register(start)
+        pos = start
+        while True:
+            newline = mm.find(b"\n", pos, size)
+            if newline == -1 or newline + 1 >= size:
+                break
+            pos = newline + 1
+            register(pos)
+        state["line_count"] = line_count
+        state["ends_with_newline"] = mm[size - 1 : size] == b"\n"
+
+    def sync(self) -> dict[str, Any]:
+        with self._lock:
+            state = self._load_state()
+            try:
+                stat = self.path.stat()
+            except OSError:
+                self._state = self._empty_state()
+                return self._state
+            if (state["mtime_ns"], state["size"]) == (stat.st_mtime_ns, stat.st_size):
+                return state
+            if stat.st_size == 0:
+                state = self._empty_state()
+            else:
+                with self.path.open("rb") as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    size = len(mm)
+                    old_size = int(state["size"])
+                    # Appends only need the new bytes scanned; anything else is a rewrite.
+                    appended = 0 < old_size < size and self._tail(mm, old_size) == state["tail"]
+                    if not appended:
+                        state = self._empty_state()
+                    self._scan(mm, state, old_size if appended else 0, size)
+                    state["size"] = size
+                    state["tail"] = self._tail(mm, size)
+            state["mtime_ns"] = stat.st_mtime_ns
+            self._state = state
+            self._save_state(state)
+            return state
+
+    def read(self, from_line: int, count: int) -> tuple[list[str], int]:
+        state = self.sync()
+        line_count = int(state["line_count"])
+        from_line = max(1, int(from_line))
+        if count <= 0 or from_line > line_count:
+            return [], line_count
+        count = min(count, line_count - from_line + 1)
+        checkpoint = (from_line - 1) // self.stride
+        with self.path.open("rb") as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = min(len(mm), int(state["size"]))
+            pos = int(state["offsets"][checkpoint])
+            for _ in range((from_line - 1) - checkpoint * self.stride):
+                pos = mm.find(b"\n", pos, size) + 1
+            end = pos
+            for _ in range(count):
+                newline = mm.find(b"\n", end, size)
+                end = size if newline == -1 else newline + 1
+            chunk = mm[pos:end]
+        return chunk.decode("utf-8", errors="replace").splitlines()[:count], line_count
+
+
+@contextmanager
+def memory_lock(root: Path) -> Iterator[None]:
+    # Serializes every writer of one agent's memory files (memory_store appends,
+    # consolidation, index saves) across threads and gateway worker processes.
+    with _locked_file(root / ".memory.lock"):
+        yield
+
+
+def dedupe_durable_notes(path: Path) -> int:
+    try:
+        lines = path.read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return 0
+    seen: set[str] = set()
+    kept: list[str] = []
+    for line in lines:
+        if line.startswith("- "):
+            digest = hashlib.sha256(" ".join(line[2:].split()).lower().encode("utf-8")).hexdigest()
+            if digest in seen:
+                continue
+            seen.add(digest)
+        kept.append(line)
+    removed = len(lines) - len(kept)
+    if removed:
+        _write_atomic(path, "\n".join(kept) + "\n")
+    return removed
+
+
+def load_archive_manifest(archive_dir: Path) -> dict[str, Any]:
+    try:
+        manifest = json.loads((archive_dir / "manifest.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        manifest = None
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("months"), dict):
+        manifest = {"version": 1, "months": {}}
+    return manifest
+
+
+def _archive_has_day(archive_file: Path, day: str) -> bool:
+    try:
+        with archive_file.open(encoding="utf-8") as handle:
+            return any(line.rstrip("\n") == f"## {day}" for line in handle)
+    except FileNotFoundError:
+        return False
+
+
+def consolidate_memory(root: Path, archive_after_days: int, today: date) -> dict[str, Any]:
+    with memory_lock(root):
+        return _consolidate_memory_locked(root, archive_after_days, today)
+
+
+def _consolidate_memory_locked(root: Path, archive_after_days: int, today: date) -> dict[str, Any]:
+    # Rolls daily files older than the cutoff into memory/archive/<YYYY-MM>.md and
+    # records each archived day in the manifest. A day whose "## <day>" section is
+    # already in the archive (a crash before the manifest write) is not appended again.
+    daily_dir = root / "memory"
+    archive_dir = daily_dir / "archive"
+    cutoff = today - timedelta(days=max(1, int(archive_after_days)))
+    manifest = load_archive_manifest(archive_dir)
+    archived = 0
+    for path in sorted(daily_dir.glob("*.md")):
+        try:
+            day = date.fromisoformat(path.stem)
+        except ValueError:
+            continue
+        if day >= cutoff:
+            continue
+        month = path.stem[:7]
+        entry = manifest["months"].setdefault(month, {"file": f"{month}.md", "days": [], "lines": 0})
+        if path.stem not in entry["days"]:
+            body = [line for line in path.read_text(encoding="utf-8").splitlines() if line.strip() and not line.startswith("# ")]
+            archive_dir.mkdir(parents=True, exist_ok=True)
+            archive_file = archive_dir / entry["file"]
+            if not _archive_has_day(archive_file, path.stem):
+                header = "" if archive_file.exists() else f"# Memory Archive {month}\n"
+                with archive_file.open("a", encoding="utf-8") as handle:
+                    handle.write(header + f"\n## {path.stem}\n" + "".join(line + "\n" for line in body))
+            entry["days"] = sorted(entry["days"] + [path.stem])
+            entry["lines"] = int(entry["lines"]) + len(body)
+            _write_atomic(archive_dir / "manifest.json", json.dumps(manifest, indent=2, sort_keys=True))
+        path.unlink(missing_ok=True)
+        path.with_name(path.name + ".lines").unlink(missing_ok=True)
+        archived += 1
+    duplicates = dedupe_durable_notes(root / "MEMORY.md")
+    if archived or duplicates:
+        log.info("memory consolidated root=%s archived_days=%s duplicates_removed=%s", root, archived, duplicates)
+    return {"archived_days": archived, "duplicates_removed": duplicates, "months": sorted(manifest["months"])}
@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import abc
+import bisect
+import threading
+import time
+from typing import Any
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], *extra: str) -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    parts.extend(part for part in extra if part)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, Any]) -> tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self, const_labels: str = "") -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self._samples(const_labels)]
+
+    @abc.abstractmethod
+    def _samples(self, const_labels: str) -> list[str]:
+        ...
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self, const_labels: str) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key, const_labels)} {_format_number(value)}" for key, value in items
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: Any) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def replace(self, values: dict[tuple[str, ...], float]) -> None:
+        # Swap in a full snapshot so label sets that disappeared (stopped workers) go away.
+        with self._lock:
+            self._values = dict(values)
+
+    def _samples(self, const_labels: str) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key, const_labels)} {_format_number(value)}" for key, value in items
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [per-bucket counts (non-cumulative) + overflow], sum, count.
+        self._series: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = ([0] * (len(self.buckets) + 1), [0.0, 0.0])
+                self._series[key] = series
+            series[0][index] += 1
+            series[1][0] += value
+            series[1][1] += 1
+
+    def count(self, **labels: Any) -> int:
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return int(series[1][1]) if series is not None else 0
+
+    def _samples(self, const_labels: str) -> list[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), list(totals))) for key, (counts, totals) in self._series.items())
+        lines: list[str] = []
+        for key, (counts, (total, count)) in items:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, float("inf")), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, const_labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key, const_labels)} {_format_number(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key, const_labels)} {_format_number(count)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: dict[str, _Metric] = {}
+        self._const_labels: dict[str, str] = {}
+
+    def set_const_labels(self, **labels: Any) -> None:
+        # Added to every sample, e.g. the worker pid when several gateway processes
+        # answer scrapes, so each process's counters stay separate series.
+        with self._lock:
+            self._const_labels = {name: str(value) for name, value in labels.items()}
+
+    def _register(self, metric: _Metric) -> Any:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            const_labels = ",".join(f'{name}="{_escape(value)}"' for name, value in sorted(self._const_labels.items()))
+        lines: list[str] = []
+        for metric in metrics:
+            lines.extend(metric.render(const_labels))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+TURN_DURATION = REGISTRY.histogram(
+    "codeclaw_turn_duration_seconds", "Agent turn duration (run_turn).", ("agent", "model")
+)
+GATEWAY_DURATION = REGISTRY.histogram(
+    "codeclaw_gateway_duration_seconds", "Gateway send duration including queueing and persistence.", ("agent", "transport")
+)
+TOKENS = REGISTRY.counter("codeclaw_tokens_total", "LLM tokens by direction.", ("agent", "model", "direction"))
+TURNS = REGISTRY.counter("codeclaw_turns_total", "Completed gateway turns.", ("agent", "transport", "cache_hit"))
+FAILOVERS = REGISTRY.counter("codeclaw_failovers_total", "Model failovers during turns.", ("agent",))
+COMPACTIONS = REGISTRY.counter(
+    "codeclaw_compactions_total", "Context compactions by kind (compacted, summary_swapped, overflow_retried).", ("agent", "kind")
+)
+TOOL_DURATION = REGISTRY.histogram("codeclaw_tool_duration_seconds", "Agent tool call duration.", ("tool", "ok"))
+STORAGE_OP = REGISTRY.histogram(
+    "codeclaw_storage_op_seconds", "Session store operation latency.", ("op",), buckets=FAST_BUCKETS
+)
+TELEGRAM_QUEUE_DEPTH = REGISTRY.gauge("codeclaw_telegram_queue_depth", "Queued Telegram updates per chat.", ("chat_id",))
+TELEGRAM_DROPPED = REGISTRY.counter("codeclaw_telegram_dropped_updates_total", "Telegram updates dropped on a full chat queue.")
+TELEGRAM_RETRIES = REGISTRY.counter(
+    "codeclaw_telegram_send_retries_total", "Retried Telegram API and gateway calls by reason.", ("reason",)
+)
+ADMISSION_QUEUED = REGISTRY.gauge("codeclaw_admission_queued", "HTTP turns waiting for a gateway worker.")
+ADMISSION_RUNNING = REGISTRY.gauge("codeclaw_admission_running", "HTTP turns running on gateway workers.")
+ADMISSION_REJECTED = REGISTRY.counter("codeclaw_admission_rejected_total", "HTTP turns rejected with 429.")
+SCHEDULER_QUEUED = REGISTRY.gauge("codeclaw_scheduler_queued", "Turns waiting for a scheduler slot.")
+SCHEDULER_RUNNING = REGISTRY.gauge("codeclaw_scheduler_running", "Turns holding a scheduler slot.")
+PROCESS_START = REGISTRY.gauge("codeclaw_process_start_time_seconds", "Start time of this process (Unix seconds).")
+PROCESS_START.set(time.time())
+
+
+def record_turn(agent_id: str, transport: str, metrics: dict[str, Any]) -> None:
+    model = str(metrics.get("model_used") or "unknown")
+    if metrics.get("duration_ms") is not None:
+        TURN_DURATION.observe(float(metrics["duration_ms"]) / 1000.0, agent=agent_id, model=model)
+    if metrics.get("gateway_duration_ms") is not None:
+        GATEWAY_DURATION.observe(float(metrics["gateway_duration_ms"]) / 1000.0, agent=agent_id, transport=transport)
+    TURNS.inc(agent=agent_id, transport=transport, cache_hit=str(bool(metrics.get("cache_hit"))).lower())
+    for direction in ("input", "output"):
+        tokens = metrics.get(f"{direction}_tokens")
+        if isinstance(tokens, (int, float)) and tokens > 0:
+            TOKENS.inc(tokens, agent=agent_id, model=model, direction=direction)
+    failovers = metrics.get("failover_count")
+    if isinstance(failovers, (int, float)) and failovers > 0:
+        FAILOVERS.inc(failovers, agent=agent_id)
+    for flag, kind in (
+        ("context_compacted", "compacted"),
+        ("context_summary_swapped", "summary_swapped"),
+        ("context_overflow_retried", "overflow_retried"),
+    ):
+        if metrics.get(flag):
+            COMPACTIONS.inc(agent=agent_id, kind=kind)
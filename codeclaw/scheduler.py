@@ -0,0 +1,306 @@
+from __future__ import annotations
+
+import itertools
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+from codeclaw.config import SchedulerConfig
+
+
+class SchedulerTimeout(TimeoutError):
+    pass
+
+
+class AdmissionRejected(RuntimeError):
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    __slots__ = ("agent_id", "provider", "flow", "finish", "seq", "enqueued", "admitted", "admitted_at", "queue_wait_ms")
+
+    def __init__(self, agent_id: str, provider: str, flow: str, finish: float, seq: int):
+        self.agent_id = agent_id
+        self.provider = provider
+        self.flow = flow
+        self.finish = finish
+        self.seq = seq
+        self.enqueued = time.perf_counter()
+        self.admitted = False
+        self.admitted_at = 0.0
+        self.queue_wait_ms = 0
+
+
+class TurnScheduler:
+    # Weighted fair queuing over flows (one per channel:peer): each waiting turn gets a
+    # virtual finish time of max(now, flow's last finish) + 1/weight, and the earliest
+    # finish whose agent, provider and global caps have room runs next. A burst from
+    # one peer therefore queues behind itself instead of ahead of everyone else.
+    def __init__(self, config: SchedulerConfig):
+        self.config = config
+        self._cond = threading.Condition()
+        self._waiting: list[_Ticket] = []
+        self._flow_finish: dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+        self._running = 0
+        self._running_agents: dict[str, int] = {}
+        self._running_providers: dict[str, int] = {}
+        self._waits_ms: deque[int] = deque(maxlen=200)
+        self._holds_ms: deque[int] = deque(maxlen=200)
+
+    @property
+    def capacity(self) -> int:
+        return max(1, int(self.config.max_concurrent_turns))
+
+    def _agent_limit(self, agent_id: str) -> int:
+        return max(1, int(self.config.agent_limits.get(agent_id, self.config.per_agent_limit)))
+
+    def _provider_limit(self, provider: str) -> int:
+        return max(1, int(self.config.provider_limits.get(provider, self.config.max_concurrent_turns)))
+
+    def _has_room(self, ticket: _Ticket) -> bool:
+        return (
+            self._running < max(1, int(self.config.max_concurrent_turns))
+            and self._running_agents.get(ticket.agent_id, 0) < self._agent_limit(ticket.agent_id)
+            and self._running_providers.get(ticket.provider, 0) < self._provider_limit(ticket.provider)
+        )
+
+    def _dispatch(self) -> None:
+        admitted = False
+        for ticket in sorted(self._waiting, key=lambda item: (item.finish, item.seq)):
+            if not self._has_room(ticket):
+                continue
+            self._waiting.remove(ticket)
+            ticket.admitted = True
+            ticket.admitted_at = time.perf_counter()
+            ticket.queue_wait_ms = int((ticket.admitted_at - ticket.enqueued) * 1000)
+            self._waits_ms.append(ticket.queue_wait_ms)
+            self._virtual_time = max(self._virtual_time, ticket.finish)
+            self._running += 1
+            self._running_agents[ticket.agent_id] = self._running_agents.get(ticket.agent_id, 0) + 1
+            self._running_providers[ticket.provider] = self._running_providers.get(ticket.provider, 0) + 1
+            admitted = True
+        if admitted:
+            self._cond.notify_all()
+
+    def acquire(self, agent_id: str, provider: str, channel: str, peer: str) -> _Ticket:
+        flow = f"{channel}:{peer}"
+        with self._cond:
+            if not self.config.enabled:
+                ticket = _Ticket(agent_id, provider, flow, 0.0, next(self._seq))
+                ticket.admitted = True
+                return ticket
+            weight = max(0.01, float(self.config.channel_weights.get(channel, 1.0)))
+            start = max(self._virtual_time, self._flow_finish.get(flow, 0.0))
+            ticket = _Ticket(agent_id, provider, flow, start + 1.0 / weight, next(self._seq))
+            self._flow_finish[flow] = ticket.finish
+            self._waiting.append(ticket)
+            self._dispatch()
+            timeout = max(0.0, float(self.config.queue_timeout_seconds))
+            deadline = time.monotonic() + timeout
+            while not ticket.admitted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(ticket)
+                    raise SchedulerTimeout(f"turn for agent {agent_id} waited more than {timeout:.0f}s for a slot")
+                self._cond.wait(remaining)
+            if not self._waiting:
+                # Idle again: forget per-flow history so an old burst is not held against a peer.
+                self._flow_finish.clear()
+            return ticket
+
+    def release(self, ticket: _Ticket) -> None:
+        with self._cond:
+            if not self.config.enabled:
+                return
+            self._running -= 1
+            self._holds_ms.append(int((time.perf_counter() - ticket.admitted_at) * 1000))
+            self._running_agents[ticket.agent_id] -= 1
+            self._running_providers[ticket.provider] -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, agent_id: str, provider: str, channel: str, peer: str) -> Iterator[_Ticket]:
+        ticket = self.acquire(agent_id, provider, channel, peer)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def service_stats(self) -> tuple[list[int], list[int]]:
+        # Recent slot waits and slot hold times (the turn's own run time), in ms.
+        with self._cond:
+            return list(self._waits_ms), list(self._holds_ms)
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._cond:
+            return {
+                "running": self._running,
+                "queued": len(self._waiting),
+                "running_by_agent": {key: value for key, value in self._running_agents.items() if value},
+                "running_by_provider": {key: value for key, value in self._running_providers.items() if value},
+            }
+
+
+class AdmissionQueue:
+    # Bounded front door for gateway turns: at most workers + max_queue turns in
+    # flight. Past that, submit() fails fast so callers can answer 429 instead of
+    # parking requests in the server threadpool until they time out. With an enabled
+    # TurnScheduler, every admitted turn gets a thread at once and waits in the
+    # scheduler's fair queue, so there is a single queue; running, queued and
+    # Retry-After then follow scheduler slots rather than blocked threads.
+    def __init__(self, workers: int, max_queue: int, scheduler: TurnScheduler | None = None):
+        self.workers = max(1, int(workers))
+        self.max_queue = max(0, int(max_queue))
+        self.scheduler = scheduler if scheduler is not None and scheduler.config.enabled else None
+        threads = self.workers + self.max_queue if self.scheduler is not None else self.workers
+        self._executor = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix="codeclaw-turn")
+        self._lock = threading.Lock()
+        self._running = 0
+        self._queued = 0
+        self._admitted = 0
+        self._rejected = 0
+        self._waits_ms: deque[int] = deque(maxlen=200)
+        self._durations_ms: deque[int] = deque(maxlen=200)
+
+    def retry_after(self) -> int:
+        with self._lock:
+            return self._retry_after_locked()
+
+    def _load_locked(self) -> tuple[int, int]:
+        # (running, queued) for admitted turns.
+        in_flight = self._running + self._queued
+        if self.scheduler is None:
+            return self._running, self._queued
+        running = min(in_flight, int(self.scheduler.snapshot()["running"]))
+        return running, in_flight - running
+
+    def _retry_after_locked(self) -> int:
+        if self.scheduler is not None:
+            _, durations = self.scheduler.service_stats()
+            capacity = self.scheduler.capacity
+        else:
+            durations = list(self._durations_ms)
+            capacity = self.workers
+        _, queued = self._load_locked()
+        average_s = (sum(durations) / len(durations) / 1000.0) if durations else 5.0
+        estimate = average_s * (queued + 1) / capacity
+        return int(min(300, max(1, math.ceil(estimate))))
+
+    def submit(self, fn: Callable[..., Any], *args: Any) -> Future:
+        with self._lock:
+            if self._running + self._queued >= self.workers + self.max_queue:
+                self._rejected += 1
+                retry_after = self._retry_after_locked()
+                running, queued = self._load_locked()
+                raise AdmissionRejected(f"turn queue is full ({queued} waiting, {running} running)", retry_after)
+            self._queued += 1
+            self._admitted += 1
+        return self._executor.submit(self._run, time.perf_counter(), fn, args)
+
+    def _run(self, enqueued: float, fn: Callable[..., Any], args: tuple[Any, ...]) -> Any:
+        started = time.perf_counter()
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._waits_ms.append(int((started - enqueued) * 1000))
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._durations_ms.append(int((time.perf_counter() - started) * 1000))
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            running, queued = self._load_locked()
+            waits = sorted(self.scheduler.service_stats()[0] if self.scheduler is not None else self._waits_ms)
+            return {
+                "workers": self.scheduler.capacity if self.scheduler is not None else self.workers,
+                "max_queue": self.max_queue,
+                "running": running,
+                "queued": queued,
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "wait_ms": {
+                    "p50": waits[min(len(waits) - 1, int(len(waits) * 0.5))] if waits else None,
+                    "p95": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else None,
+                },
+                "retry_after_seconds": self._retry_after_locked(),
+            }
+
+
+class _QueuedTurn:
+    __slots__ = ("message", "coalescible", "done", "result", "error")
+
+    def __init__(self, message: str, coalescible: bool):
+        self.message = message
+        self.coalescible = coalescible
+        self.done = False
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+
+class SessionTurnCoordinator:
+    # One turn at a time per session, in arrival order. The turn at the head of a
+    # session's queue runs; with coalescing it also takes the messages queued behind
+    # it, and those callers receive the combined turn's result instead of running.
+    # Callers that are not coalescible (they stream their own events) always run
+    # their own turn, and merging stops at the first of them to keep order.
+    def __init__(self, coalesce: bool = False, max_batch: int = 5):
+        self.coalesce = coalesce
+        self.max_batch = max(1, int(max_batch))
+        self._cond = threading.Condition()
+        self._busy: set[Any] = set()
+        self._queues: dict[Any, list[_QueuedTurn]] = {}
+
+    def run(self, key: Any, message: str, turn_fn: Callable[[list[str]], Any], coalescible: bool = True) -> Any:
+        entry = _QueuedTurn(message, coalescible)
+        with self._cond:
+            pending = self._queues.setdefault(key, [])
+            pending.append(entry)
+            while not entry.done and (key in self._busy or pending[0] is not entry):
+                self._cond.wait()
+            if entry.done:
+                if entry.error is not None:
+                    raise entry.error
+                return entry.result
+            batch = [pending.pop(0)]
+            while self.coalesce and pending and pending[0].coalescible and len(batch) < self.max_batch:
+                batch.append(pending.pop(0))
+            self._busy.add(key)
+        result: Any = None
+        error: BaseException | None = None
+        try:
+            result = turn_fn([item.message for item in batch])
+        except BaseException as exc:
+            error = exc
+        with self._cond:
+            self._busy.discard(key)
+            for item in batch[1:]:
+                item.result = result
+                item.error = error
+                item.done = True
+            if not self._queues.get(key):
+                self._queues.pop(key, None)
+            self._cond.notify_all()
+        if error is not None:
+            raise error
+        return result
+
+    def snapshot(self) -> dict[str, int]:
+        with self._cond:
+            return {
+                "busy_sessions": len(self._busy),
+                "queued_turns": sum(len(pending) for pending in self._queues.values()),
+            }
@@ -1,26 +1,39 @@
 from __future__ import annotations
 
+import hashlib
 import json
+import logging
+import shutil
 import threading
+import time
 import uuid
 from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable
 
 from codeclaw.config import StorageConfig
+from codeclaw.metrics import STORAGE_OP
 
 try:
     import fcntl
 except ImportError:  # pragma: no cover
     fcntl = None
 
+log = logging.getLogger(__name__)
+
+EventListener = Callable[[str, str, dict], None]
+
 
 def _now() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+def _events_digest(events: list[dict]) -> str:
+    return hashlib.sha256(json.dumps(events, sort_keys=True).encode("utf-8")).hexdigest()
+
+
 def _parse_ts(value: str) -> datetime:
     dt = datetime.fromisoformat(value)
     if dt.tzinfo is None:
@@ -57,6 +70,15 @@ def _locked_file(path: Path):
                     fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
 
 
+@contextmanager
+def _timed_op(op: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STORAGE_OP.observe(time.perf_counter() - started, op=op)
+
+
 @dataclass
 class SessionRecord:
     id: str
@@ -73,6 +95,18 @@ class SessionStore:
         self.base_path = Path(config.base_path).expanduser()
         self.retention_days = config.retention_days
         self.compact_interval_hours = config.compact_interval_hours
+        self._listeners: list[EventListener] = []
+        self._listeners_lock = threading.Lock()
+
+    def add_listener(self, listener: EventListener) -> None:
+        with self._listeners_lock:
+            if listener not in self._listeners:
+                self._listeners.append(listener)
+
+    def remove_listener(self, listener: EventListener) -> None:
+        with self._listeners_lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
 
     def _session_dir(self, agent_id: str) -> Path:
         return self.base_path / agent_id / "sessions"
@@ -89,6 +123,20 @@ class SessionStore:
     def _events_path(self, agent_id: str, session_id: str) -> Path:
         return self._session_dir(agent_id) / f"{session_id}.jsonl"
 
+    def _prepared_summary_path(self, agent_id: str, session_id: str) -> Path:
+        return self._session_dir(agent_id) / f"{session_id}.summary.json"
+
+    def artifacts_path(self, agent_id: str, session_id: str) -> Path:
+        return self._session_dir(agent_id) / f"{session_id}.artifacts"
+
+    def _turn_lock_path(self, agent_id: str, session_id: str) -> Path:
+        return self._session_dir(agent_id) / f"{session_id}.turn.lock"
+
+    @contextmanager
+    def session_turn_lock(self, agent_id: str, session_id: str):
+        with _locked_file(self._turn_lock_path(agent_id, session_id)):
+            yield
+
     def _lock_path(self, agent_id: str) -> Path:
         return self._session_dir(agent_id) / ".store.lock"
 
@@ -138,7 +186,7 @@ class SessionStore:
                 handle.write(json.dumps(event) + "\n")
 
     def list_sessions(self, agent_id: str) -> list[dict]:
-        with self._agent_lock(agent_id):
+        with _timed_op("list_sessions"), self._agent_lock(agent_id):
             return self._load_index_unlocked(agent_id)
 
     def find_latest_session(self, agent_id: str, channel: str, peer: str) -> dict | None:
@@ -158,7 +206,7 @@ class SessionStore:
         return None
 
     def create_session(self, agent_id: str, channel: str, peer: str, title: str) -> dict:
-        with self._agent_lock(agent_id):
+        with _timed_op("create_session"), self._agent_lock(agent_id):
             session_id = f"{agent_id}-{uuid.uuid4().hex}"
             session = SessionRecord(
                 id=session_id,
@@ -204,16 +252,39 @@ class SessionStore:
         with self._agent_lock(agent_id):
             self._touch_session_unlocked(agent_id, session_id)
 
-    def append_event(self, agent_id: str, session_id: str, event: dict) -> None:
-        with self._agent_lock(agent_id):
+    def _next_seq_unlocked(self, sessions: list[dict], agent_id: str, session_id: str) -> int:
+        # Per-session event sequence, persisted in the index so it keeps increasing
+        # across restarts and transcript compaction.
+        for session in sessions:
+            if session.get("id") == session_id:
+                last_seq = session.get("last_seq")
+                if not isinstance(last_seq, int):
+                    last_seq = len(self._read_events_unlocked(agent_id, session_id))
+                session["last_seq"] = last_seq + 1
+                session["updated_at"] = _now()
+                return last_seq + 1
+        return len(self._read_events_unlocked(agent_id, session_id)) + 1
+
+    def append_event(self, agent_id: str, session_id: str, event: dict) -> dict:
+        with _timed_op("append_event"), self._agent_lock(agent_id):
             path = self._events_path(agent_id, session_id)
             path.parent.mkdir(parents=True, exist_ok=True)
+            sessions = self._load_index_unlocked(agent_id)
             event_to_write = dict(event)
             event_to_write.setdefault("created_at", _now())
+            event_to_write["seq"] = self._next_seq_unlocked(sessions, agent_id, session_id)
             with path.open("a", encoding="utf-8") as handle:
                 handle.write(json.dumps(event_to_write) + "\n")
-            self._touch_session_unlocked(agent_id, session_id)
+            self._save_index_unlocked(agent_id, sessions)
             self._compact_if_needed_unlocked(agent_id)
+        with self._listeners_lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(agent_id, session_id, event_to_write)
+            except Exception as exc:  # noqa: BLE001
+                log.warning("session event listener failed agent_id=%s session_id=%s err=%s", agent_id, session_id, exc)
+        return event_to_write
 
     def append_audit(self, agent_id: str, entry: dict[str, Any]) -> None:
         with self._agent_lock(agent_id):
@@ -224,8 +295,47 @@ class SessionStore:
             with path.open("a", encoding="utf-8") as handle:
                 handle.write(json.dumps(payload) + "\n")
 
+    def _file_generation(self, path: Path) -> str:
+        try:
+            stat = path.stat()
+        except OSError:
+            return "0"
+        return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+    def sessions_generation(self, agent_id: str) -> str:
+        # The index is small and rewritten in place (often at the same size), so hash it.
+        try:
+            return hashlib.sha256(self._index_path(agent_id).read_bytes()).hexdigest()[:16]
+        except OSError:
+            return "0"
+
+    def events_generation(self, agent_id: str, session_id: str) -> str:
+        # Transcripts only grow between compactions, so size + mtime identify a version.
+        return self._file_generation(self._events_path(agent_id, session_id))
+
+    # The *_snapshot readers take the generation and the data under one lock so they
+    # always match; the data is skipped when unchanged(generation) says the caller
+    # already has it.
+    def sessions_snapshot(
+        self, agent_id: str, unchanged: Callable[[str], bool] | None = None
+    ) -> tuple[str, list[dict] | None]:
+        with _timed_op("list_sessions"), self._agent_lock(agent_id):
+            generation = self.sessions_generation(agent_id)
+            if unchanged is not None and unchanged(generation):
+                return generation, None
+            return generation, self._load_index_unlocked(agent_id)
+
+    def events_snapshot(
+        self, agent_id: str, session_id: str, unchanged: Callable[[str], bool] | None = None
+    ) -> tuple[str, list[dict] | None]:
+        with _timed_op("read_events"), self._agent_lock(agent_id):
+            generation = self.events_generation(agent_id, session_id)
+            if unchanged is not None and unchanged(generation):
+                return generation, None
+            return generation, self._read_events_unlocked(agent_id, session_id)
+
     def read_events(self, agent_id: str, session_id: str) -> list[dict]:
-        with self._agent_lock(agent_id):
+        with _timed_op("read_events"), self._agent_lock(agent_id):
             return self._read_events_unlocked(agent_id, session_id)
 
     def compact_if_needed(self, agent_id: str) -> None:
@@ -268,6 +378,9 @@ class SessionStore:
                 path = self._events_path(agent_id, session_id)
                 if path.exists():
                     path.unlink()
+                self._prepared_summary_path(agent_id, session_id).unlink(missing_ok=True)
+                shutil.rmtree(self.artifacts_path(agent_id, session_id), ignore_errors=True)
+                self._turn_lock_path(agent_id, session_id).unlink(missing_ok=True)
         self._save_index_unlocked(agent_id, kept)
 
     def compact_session_context(
@@ -298,6 +411,47 @@ class SessionStore:
             self._touch_session_unlocked(agent_id, session_id)
             return {"compacted": True, "source_events": len(head), "kept_events": len(tail)}
 
+    def save_prepared_summary(self, agent_id: str, session_id: str, head: list[dict], summary_text: str) -> None:
+        with self._agent_lock(agent_id):
+            path = self._prepared_summary_path(agent_id, session_id)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            payload = {
+                "summary": summary_text,
+                "source_event_count": len(head),
+                "head_digest": _events_digest(head),
+                "created_at": _now(),
+            }
+            path.write_text(json.dumps(payload))
+
+    def apply_prepared_summary(self, agent_id: str, session_id: str) -> dict[str, Any]:
+        with self._agent_lock(agent_id):
+            path = self._prepared_summary_path(agent_id, session_id)
+            if not path.exists():
+                return {"compacted": False, "reason": "no_prepared_summary"}
+            try:
+                prepared = json.loads(path.read_text())
+            except json.JSONDecodeError:
+                prepared = {}
+            path.unlink(missing_ok=True)
+            if not isinstance(prepared, dict) or not prepared.get("summary"):
+                return {"compacted": False, "reason": "invalid_prepared_summary"}
+            source_count = int(prepared.get("source_event_count") or 0)
+            events = self._read_events_unlocked(agent_id, session_id)
+            if source_count <= 0 or len(events) <= source_count:
+                return {"compacted": False, "reason": "stale_prepared_summary"}
+            if _events_digest(events[:source_count]) != prepared.get("head_digest"):
+                return {"compacted": False, "reason": "stale_prepared_summary"}
+            summary_event = {
+                "role": "summary",
+                "content": str(prepared["summary"]),
+                "meta": {"source_event_count": source_count, "prepared_at": prepared.get("created_at")},
+                "created_at": _now(),
+            }
+            tail = events[source_count:]
+            self._write_events_unlocked(agent_id, session_id, [summary_event, *tail])
+            self._touch_session_unlocked(agent_id, session_id)
+            return {"compacted": True, "source_events": source_count, "kept_events": len(tail)}
+
     def _summarize_events(self, events: list[dict], summary_line_limit: int) -> str:
         lines: list[str] = []
         for event in events:
@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import logging
+import queue
+import re
+import threading
+from typing import Any, Callable
+
+from codeclaw.config import AppConfig
+from codeclaw.storage import SessionStore
+
+log = logging.getLogger(__name__)
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+_SUMMARY_HEADERS = {"compacted session summary:", "rolling session summary:"}
+
+
+def _first_sentence(text: str, max_chars: int = 200) -> str:
+    collapsed = " ".join(text.split())
+    sentence = _SENTENCE_SPLIT.split(collapsed, maxsplit=1)[0]
+    if len(sentence) <= max_chars:
+        return sentence
+    cut = sentence[:max_chars].rsplit(" ", 1)[0] or sentence[:max_chars]
+    return cut + "..."
+
+
+def summarize_events_locally(events: list[dict], summary_line_limit: int) -> str:
+    # Extractive rolling summary: carry forward earlier summaries, then keep the
+    # leading sentence of each user/assistant message with duplicates removed.
+    lines: list[str] = []
+    seen: set[str] = set()
+
+    def _add(line: str) -> None:
+        key = line.lower()
+        if key in seen:
+            return
+        seen.add(key)
+        lines.append(line)
+
+    for event in events:
+        role = str(event.get("role", "")).strip().lower()
+        content = str(event.get("content", "")).strip()
+        if not content:
+            continue
+        if role == "summary":
+            for raw in content.splitlines():
+                stripped = raw.strip()
+                if stripped and stripped.lower() not in _SUMMARY_HEADERS:
+                    _add(stripped if stripped.startswith("- ") else f"- {stripped}")
+        elif role in {"user", "assistant"}:
+            prefix = "User" if role == "user" else "Assistant"
+            _add(f"- {prefix}: {_first_sentence(content)}")
+    if not lines:
+        return ""
+    limit = max(1, summary_line_limit)
+    return "Rolling session summary:\n" + "\n".join(lines[-limit:])
+
+
+class ContextSummarizer:
+    def __init__(self, config: AppConfig, store: SessionStore, llm_factory: Callable[[str, str], Any]):
+        self.config = config
+        self.store = store
+        self._llm_factory = llm_factory
+        self._queue: queue.Queue[tuple[str, str] | None] = queue.Queue()
+        self._pending: set[tuple[str, str]] = set()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def watermark_tokens(self) -> int:
+        context_cfg = self.config.context
+        threshold = max(1, context_cfg.context_window_tokens - context_cfg.reserve_tokens - context_cfg.compact_trigger_tokens)
+        ratio = min(1.0, max(0.05, float(context_cfg.summary_watermark_ratio)))
+        return max(1, int(threshold * ratio))
+
+    def observe(self, agent_id: str, session_id: str, estimated_tokens: int) -> bool:
+        if not self.config.context.background_summary_enabled:
+            return False
+        if estimated_tokens < self.watermark_tokens():
+            return False
+        key = (agent_id, session_id)
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True, name="codeclaw-summarizer")
+                self._thread.start()
+        self._queue.put(key)
+        return True
+
+    def stop(self) -> None:
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+
+    def _run(self) -> None:
+        while True:
+            key = self._queue.get()
+            if key is None:
+                return
+            try:
+                self.prepare(*key)
+            except Exception as exc:  # noqa: BLE001
+                log.exception("background summary failed agent=%s session=%s err=%s", key[0], key[1], exc)
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+
+    def prepare(self, agent_id: str, session_id: str) -> dict[str, Any]:
+        context_cfg = self.config.context
+        events = self.store.read_events(agent_id, session_id)
+        keep_recent_events = max(4, context_cfg.keep_recent_events)
+        if len(events) <= keep_recent_events + 1:
+            return {"prepared": False, "reason": "not_enough_events"}
+        head = events[:-keep_recent_events]
+        summary_text = self._summarize(agent_id, head)
+        if not summary_text:
+            return {"prepared": False, "reason": "empty_summary"}
+        self.store.save_prepared_summary(agent_id, session_id, head, summary_text)
+        log.info("background summary prepared agent=%s session=%s source_events=%s", agent_id, session_id, len(head))
+        return {"prepared": True, "source_events": len(head)}
+
+    def _summarize(self, agent_id: str, events: list[dict]) -> str:
+        line_limit = self.config.context.summary_line_limit
+        model = self.config.context.summary_model.strip()
+        if model:
+            try:
+                return self._summarize_with_model(agent_id, model, events, line_limit)
+            except Exception as exc:  # noqa: BLE001
+                log.warning("summary model failed agent=%s model=%s err=%s; using local summary", agent_id, model, exc)
+        return summarize_events_locally(events, line_limit)
+
+    def _summarize_with_model(self, agent_id: str, model: str, events: list[dict], line_limit: int) -> str:
+        from langchain_core.messages import HumanMessage, SystemMessage
+
+        transcript = summarize_events_locally(events, line_limit * 4)
+        if not transcript:
+            return ""
+        llm = self._llm_factory(agent_id, model)
+        response = llm.invoke(
+            [
+                SystemMessage(
+                    content=(
+                        f"Condense this conversation log into at most {line_limit} short bullet points. "
+                        "Preserve decisions, preferences, names, dates, file paths and open tasks."
+                    )
+                ),
+                HumanMessage(content=transcript),
+            ]
+        )
+        text = str(getattr(response, "content", "") or "").strip()
+        if not text:
+            return ""
+        return "Rolling session summary:\n" + text
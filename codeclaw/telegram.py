@@ -8,14 +8,23 @@ import threading
 import time
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable
 
 import httpx
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
 from codeclaw.config import AppConfig, load_config
+from codeclaw.metrics import TELEGRAM_DROPPED, TELEGRAM_RETRIES
 
 log = logging.getLogger(__name__)
 
+# Bot API limit on the text of one message.
+_TELEGRAM_MAX_CHARS = 4096
+
 
 @dataclass
 class WorkItem:
@@ -35,6 +44,7 @@ class ChatWorker:
         self.queue: queue.Queue[WorkItem | None] = queue.Queue(maxsize=max(1, int(config.telegram.max_queue_per_chat)))
         self._thread = threading.Thread(target=self._run, daemon=True, name=f"codeclaw-tg-chat-{chat_id}")
         self._session_id: str | None = None
+        self._carry: WorkItem | None = None
         self._processed = 0
         self._last_update_id = 0
         self._last_duration_ms = 0
@@ -68,23 +78,63 @@ class ChatWorker:
             "active": self._running,
         }
 
+    def _next_item(self) -> WorkItem | None:
+        if self._carry is not None:
+            item, self._carry = self._carry, None
+            return item
+        return self.queue.get()
+
+    @staticmethod
+    def _coalescible(item: WorkItem | None) -> bool:
+        # Plain text only: voice needs transcription and slash commands must run alone.
+        if item is None:
+            return False
+        text = item.text.strip()
+        return bool(text) and not text.startswith("/")
+
+    def _drain_text_items(self) -> list[WorkItem]:
+        # Text that piled up while the previous turn ran; stops at the first item that
+        # cannot be merged (voice, command, stop marker), carried to the next iteration.
+        drained: list[WorkItem] = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return drained
+            if not self._coalescible(item):
+                self._carry = item
+                return drained
+            drained.append(item)
+
     def _run(self) -> None:
         while self._running:
-            item = self.queue.get()
+            item = self._next_item()
+            items = [item]
             try:
                 if item is None:
                     return
+                if self.config.telegram.coalesce_messages and self._coalescible(item):
+                    items.extend(self._drain_text_items())
+                if len(items) > 1:
+                    log.info("telegram coalesced chat_id=%s messages=%s", self.chat_id, len(items))
+                    item = WorkItem(
+                        update_id=items[-1].update_id,
+                        chat_id=self.chat_id,
+                        text="\n\n".join(entry.text.strip() for entry in items),
+                    )
                 self._process_item(item)
             except Exception as exc:  # noqa: BLE001
                 self._last_error = f"{exc.__class__.__name__}: {exc}"
                 log.exception("telegram worker failure chat_id=%s err=%s", self.chat_id, exc)
             finally:
-                self.queue.task_done()
+                for _ in items:
+                    self.queue.task_done()
 
     def _process_item(self, item: WorkItem) -> None:
         typing = TypingLoop(self.config, self.chat_id)
         typing.start()
         started = time.perf_counter()
+        partial = PartialReply(self.config, self.chat_id) if self.config.telegram.stream_partial_replies else None
         try:
             user_text = item.text.strip()
             if not user_text and item.voice_file_id:
@@ -132,7 +182,10 @@ class ChatWorker:
                 self._session_id,
                 str(self.chat_id),
                 queue_depth=self.queue.qsize(),
-                stream_partial=self.config.telegram.stream_partial_replies,
+                stream_partial=partial is not None,
+                on_event=partial.on_event if partial is not None else None,
+                # Telegram redelivers an update after a lost ack; the key makes that a replay.
+                idempotency_key=f"telegram:{self.chat_id}:{item.update_id}",
             )
         finally:
             typing.stop()
@@ -149,12 +202,8 @@ class ChatWorker:
             self._last_error = str(result.get("error", "Request failed."))
             reply = self._last_error.strip() or "Request failed."
 
-        _send_telegram_message(
-            self.config,
-            self.chat_id,
-            reply,
-            stream_partial=self.config.telegram.stream_partial_replies,
-        )
+        if partial is None or not partial.finish(reply):
+            _send_telegram_message(self.config, self.chat_id, reply, stream_partial=False)
         log.info(
             "telegram turn chat_id=%s update_id=%s duration_ms=%s queue_depth=%s ok=%s",
             self.chat_id,
@@ -165,6 +214,64 @@ class ChatWorker:
         )
 
 
+class PartialReply:
+    # Shows streamed assistant deltas as one Telegram message that is edited in place.
+    def __init__(self, config: AppConfig, chat_id: int):
+        self.config = config
+        self.chat_id = chat_id
+        self._text = ""
+        self._shown = ""
+        self._message_id: int | None = None
+        self._last_edit = 0.0
+        self._chunk_chars = max(80, int(config.telegram.partial_reply_chunk_chars))
+        self._min_interval = max(0.01, float(config.telegram.partial_reply_delay_seconds))
+
+    def on_event(self, event: dict[str, Any]) -> None:
+        kind = event.get("type")
+        if kind == "reset":
+            self._text = ""
+            return
+        if kind != "delta":
+            return
+        self._text += str(event.get("text", ""))
+        if len(self._text) - len(self._shown) < self._chunk_chars or len(self._text.strip()) > _TELEGRAM_MAX_CHARS:
+            return
+        if time.monotonic() - self._last_edit < self._min_interval:
+            return
+        self._show(self._text)
+
+    def finish(self, reply: str) -> bool:
+        # False means the reply is not in the partial message and must be sent normally.
+        if self._message_id is None or len(reply.strip()) > _TELEGRAM_MAX_CHARS:
+            return False
+        return self._show(reply)
+
+    def _show(self, text: str) -> bool:
+        normalized = text.strip()
+        if not normalized:
+            return False
+        if normalized == self._shown:
+            return True
+        if self._message_id is None:
+            sent = _telegram_api_post(self.config, "sendMessage", {"chat_id": self.chat_id, "text": normalized})
+            result = sent.get("result") if sent.get("ok") else None
+            message_id = result.get("message_id") if isinstance(result, dict) else None
+            if not isinstance(message_id, int):
+                return False
+            self._message_id = message_id
+        else:
+            edited = _telegram_api_post(
+                self.config,
+                "editMessageText",
+                {"chat_id": self.chat_id, "message_id": self._message_id, "text": normalized},
+            )
+            if not edited.get("ok"):
+                return False
+        self._shown = normalized
+        self._last_edit = time.monotonic()
+        return True
+
+
 class TelegramDispatcher:
     def __init__(self, config: AppConfig):
         self.config = config
@@ -178,6 +285,7 @@ class TelegramDispatcher:
         accepted = worker.enqueue(item)
         if not accepted:
             self._dropped_updates += 1
+            TELEGRAM_DROPPED.inc()
             log.warning("telegram queue full for chat_id=%s; dropping update_id=%s", item.chat_id, item.update_id)
 
     def stop(self) -> None:
@@ -279,27 +387,56 @@ def _send_gateway(
     peer: str,
     queue_depth: int | None = None,
     stream_partial: bool = False,
+    on_event: Callable[[dict[str, Any]], None] | None = None,
+    idempotency_key: str | None = None,
 ) -> dict:
     timeout_seconds = int(os.environ.get("CODECLAW_TELEGRAM_GATEWAY_TIMEOUT", "300"))
     timeout = httpx.Timeout(connect=10.0, read=float(timeout_seconds), write=30.0, pool=30.0)
+    streaming = stream_partial and on_event is not None
     payload: dict[str, Any] = {
         "agent_id": agent_id,
         "message": message,
         "session_id": session_id,
         "channel": "telegram",
         "peer": peer,
-        "stream_partial": stream_partial,
+        "stream_partial": streaming,
     }
     if queue_depth is not None:
         payload["queue_depth"] = int(queue_depth)
+    if idempotency_key:
+        payload["idempotency_key"] = idempotency_key
+    url = f"{_gateway_url(config)}/api/session/send"
+    busy_retries = max(0, int(os.environ.get("CODECLAW_TELEGRAM_GATEWAY_BUSY_RETRIES", "3")))
+    attempt = 0
+    while True:
+        attempt += 1
+        if streaming:
+            result = _stream_gateway(url, payload, timeout, on_event)
+        else:
+            result = _post_gateway(url, payload, timeout)
+        retry_after = result.pop("retry_after_seconds", None)
+        if retry_after is None or attempt > busy_retries:
+            return result
+        # Gateway turn queue is full: defer this chat's turn instead of failing it.
+        log.info("gateway busy peer=%s attempt=%s retry_after=%s", peer, attempt, retry_after)
+        TELEGRAM_RETRIES.inc(reason="gateway_busy")
+        time.sleep(retry_after)
+
+
+def _retry_after_seconds(resp: Any) -> float:
     try:
-        resp = httpx.post(
-            f"{_gateway_url(config)}/api/session/send",
-            json=payload,
-            timeout=timeout,
-        )
+        return min(300.0, max(1.0, float(resp.headers.get("Retry-After", "1"))))
+    except (AttributeError, TypeError, ValueError):
+        return 1.0
+
+
+def _post_gateway(url: str, payload: dict[str, Any], timeout: httpx.Timeout) -> dict:
+    try:
+        resp = httpx.post(url, json=payload, timeout=timeout)
     except httpx.RequestError as exc:
         return {"ok": False, "error": f"Gateway request failed: {exc}"}
+    if resp.status_code == 429:
+        return {"ok": False, "error": "Gateway is busy; try again shortly.", "retry_after_seconds": _retry_after_seconds(resp)}
     try:
         data = resp.json()
     except ValueError:
@@ -309,6 +446,41 @@ def _send_gateway(
     return {"ok": False, "error": "Gateway returned invalid JSON payload."}
 
 
+def _stream_gateway(
+    url: str,
+    payload: dict[str, Any],
+    timeout: httpx.Timeout,
+    on_event: Callable[[dict[str, Any]], None],
+) -> dict:
+    result: dict[str, Any] = {"ok": False, "error": "Gateway stream ended without a result."}
+    try:
+        with httpx.stream("POST", url, json=payload, timeout=timeout) as resp:
+            if resp.status_code == 429:
+                return {
+                    "ok": False,
+                    "error": "Gateway is busy; try again shortly.",
+                    "retry_after_seconds": _retry_after_seconds(resp),
+                }
+            if resp.status_code >= 400:
+                return {"ok": False, "error": f"Gateway stream failed (HTTP {resp.status_code})."}
+            for line in resp.iter_lines():
+                if not line.strip():
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if not isinstance(event, dict):
+                    continue
+                if event.get("type") in {"result", "error"}:
+                    result = event
+                    continue
+                on_event(event)
+    except httpx.RequestError as exc:
+        return {"ok": False, "error": f"Gateway request failed: {exc}"}
+    return result
+
+
 def _offset_path(config: AppConfig) -> Path:
     return Path(config.telegram.offset_path).expanduser()
 
@@ -388,6 +560,7 @@ def _telegram_api_post(
         except httpx.RequestError as exc:
             if attempt > retries:
                 return {"ok": False, "error": f"telegram request failed: {exc}"}
+            TELEGRAM_RETRIES.inc(reason="network")
             time.sleep(backoff * attempt)
             continue
 
@@ -405,12 +578,14 @@ def _telegram_api_post(
                     retry_after = retry_after_raw
             if attempt > retries:
                 return {"ok": False, "error": "telegram rate limit exceeded", "response": data}
+            TELEGRAM_RETRIES.inc(reason="rate_limit")
             time.sleep(max(backoff * attempt, retry_after))
             continue
 
         if response.status_code >= 500:
             if attempt > retries:
                 return {"ok": False, "error": f"telegram server error {response.status_code}", "response": data}
+            TELEGRAM_RETRIES.inc(reason="server_error")
             time.sleep(backoff * attempt)
             continue
 
@@ -631,6 +806,72 @@ def start_poller_in_background(config: AppConfig) -> TelegramPoller:
         return poller
 
 
+class PollerLeader:
+    # With several gateway workers, only the process holding an exclusive flock on
+    # <offset_path>.lock runs the poller. The OS drops the lock when the leader exits,
+    # and followers retry every leader_retry_seconds, so polling fails over on its own.
+    def __init__(self, config: AppConfig):
+        self.config = config
+        self.lock_path = _offset_path(config).with_suffix(".lock")
+        self.retry_seconds = max(0.05, float(config.telegram.leader_retry_seconds))
+        self._handle = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._handle is not None
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="codeclaw-telegram-leader")
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=3.0)
+        if self.is_leader:
+            stop_active_poller()
+            self._release()
+
+    def status(self) -> dict[str, Any]:
+        return {"leader": self.is_leader, "pid": os.getpid(), "lock_path": str(self.lock_path)}
+
+    def _try_acquire(self) -> bool:
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        handle = self.lock_path.open("a+", encoding="utf-8")
+        if fcntl is not None:
+            try:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                return False
+        handle.seek(0)
+        handle.truncate()
+        handle.write(f"{os.getpid()}\n")
+        handle.flush()
+        self._handle = handle
+        return True
+
+    def _release(self) -> None:
+        handle, self._handle = self._handle, None
+        if handle is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+        handle.close()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            if not self.is_leader and self._try_acquire():
+                log.info("telegram poller leader elected pid=%s lock=%s", os.getpid(), self.lock_path)
+                start_poller_in_background(self.config)
+            self._stop.wait(self.retry_seconds)
+
+
 def stop_active_poller() -> None:
     global _ACTIVE_POLLER
     with _POLLER_LOCK:
@@ -1,8 +1,10 @@
 from __future__ import annotations
 
+import hashlib
 import json
 import os
 import pwd
+import re
 import subprocess
 from datetime import datetime, timezone
 from pathlib import Path
@@ -15,6 +17,7 @@ from codeclaw.config import ToolsConfig
 
 
 FILE_INDEX_NAME = "FILE_INDEX.json"
+_ARTIFACT_HANDLE = re.compile(r"^[0-9a-f]{16}$")
 
 
 class ToolApprovalRequired(Exception):
@@ -179,10 +182,77 @@ def _web_fetch(args: dict[str, Any]) -> dict[str, Any]:
     return {"ok": True, "status": resp.status_code, "text": resp.text}
 
 
+class ArtifactStore:
+    # Full copies of oversized tool outputs for one session, addressed by a content
+    # hash so a repeated output (the same file read twice) is stored once.
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+
+    def put(self, text: str) -> str:
+        handle = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+        path = self.directory / f"{handle}.txt"
+        if not path.exists():
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_text(text, encoding="utf-8")
+            os.replace(tmp_path, path)
+        return handle
+
+    def read(self, handle: str, offset: int = 0, limit: int = 4000) -> dict[str, Any]:
+        handle = str(handle or "").strip()
+        if not _ARTIFACT_HANDLE.match(handle):
+            return {"ok": False, "error": f"invalid artifact handle: {handle!r}"}
+        path = self.directory / f"{handle}.txt"
+        if not path.exists():
+            return {"ok": False, "error": f"artifact not found: {handle}"}
+        text = path.read_text(encoding="utf-8")
+        offset = max(0, int(offset))
+        chunk = text[offset : offset + max(1, int(limit))]
+        next_offset = offset + len(chunk)
+        return {
+            "ok": True,
+            "artifact": handle,
+            "offset": offset,
+            "text": chunk,
+            "total_chars": len(text),
+            "next_offset": next_offset if next_offset < len(text) else None,
+        }
+
+
+def apply_result_budget(
+    result: dict[str, Any],
+    artifacts: ArtifactStore | None,
+    max_chars: int,
+    preview_chars: int,
+) -> dict[str, Any]:
+    if artifacts is None or max_chars <= 0 or not isinstance(result, dict):
+        return result
+    budgeted = dict(result)
+    offloaded: dict[str, dict[str, Any]] = {}
+    for key, value in result.items():
+        if not isinstance(value, str) or len(value) <= max_chars:
+            continue
+        handle = artifacts.put(value)
+        head_chars = max(0, min(preview_chars, max_chars) // 2)
+        tail_chars = max(0, min(preview_chars, max_chars) - head_chars)
+        omitted = len(value) - head_chars - tail_chars
+        tail = value[-tail_chars:] if tail_chars else ""
+        budgeted[key] = (
+            f"{value[:head_chars]}\n"
+            f"[... {omitted} chars omitted; page with artifact_read(handle='{handle}', offset={head_chars}) ...]\n"
+            f"{tail}"
+        )
+        offloaded[key] = {"handle": handle, "chars": len(value)}
+    if offloaded:
+        budgeted["artifacts"] = offloaded
+    return budgeted
+
+
 class ToolRegistry:
-    def __init__(self, config: ToolsConfig, approvals: ApprovalsStore):
+    def __init__(self, config: ToolsConfig, approvals: ApprovalsStore, artifacts: ArtifactStore | None = None):
         self.config = config
         self.approvals = approvals
+        self.artifacts = artifacts
 
     def ensure_approved(self, tool: str, channel: str, interactive: bool) -> None:
         if self.approvals.is_allowed(tool):
@@ -195,7 +265,15 @@ class ToolRegistry:
         raise ToolApprovalRequired(tool, f"Tool '{tool}' requires approval")
 
     def execute(self, tool: str, args: dict[str, Any], channel: str, interactive: bool) -> dict[str, Any]:
+        if tool == "artifact.read":
+            if self.artifacts is None:
+                return {"ok": False, "error": "no artifact store configured"}
+            return self.artifacts.read(args.get("handle", ""), args.get("offset", 0), args.get("limit", 4000))
         self.ensure_approved(tool, channel, interactive)
+        result = self._dispatch(tool, args, channel)
+        return apply_result_budget(result, self.artifacts, self.config.result_max_chars, self.config.result_preview_chars)
+
+    def _dispatch(self, tool: str, args: dict[str, Any], channel: str) -> dict[str, Any]:
         if tool == "exec":
             return _exec_tool(args, self.config.exec_allowlist)
         if tool == "file.read":
@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import gzip
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+log = logging.getLogger(__name__)
+
+TraceExporter = Callable[[dict[str, Any]], None]
+
+_exporters: list[TraceExporter] = []
+_exporters_lock = threading.Lock()
+
+
+class Span:
+    __slots__ = ("name", "attrs", "started", "ended", "children")
+
+    def __init__(self, name: str, attrs: dict[str, Any] | None = None):
+        self.name = name
+        self.attrs: dict[str, Any] = dict(attrs or {})
+        self.started = time.perf_counter()
+        self.ended: float | None = None
+        self.children: list[Span] = []
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+    def end(self) -> None:
+        if self.ended is None:
+            self.ended = time.perf_counter()
+
+    def to_dict(self, origin: float) -> dict[str, Any]:
+        ended = self.ended if self.ended is not None else time.perf_counter()
+        payload: dict[str, Any] = {
+            "name": self.name,
+            "start_ms": round((self.started - origin) * 1000, 2),
+            "duration_ms": round((ended - self.started) * 1000, 2),
+        }
+        if self.attrs:
+            payload["attrs"] = dict(self.attrs)
+        if self.children:
+            payload["children"] = [child.to_dict(origin) for child in self.children]
+        return payload
+
+
+class TurnTrace:
+    # Nested timing spans for one turn. Each thread keeps its own span stack, so work
+    # handed to helper threads (hedged attempts) passes an explicit parent instead.
+    def __init__(self, name: str, **attrs: Any):
+        self.root = Span(name, attrs)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def current(self) -> Span:
+        stack = getattr(self._local, "stack", None)
+        return stack[-1] if stack else self.root
+
+    @contextmanager
+    def span(self, name: str, parent: Span | None = None, **attrs: Any) -> Iterator[Span]:
+        span = Span(name, attrs)
+        with self._lock:
+            (parent or self.current()).children.append(span)
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as exc:
+            span.set(error=exc.__class__.__name__)
+            raise
+        finally:
+            span.end()
+            stack.pop()
+
+    def finish(self, **attrs: Any) -> dict[str, Any]:
+        self.root.set(**attrs)
+        self.root.end()
+        with self._lock:
+            return self.root.to_dict(self.root.started)
+
+
+def add_exporter(exporter: TraceExporter) -> None:
+    with _exporters_lock:
+        if exporter not in _exporters:
+            _exporters.append(exporter)
+
+
+def remove_exporter(exporter: TraceExporter) -> None:
+    with _exporters_lock:
+        if exporter in _exporters:
+            _exporters.remove(exporter)
+
+
+def export_trace(trace: dict[str, Any]) -> None:
+    with _exporters_lock:
+        exporters = list(_exporters)
+    for exporter in exporters:
+        try:
+            exporter(trace)
+        except Exception as exc:  # noqa: BLE001
+            log.warning("trace exporter failed exporter=%s err=%s", getattr(exporter, "__name__", exporter), exc)
+
+
+class TracingPolicy:
+    # "off", "sampled:<rate>", "errors_only" or "slow_only:<ms>"; decided once the
+    # trace is finished so the hot path only records spans.
+    def __init__(self, mode: str, rate: float = 1.0, slow_ms: float = 0.0):
+        self.mode = mode
+        self.rate = rate
+        self.slow_ms = slow_ms
+
+    @classmethod
+    def parse(cls, text: str) -> TracingPolicy:
+        raw = str(text or "off").strip().lower()
+        name, _, arg = raw.partition(":")
+        try:
+            if name == "off" and not arg:
+                return cls("off")
+            if name == "errors_only" and not arg:
+                return cls("errors_only")
+            if name == "sampled":
+                rate = float(arg)
+                if 0.0 <= rate <= 1.0:
+                    return cls("sampled", rate=rate)
+            if name == "slow_only":
+                return cls("slow_only", slow_ms=max(0.0, float(arg)))
+        except ValueError:
+            pass
+        raise ValueError(f"invalid tracing policy {text!r}; expected off, sampled:<rate>, errors_only or slow_only:<ms>")
+
+    def should_export(self, trace: dict[str, Any]) -> bool:
+        if self.mode == "sampled":
+            return random.random() < self.rate
+        if self.mode == "errors_only":
+            return _has_error(trace)
+        if self.mode == "slow_only":
+            return float(trace.get("duration_ms") or 0) >= self.slow_ms
+        return False
+
+
+def _has_error(span: dict[str, Any]) -> bool:
+    if "error" in (span.get("attrs") or {}):
+        return True
+    return any(_has_error(child) for child in span.get("children") or [])
+
+
+class JsonlTraceExporter:
+    # Buffers traces in memory and appends them from a background thread as gzip
+    # members of traces-<YYYYMMDD>.jsonl.gz; a full buffer drops traces, never blocks.
+    def __init__(self, directory: str, batch_size: int = 50, flush_seconds: float = 5.0, max_pending: int = 10000):
+        self.directory = Path(directory).expanduser()
+        self.batch_size = max(1, int(batch_size))
+        self.flush_seconds = max(0.05, float(flush_seconds))
+        self.dropped = 0
+        self.written = 0
+        self._queue: queue.Queue[dict[str, Any] | None] = queue.Queue(maxsize=max(1, int(max_pending)))
+        self._thread = threading.Thread(target=self._run, daemon=True, name="codeclaw-trace-exporter")
+        self._thread.start()
+
+    def __call__(self, trace: dict[str, Any]) -> None:
+        record = dict(trace)
+        record.setdefault("exported_at", datetime.now(timezone.utc).isoformat())
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout: float = 5.0) -> None:
+        self._queue.put(None)
+        self._thread.join(timeout=timeout)
+
+    def _run(self) -> None:
+        batch: list[dict[str, Any]] = []
+        deadline: float | None = None
+        while True:
+            stop = False
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+                if item is None:
+                    stop = True
+                else:
+                    batch.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_seconds
+            except queue.Empty:
+                pass
+            if batch and (stop or len(batch) >= self.batch_size or time.monotonic() >= (deadline or 0.0)):
+                self._write(batch)
+                batch = []
+                deadline = None
+            if stop:
+                return
+
+    def _write(self, batch: list[dict[str, Any]]) -> None:
+        path = self.directory / f"traces-{datetime.now(timezone.utc).strftime('%Y%m%d')}.jsonl.gz"
+        payload = "".join(json.dumps(record, default=str) + "\n" for record in batch).encode("utf-8")
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with gzip.open(path, "ab") as handle:
+                handle.write(payload)
+            self.written += len(batch)
+        except OSError as exc:
+            log.warning("trace export failed path=%s traces=%s err=%s", path, len(batch), exc)
+
+
+_policy_exporter: TraceExporter | None = None
+_file_exporter: JsonlTraceExporter | None = None
+
+
+def configure_tracing(policy_text: str, directory: str, batch_size: int = 50, flush_seconds: float = 5.0) -> TracingPolicy:
+    global _policy_exporter, _file_exporter
+    policy = TracingPolicy.parse(policy_text)
+    with _exporters_lock:
+        previous, _policy_exporter = _policy_exporter, None
+    if previous is not None:
+        remove_exporter(previous)
+    if policy.mode == "off":
+        return policy
+    if _file_exporter is None or _file_exporter.directory != Path(directory).expanduser():
+        if _file_exporter is not None:
+            _file_exporter.close()
+        _file_exporter = JsonlTraceExporter(directory, batch_size=batch_size, flush_seconds=flush_seconds)
+    file_exporter = _file_exporter
+
+    def export_by_policy(trace: dict[str, Any]) -> None:
+        if policy.should_export(trace):
+            file_exporter(trace)
+
+    _policy_exporter = export_by_policy
+    add_exporter(export_by_policy)
+    return policy
@@ -1,7 +1,9 @@
 from __future__ import annotations
 
+import copy
 import json
 import os
+import threading
 from datetime import datetime
 from pathlib import Path
 from typing import Any
@@ -18,14 +20,43 @@ def _gateway_url(config):
     return f"http://{config.gateway.host}:{config.gateway.port}"
 
 
+_ETAG_CACHE: dict[str, tuple[str, Any]] = {}
+_ETAG_CACHE_LOCK = threading.Lock()
+_ETAG_CACHE_MAX = 128
+
+
+def _etag_cache_key(url: str, params: Any) -> str:
+    return url + "?" + json.dumps(params or {}, sort_keys=True, default=str)
+
+
 def _request_json(method: str, url: str, **kwargs):
+    # GETs revalidate with If-None-Match, so reruns of an idle page get empty 304s.
+    cache_key = _etag_cache_key(url, kwargs.get("params")) if method.upper() == "GET" else ""
+    cached = None
+    if cache_key:
+        with _ETAG_CACHE_LOCK:
+            cached = _ETAG_CACHE.get(cache_key)
+        if cached is not None:
+            headers = dict(kwargs.get("headers") or {})
+            headers.setdefault("If-None-Match", cached[0])
+            kwargs["headers"] = headers
     try:
         kwargs.setdefault("verify", False)
         response = httpx.request(method, url, **kwargs)
     except httpx.RequestError as exc:
         return {"ok": False, "error": str(exc)}
+    if response.status_code == 304 and cached is not None:
+        # Callers may mutate what they get back, so never hand out the cached object.
+        return copy.deepcopy(cached[1])
     try:
-        return response.json()
+        payload = response.json()
+        etag = response.headers.get("etag")
+        if cache_key and etag and response.status_code == 200:
+            with _ETAG_CACHE_LOCK:
+                if len(_ETAG_CACHE) >= _ETAG_CACHE_MAX and cache_key not in _ETAG_CACHE:
+                    _ETAG_CACHE.pop(next(iter(_ETAG_CACHE)))
+                _ETAG_CACHE[cache_key] = (etag, copy.deepcopy(payload))
+        return payload
     except ValueError:
         if response.text:
             return {"ok": False, "error": response.text[:500]}
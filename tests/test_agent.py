@@ -1,5 +1,9 @@
+import tempfile
+import threading
+import time
 from pathlib import Path
 
+import pytest
 from deepagents.backends import LocalShellBackend
 
 from codeclaw.agent import AgentRuntime
@@ -13,16 +17,26 @@ from codeclaw.config import (
     LangSmithConfig,
     LLMConfig,
     OpenAIConfig,
+    ResponseCacheConfig,
     StorageConfig,
     TelegramConfig,
     ToolsConfig,
+    WebSearchCacheConfig,
 )
+from codeclaw.storage import SessionStore
+from codeclaw.tracing import add_exporter, remove_exporter
 
 
 class _DummyStore:
     def read_events(self, agent_id, session_id):
         return []
 
+    def apply_prepared_summary(self, agent_id, session_id):
+        return {"compacted": False, "reason": "no_prepared_summary"}
+
+    def artifacts_path(self, agent_id, session_id):
+        return Path(tempfile.gettempdir()) / "codeclaw-test-artifacts" / agent_id / session_id
+
 
 def _config() -> AppConfig:
     return AppConfig(
@@ -36,6 +50,7 @@ def _config() -> AppConfig:
         storage=StorageConfig(),
         tools=ToolsConfig(),
         doctor=DoctorConfig(),
+        web_search_cache=WebSearchCacheConfig(disk_path=""),
     )
 
 
@@ -121,6 +136,52 @@ def test_web_search_tool_calls_openai_web_search(monkeypatch):
     assert captured_client["api_key"] == "k"
 
 
+def test_web_search_reuses_client_and_caches_normalized_queries(monkeypatch):
+    runtime = AgentRuntime(_config(), _DummyStore())
+    monkeypatch.setattr(runtime, "_llm", lambda _, __: object())
+    captured_agent = {}
+    counts = {"clients": 0, "calls": 0}
+    timings: list[dict] = []
+
+    def _fake_create_deep_agent(model=None, tools=None, system_prompt=None, backend=None, **kwargs):
+        captured_agent.update({"tools": tools})
+        return object()
+
+    class _DummyResponse:
+        output_text = "web answer"
+
+    class _DummyResponses:
+        def create(self, **kwargs):
+            counts["calls"] += 1
+            return _DummyResponse()
+
+    class _DummyClient:
+        def __init__(self, **kwargs):
+            counts["clients"] += 1
+            self.responses = _DummyResponses()
+
+    monkeypatch.setattr("codeclaw.agent.create_deep_agent", _fake_create_deep_agent)
+    monkeypatch.setattr("codeclaw.agent.OpenAI", _DummyClient)
+    for session_id in ("s1", "s2"):
+        runtime._deep_agent(
+            "default",
+            session_id=session_id,
+            user_msg="hello",
+            channel="cli",
+            interactive=False,
+            model="gpt-5",
+            tool_timings=timings,
+        )
+        web_tool = next(tool for tool in captured_agent["tools"] if getattr(tool, "__name__", "") == "web_search_openai")
+        web_tool("Latest  Updates " if session_id == "s1" else "latest updates")
+    result = web_tool("latest updates")
+
+    assert result == {"ok": True, "query": "latest updates", "answer": "web answer"}
+    assert counts == {"clients": 1, "calls": 1}
+    assert [timing["cache_hit"] for timing in timings] == [False, True, True]
+    assert all("saved_latency_ms" in timing for timing in timings[1:])
+
+
 def test_run_turn_returns_assistant_message_and_plan(monkeypatch):
     runtime = AgentRuntime(_config(), _DummyStore())
 
@@ -135,3 +196,327 @@ def test_run_turn_returns_assistant_message_and_plan(monkeypatch):
     result = runtime.run_turn("default", "s1", "hello", "webui", interactive=False)
     assert result["assistant_message"] == "done"
     assert result["plan"] == [{"content": "Step A", "status": "in_progress"}]
+
+
+def test_stream_turn_yields_deltas_plan_and_result(monkeypatch):
+    runtime = AgentRuntime(_config(), _DummyStore())
+
+    class _Chunk:
+        type = "AIMessageChunk"
+
+        def __init__(self, content):
+            self.content = content
+
+    class _StreamingDeepAgent:
+        def stream(self, payload, stream_mode=None):
+            yield ("messages", (_Chunk("do"), {}))
+            yield ("messages", (_Chunk("ne"), {}))
+            yield (
+                "values",
+                {
+                    "messages": [{"type": "assistant", "content": "done"}],
+                    "todos": [{"content": "Step A", "status": "completed"}],
+                },
+            )
+
+    monkeypatch.setattr(runtime, "_deep_agent", lambda *args, **kwargs: _StreamingDeepAgent())
+    events = list(runtime.stream_turn("default", "s1", "hello", "webui", interactive=False))
+
+    assert [event["text"] for event in events if event["type"] == "delta"] == ["do", "ne"]
+    assert {"type": "plan", "plan": [{"content": "Step A", "status": "completed"}]} in events
+    assert events[-1]["type"] == "result"
+    assert events[-1]["assistant_message"] == "done"
+
+
+def test_llm_requests_usage_on_streamed_responses():
+    runtime = AgentRuntime(_config(), _DummyStore())
+    assert runtime._llm("default", "gpt-5").stream_usage is True
+
+
+def test_streamed_turn_reports_provider_token_usage(monkeypatch):
+    from langchain_core.messages import AIMessage, AIMessageChunk
+
+    runtime = AgentRuntime(_config(), _DummyStore())
+    usage = {"input_tokens": 1234, "output_tokens": 56, "total_tokens": 1290}
+
+    class _StreamingDeepAgent:
+        def stream(self, payload, stream_mode=None):
+            yield ("messages", (AIMessageChunk(content="done"), {}))
+            yield ("values", {"messages": [AIMessage(content="done", usage_metadata=usage)]})
+
+    monkeypatch.setattr(runtime, "_deep_agent", lambda *args, **kwargs: _StreamingDeepAgent())
+    result = runtime.run_turn("default", "s1", "hello", "cli", interactive=False)
+
+    assert result["metrics"]["input_tokens"] == 1234
+    assert result["metrics"]["output_tokens"] == 56
+
+
+def test_run_turn_serves_repeated_turns_from_response_cache(monkeypatch, tmp_path):
+    config = _config()
+    config.agents[0].response_cache = True
+    config.response_cache = ResponseCacheConfig(disk_path=str(tmp_path / "cache"))
+    calls = []
+
+    class _DummyDeepAgent:
+        def invoke(self, payload):
+            calls.append(payload)
+            return {"messages": [{"type": "assistant", "content": "status ok"}]}
+
+    runtime = AgentRuntime(config, _DummyStore())
+    monkeypatch.setattr(runtime, "_deep_agent", lambda *args, **kwargs: _DummyDeepAgent())
+    first = runtime.run_turn("default", "s1", "status?", "cli", interactive=False)
+    second = runtime.run_turn("default", "s2", "status?", "cli", interactive=False)
+
+    assert len(calls) == 1
+    assert first["metrics"]["cache_hit"] is False
+    assert second["metrics"]["cache_hit"] is True
+    assert second["metrics"]["input_tokens"] == 0
+    assert second["assistant_message"] == "status ok"
+
+    restarted = AgentRuntime(config, _DummyStore())
+    monkeypatch.setattr(restarted, "_deep_agent", lambda *args, **kwargs: _DummyDeepAgent())
+    assert restarted.run_turn("default", "s3", "status?", "cli", interactive=False)["metrics"]["cache_hit"] is True
+    assert len(calls) == 1
+
+
+def test_run_turn_hedges_slow_primary_with_fallback(monkeypatch):
+    config = _config()
+    config.agents[0].fallback_models = ["gpt-5-mini"]
+    config.llm.hedge_enabled = True
+    config.llm.hedge_after_ms = 20
+    release_primary = threading.Event()
+
+    class _DummyDeepAgent:
+        def __init__(self, model):
+            self.model = model
+
+        def invoke(self, payload):
+            if self.model == "gpt-5":
+                release_primary.wait(5)
+            return {"messages": [{"type": "assistant", "content": f"from {self.model}"}]}
+
+    runtime = AgentRuntime(config, _DummyStore())
+    monkeypatch.setattr(runtime, "_deep_agent", lambda *args, **kwargs: _DummyDeepAgent(kwargs["model"]))
+    try:
+        result = runtime.run_turn("default", "s1", "hello", "cli", interactive=False)
+    finally:
+        release_primary.set()
+
+    assert result["assistant_message"] == "from gpt-5-mini"
+    assert result["metrics"]["model_used"] == "gpt-5-mini"
+    assert result["metrics"]["hedge"]["fired"] is True
+    assert result["metrics"]["hedge"]["winner"] == "gpt-5-mini"
+    assert result["metrics"]["hedge"]["loser_cancelled"] is True
+
+
+class _Message:
+    def __init__(self, type, content="", tool_calls=None):
+        self.type = type
+        self.content = content
+        self.tool_calls = tool_calls or []
+
+
+class _ToolCallingDeepAgent:
+    # Mimics a LangGraph stream: the tool only runs once the consumer advances past the
+    # model update that requested it.
+    def __init__(self, model, side_effects, delay, finished, after_tool=None):
+        self.model = model
+        self.side_effects = side_effects
+        self.delay = delay
+        self.finished = finished
+        self.after_tool = after_tool
+
+    def stream(self, payload, stream_mode=None):
+        try:
+            self.delay.wait(5)
+            call = {"name": "execute", "id": f"call-{self.model}", "args": {}}
+            yield ("messages", (_Message("AIMessageChunk"), {}))
+            yield ("updates", {"model": {"messages": [_Message("ai", tool_calls=[call])]}})
+            self.side_effects.append(self.model)
+            if self.after_tool is not None:
+                # Let the other attempt catch up while this one is still finishing.
+                self.after_tool.set()
+                time.sleep(0.2)
+            yield ("values", {"messages": [{"type": "assistant", "content": f"from {self.model}"}]})
+        finally:
+            self.finished.set()
+
+
+def test_hedged_turn_runs_tools_only_once(monkeypatch):
+    config = _config()
+    config.agents[0].fallback_models = ["gpt-5-mini"]
+    config.llm.hedge_enabled = True
+    config.llm.hedge_after_ms = 20
+    side_effects = []
+    release_primary = threading.Event()
+    primary_finished = threading.Event()
+    agents = {
+        "gpt-5": _ToolCallingDeepAgent("gpt-5", side_effects, release_primary, primary_finished),
+        "gpt-5-mini": _ToolCallingDeepAgent(
+            "gpt-5-mini", side_effects, threading.Event(), threading.Event(), after_tool=release_primary
+        ),
+    }
+    agents["gpt-5-mini"].delay.set()
+
+    runtime = AgentRuntime(config, _DummyStore())
+    monkeypatch.setattr(runtime, "_deep_agent", lambda *args, **kwargs: agents[kwargs["model"]])
+    try:
+        result = runtime.run_turn("default", "s1", "run it", "cli", interactive=False)
+    finally:
+        release_primary.set()
+    assert primary_finished.wait(5)
+
+    assert result["metrics"]["hedge"]["fired"] is True
+    assert result["metrics"]["model_used"] == "gpt-5-mini"
+    assert side_effects == ["gpt-5-mini"]
+
+
+def test_hedge_does_not_fire_once_primary_starts_a_tool_call(monkeypatch):
+    config = _config()
+    config.agents[0].fallback_models = ["gpt-5-mini"]
+    config.llm.hedge_enabled = True
+    config.llm.hedge_after_ms = 20
+    side_effects = []
+    built = []
+
+    class _SlowToolDeepAgent(_ToolCallingDeepAgent):
+        def stream(self, payload, stream_mode=None):
+            for mode, chunk in super().stream(payload, stream_mode):
+                if mode == "updates":
+                    # The model is still streaming tool-call arguments, with no text yet.
+                    time.sleep(0.2)
+                yield mode, chunk
+
+    def _build(*args, **kwargs):
+        built.append(kwargs["model"])
+        ready = threading.Event()
+        ready.set()
+        return _SlowToolDeepAgent(kwargs["model"], side_effects, ready, threading.Event())
+
+    runtime = AgentRuntime(config, _DummyStore())
+    monkeypatch.setattr(runtime, "_deep_agent", _build)
+    result = runtime.run_turn("default", "s1", "run it", "cli", interactive=False)
+
+    assert result["metrics"]["hedge"]["fired"] is False
+    assert built == ["gpt-5"]
+    assert side_effects == ["gpt-5"]
+
+
+def test_run_turn_skips_model_with_open_breaker(monkeypatch):
+    config = _config()
+    config.agents[0].fallback_models = ["gpt-5-mini"]
+    config.model_health.failure_threshold = 1
+    models = []
+
+    class _DummyDeepAgent:
+        def __init__(self, model):
+            self.model = model
+
+        def invoke(self, payload):
+            models.append(self.model)
+            if self.model == "gpt-5":
+                raise TimeoutError("request timed out")
+            return {"messages": [{"type": "assistant", "content": f"from {self.model}"}]}
+
+    runtime = AgentRuntime(config, _DummyStore())
+    monkeypatch.setattr(runtime, "_deep_agent", lambda *args, **kwargs: _DummyDeepAgent(kwargs["model"]))
+    first = runtime.run_turn("default", "s1", "hello", "cli", interactive=False)
+    second = runtime.run_turn("default", "s1", "hello", "cli", interactive=False)
+
+    assert first["metrics"]["failover_count"] == 1
+    assert second["metrics"]["failover_count"] == 0
+    assert second["metrics"]["model_used"] == "gpt-5-mini"
+    assert models == ["gpt-5", "gpt-5-mini", "gpt-5-mini"]
+    assert runtime.health.snapshot()["gpt-5"]["last_error_kind"] == "timeout"
+
+
+def test_run_turn_prefetches_memory_into_context(monkeypatch, tmp_path):
+    config = _config()
+    config.storage = StorageConfig(base_path=str(tmp_path))
+    config.memory.prefetch_enabled = True
+    captured = {}
+
+    class _DummyDeepAgent:
+        def invoke(self, payload):
+            captured["messages"] = payload["messages"]
+            return {"messages": [{"type": "assistant", "content": "Postgres."}]}
+
+    runtime = AgentRuntime(config, SessionStore(config.storage))
+    runtime._memory_store("default", "Project Apollo stores data in Postgres")
+    monkeypatch.setattr(runtime, "_deep_agent", lambda *args, **kwargs: _DummyDeepAgent())
+    result = runtime.run_turn("default", "s1", "Which database does Apollo use?", "cli", interactive=False)
+
+    injected = captured["messages"][-2]
+    assert "Memory prefetched" in injected.content
+    assert "MEMORY.md:3" in injected.content
+    assert result["metrics"]["memory_prefetch"]["hit"] is True
+    assert result["metrics"]["memory_prefetch"]["tokens_saved_estimate"] > 0
+    assert runtime.memory_prefetch_stats()["hit_rate"] == 1.0
+
+
+def test_memory_search_stats_a_constant_number_of_files(monkeypatch, tmp_path):
+    config = _config()
+    config.storage = StorageConfig(base_path=str(tmp_path))
+    config.memory.max_search_results = 50
+    runtime = AgentRuntime(config, SessionStore(config.storage))
+    runtime._memory_store("default", "kickoff note")
+    daily = tmp_path / "default" / "memory"
+    for day in range(1, 29):
+        (daily / f"2025-02-{day:02d}.md").write_text(f"# Daily Memory\n- note {day} about zebras\n")
+    assert len(runtime._memory_search("default", "zebras", max_results=50)["results"]) == 28
+
+    import codeclaw.memory as memory_module
+
+    stats = []
+    real_signature = memory_module._file_signature
+    monkeypatch.setattr(memory_module, "_file_signature", lambda path: stats.append(path) or real_signature(path))
+    runtime._memory_store("default", "zebras are striped")
+    stats.clear()
+    found = runtime._memory_search("default", "striped")
+    assert [hit["snippet"] for hit in found["results"]][0].endswith("zebras are striped")
+    assert len(stats) == 2
+
+    # A new file changes the directory, so the next search checks everything again.
+    (daily / "2025-03-01.md").write_text("# Daily Memory\n- giraffes\n")
+    assert runtime._memory_search("default", "giraffes")["results"]
+    assert len(stats) > 2 + 28
+
+
+def test_run_turn_attaches_phase_spans_and_exports_trace(monkeypatch):
+    config = _config()
+    config.context.background_summary_enabled = True
+    runtime = AgentRuntime(config, _DummyStore())
+    exported = []
+
+    class _DummyDeepAgent:
+        def invoke(self, payload):
+            return {"messages": [{"type": "assistant", "content": "done"}]}
+
+    monkeypatch.setattr(runtime, "_deep_agent", lambda *args, **kwargs: _DummyDeepAgent())
+    add_exporter(exported.append)
+    try:
+        result = runtime.run_turn("default", "s1", "hello", "cli", interactive=False)
+    finally:
+        remove_exporter(exported.append)
+
+    names = [span["name"] for span in result["metrics"]["spans"]]
+    assert names == ["apply_prepared_summary", "read_events", "build_messages", "agent_build", "invoke", "extraction"]
+    assert exported[0]["name"] == "run_turn"
+
+
+def test_failed_probe_with_non_failover_error_frees_the_probe(monkeypatch):
+    config = _config()
+    config.model_health.failure_threshold = 1
+    config.model_health.cooldown_seconds = 0
+
+    class _BadRequestDeepAgent:
+        def invoke(self, payload):
+            raise ValueError("invalid tool schema")
+
+    runtime = AgentRuntime(config, _DummyStore())
+    runtime.health.record_failure("gpt-5", "timeout")
+    monkeypatch.setattr(runtime, "_deep_agent", lambda *args, **kwargs: _BadRequestDeepAgent())
+    with pytest.raises(ValueError):
+        runtime.run_turn("default", "s1", "hello", "cli", interactive=False)
+
+    assert runtime.health.allow("gpt-5") is True
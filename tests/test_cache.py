@@ -0,0 +1,25 @@
+import time
+
+from codeclaw.cache import TieredCache, TTLCache
+
+
+def test_ttl_cache_evicts_least_recently_used_and_expired():
+    cache = TTLCache(ttl_seconds=60, max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    cache.set("d", 4, expires_at=time.time() - 1)
+    assert cache.get("d") is None
+
+
+def test_tiered_cache_reads_disk_tier_and_prunes_to_bound(tmp_path):
+    cache = TieredCache(ttl_seconds=60, max_entries=8, disk_path=str(tmp_path), max_disk_entries=2)
+    for key in ["aa1", "bb2", "cc3"]:
+        cache.set(key, {"value": key})
+    fresh = TieredCache(ttl_seconds=60, max_entries=8, disk_path=str(tmp_path), max_disk_entries=2)
+    assert fresh.get("cc3") == {"value": "cc3"}
+    assert fresh.prune_disk() == 1
+    assert len(list(tmp_path.glob("*/*.json"))) == 2
@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from codeclaw.cli import _read_batch_file, build_parser
+from codeclaw.config import load_config
+
+_HEAVY_MODULES = {"deepagents", "langchain_openai", "langchain_core", "openai", "uvicorn"}
+_EXAMPLE_CONFIG = Path(__file__).resolve().parents[1] / "docs" / "codeclaw.example.toml"
+# Generous enough for a cold CI box; eager heavy imports cost several seconds.
+_IMPORT_BUDGET_US = 1_500_000
+
+
+def _importtime(code: str) -> dict[str, int]:
+    env = {**os.environ, "CODECLAW_CONFIG": "/nonexistent/codeclaw.toml"}
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, env=env, check=True)
+    cumulative: dict[str, int] = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, total, name = line.split("|")
+        if total.strip().isdigit():
+            cumulative[name.strip()] = int(total)
+    return cumulative
+
+
+def test_cli_subcommand_imports_stay_light():
+    for module in ["codeclaw.gateway_client", "codeclaw.doctor"]:
+        cumulative = _importtime(f"import codeclaw.cli, {module}")
+        assert not _HEAVY_MODULES & set(cumulative)
+        assert cumulative["codeclaw.cli"] + cumulative[module] < _IMPORT_BUDGET_US
+
+
+def test_gateway_import_defers_app_and_agent_libraries():
+    cumulative = _importtime("import codeclaw.gateway")
+    assert "deepagents" not in cumulative
+    assert "langchain_openai" not in cumulative
+
+
+def test_gateway_run_uses_app_factory(monkeypatch):
+    calls = []
+    # cmd_gateway_run exports the worker count; let monkeypatch restore it.
+    monkeypatch.delenv("CODECLAW_GATEWAY_WORKERS", raising=False)
+    monkeypatch.setattr("codeclaw.cli.load_config", lambda _path: load_config(str(_EXAMPLE_CONFIG)))
+    monkeypatch.setattr("uvicorn.run", lambda target, **kwargs: calls.append((target, kwargs)))
+    args = build_parser().parse_args(["gateway", "run"])
+    args.func(args)
+    assert calls[0][0] == "codeclaw.gateway:create_app"
+    assert calls[0][1]["factory"] is True
+
+
+def test_gateway_run_passes_worker_count(monkeypatch):
+    calls = []
+    monkeypatch.delenv("CODECLAW_GATEWAY_WORKERS", raising=False)
+    monkeypatch.setattr("codeclaw.cli.load_config", lambda _path: load_config(str(_EXAMPLE_CONFIG)))
+    monkeypatch.setattr("uvicorn.run", lambda target, **kwargs: calls.append(kwargs))
+    args = build_parser().parse_args(["gateway", "run", "--workers", "4"])
+    args.func(args)
+    assert calls[0]["workers"] == 4
+    assert os.environ["CODECLAW_GATEWAY_WORKERS"] == "4"
+
+
+def test_read_batch_file_fills_defaults(tmp_path):
+    path = tmp_path / "prompts.jsonl"
+    path.write_text('{"message": "one", "session_id": "s1"}\n\n"two"\n')
+    items = _read_batch_file(str(path), "default", "eval")
+    assert items == [
+        {"message": "one", "session_id": "s1", "agent_id": "default", "channel": "cli", "peer": "eval"},
+        {"message": "two", "agent_id": "default", "channel": "cli", "peer": "eval", "force_new": True},
+    ]
@@ -1,4 +1,7 @@
-from codeclaw.config import load_config
+import pytest
+from pydantic import ValidationError
+
+from codeclaw.config import ObservabilityConfig, load_config
 
 
 def test_load_config(tmp_path):
@@ -48,3 +51,12 @@ exec_allowlist = []
     assert config.gateway.token == ""
     assert config.gateway.password == ""
     assert config.agents[0].id == "default"
+    assert config.context.background_summary_enabled is False
+    assert config.memory.archive_after_days == 0
+    assert config.telegram.coalesce_messages is False
+
+
+def test_malformed_tracing_policy_fails_at_load():
+    assert ObservabilityConfig(tracing="sampled:0.25").tracing == "sampled:0.25"
+    with pytest.raises(ValidationError, match="tracing"):
+        ObservabilityConfig(tracing="sampled:2")
@@ -1,4 +1,16 @@
-from codeclaw.gateway import _get_or_create_session
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+from codeclaw.config import load_config
+from codeclaw.storage import SessionStore
+from codeclaw.gateway import _get_or_create_session, _ndjson_lines, _per_worker_config, create_app
+
+_EXAMPLE_CONFIG = Path(__file__).resolve().parents[1] / "docs" / "codeclaw.example.toml"
 
 
 class _DummyStore:
@@ -47,3 +59,376 @@ def test_get_or_create_session_uses_latest_when_not_forced():
     assert result["id"] == "latest-1"
     assert ("find_latest", None) in store.calls
 
+
+
+def test_ndjson_lines_marks_terminal_events():
+    lines = list(
+        _ndjson_lines(
+            iter(
+                [
+                    {"type": "delta", "text": "hi"},
+                    {"type": "result", "assistant_message": "hi"},
+                ]
+            )
+        )
+    )
+    assert lines[0] == '{"type": "delta", "text": "hi"}\n'
+    assert '"ok": true' in lines[1]
+
+
+def _ws_app(monkeypatch, tmp_path, max_inflight):
+    config = load_config(str(_EXAMPLE_CONFIG))
+    config.storage.base_path = str(tmp_path)
+    config.gateway.ws_max_inflight = max_inflight
+    monkeypatch.setattr("codeclaw.gateway._load_app_config", lambda: config)
+    release = threading.Event()
+
+    def _fake_handle(method, params, store, runtime, config):
+        if method == "slow":
+            release.wait(5)
+        return {"method": method}
+
+    monkeypatch.setattr("codeclaw.gateway._handle_ws_request", _fake_handle)
+    return create_app(), release
+
+
+def test_ws_requests_are_multiplexed_out_of_order(monkeypatch, tmp_path):
+    app, release = _ws_app(monkeypatch, tmp_path, max_inflight=4)
+    with TestClient(app).websocket_connect("/ws") as ws:
+        ws.send_json({"type": "req", "id": 0, "method": "connect"})
+        assert ws.receive_json()["result"]["ok"] is True
+        ws.send_json({"type": "req", "id": 1, "method": "slow"})
+        ws.send_json({"type": "req", "id": 2, "method": "fast"})
+        assert ws.receive_json() == {"type": "res", "id": 2, "result": {"method": "fast"}}
+        release.set()
+        assert ws.receive_json() == {"type": "res", "id": 1, "result": {"method": "slow"}}
+
+
+def test_ws_rejects_requests_over_inflight_limit(monkeypatch, tmp_path):
+    app, release = _ws_app(monkeypatch, tmp_path, max_inflight=1)
+    with TestClient(app).websocket_connect("/ws") as ws:
+        ws.send_json({"type": "req", "id": 0, "method": "connect"})
+        ws.receive_json()
+        ws.send_json({"type": "req", "id": 1, "method": "slow"})
+        ws.send_json({"type": "req", "id": 2, "method": "fast"})
+        rejected = ws.receive_json()
+        assert rejected["id"] == 2
+        assert "in-flight" in rejected["error"]["message"]
+        release.set()
+        assert ws.receive_json()["id"] == 1
+
+
+def test_session_send_returns_429_when_turn_queue_is_full(monkeypatch, tmp_path):
+    config = load_config(str(_EXAMPLE_CONFIG))
+    config.storage.base_path = str(tmp_path)
+    config.gateway.turn_workers = 1
+    config.gateway.turn_queue_max = 0
+    monkeypatch.setattr("codeclaw.gateway._load_app_config", lambda: config)
+    release = threading.Event()
+
+    def _fake_execute_send(store, runtime, turns, config, req, on_event=None):
+        release.wait(5)
+        return {"session_id": "s1", "assistant_message": "done"}
+
+    monkeypatch.setattr("codeclaw.gateway._execute_send", _fake_execute_send)
+    client = TestClient(create_app())
+    first = threading.Thread(target=client.post, args=("/api/session/send",), kwargs={"json": {"agent_id": "default", "message": "a"}})
+    first.start()
+    for _ in range(500):
+        admission = client.get("/api/runtime/status").json()["admission"]
+        # The fake turn never takes a scheduler slot, so it is reported as queued.
+        if admission["running"] + admission["queued"] >= 1:
+            break
+        time.sleep(0.01)
+
+    busy = client.post("/api/session/send", json={"agent_id": "default", "message": "b"})
+    release.set()
+    first.join(5)
+
+    assert busy.status_code == 429
+    assert int(busy.headers["Retry-After"]) >= 1
+    assert busy.json()["ok"] is False
+
+
+def test_ws_session_send_goes_through_admission(monkeypatch, tmp_path):
+    config = load_config(str(_EXAMPLE_CONFIG))
+    config.storage.base_path = str(tmp_path)
+    config.gateway.turn_workers = 1
+    config.gateway.turn_queue_max = 0
+    monkeypatch.setattr("codeclaw.gateway._load_app_config", lambda: config)
+    release = threading.Event()
+    transports = []
+
+    def _fake_execute_send(store, runtime, turns, config, req, on_event=None, transport="http"):
+        transports.append(transport)
+        release.wait(5)
+        return {"session_id": "s1", "assistant_message": "done"}
+
+    monkeypatch.setattr("codeclaw.gateway._execute_send", _fake_execute_send)
+    client = TestClient(create_app())
+    with client.websocket_connect("/ws") as ws:
+        ws.send_json({"type": "req", "id": 0, "method": "connect"})
+        ws.receive_json()
+        ws.send_json({"type": "req", "id": 1, "method": "session.send", "params": {"agent_id": "default", "message": "a"}})
+        for _ in range(500):
+            admission = client.get("/api/runtime/status").json()["admission"]
+            if admission["running"] + admission["queued"] >= 1:
+                break
+            time.sleep(0.01)
+        ws.send_json({"type": "req", "id": 2, "method": "session.send", "params": {"agent_id": "default", "message": "b"}})
+        rejected = ws.receive_json()
+        release.set()
+        done = ws.receive_json()
+
+    assert rejected["id"] == 2
+    assert "turn queue is full" in rejected["error"]["message"]
+    assert rejected["error"]["retry_after"] >= 1
+    assert (done["id"], done["result"]["assistant_message"]) == (1, "done")
+    assert transports == ["ws"]
+
+
+def test_ws_session_subscribe_pushes_appended_events(monkeypatch, tmp_path):
+    config = load_config(str(_EXAMPLE_CONFIG))
+    config.storage.base_path = str(tmp_path)
+    monkeypatch.setattr("codeclaw.gateway._load_app_config", lambda: config)
+    stores = []
+
+    class _Store(SessionStore):
+        def __init__(self, storage_config):
+            super().__init__(storage_config)
+            stores.append(self)
+
+    monkeypatch.setattr("codeclaw.gateway.SessionStore", _Store)
+    app = create_app()
+    store = stores[0]
+    session = store.create_session("default", "cli", "local", "hi")
+    store.append_event("default", session["id"], {"role": "user", "content": "before"})
+
+    with TestClient(app).websocket_connect("/ws") as ws:
+        ws.send_json({"type": "req", "id": 0, "method": "connect"})
+        ws.receive_json()
+        ws.send_json(
+            {"type": "req", "id": 1, "method": "session.subscribe", "params": {"agent_id": "default", "session_id": session["id"], "since_seq": 0}}
+        )
+        subscribed = ws.receive_json()["result"]
+        assert subscribed["seq"] == 1
+        assert [event["content"] for event in subscribed["events"]] == ["before"]
+
+        store.append_event("default", session["id"], {"role": "assistant", "content": "after"})
+        pushed = ws.receive_json()
+        assert pushed["method"] == "session.event"
+        assert pushed["params"]["subscription"] == subscribed["subscription"]
+        assert (pushed["params"]["event"]["seq"], pushed["params"]["event"]["content"]) == (2, "after")
+
+        ws.send_json({"type": "req", "id": 2, "method": "session.unsubscribe", "params": {"subscription": subscribed["subscription"]}})
+        assert ws.receive_json()["result"]["ok"] is True
+
+
+def test_multi_worker_subscribers_see_other_workers_appends(monkeypatch, tmp_path):
+    config = load_config(str(_EXAMPLE_CONFIG))
+    config.storage.base_path = str(tmp_path)
+    config.gateway.event_tail_seconds = 0.05
+    monkeypatch.setattr("codeclaw.gateway._load_app_config", lambda: config)
+    monkeypatch.setenv("CODECLAW_GATEWAY_WORKERS", "2")
+    other_worker = SessionStore(config.storage)
+    session = other_worker.create_session("default", "cli", "local", "hi")
+    other_worker.append_event("default", session["id"], {"role": "user", "content": "before"})
+
+    with TestClient(create_app()) as client, client.websocket_connect("/ws") as ws:
+        assert client.get("/api/runtime/status").json()["gateway"]["workers"] == 2
+        assert f'worker="{os.getpid()}"' in client.get("/metrics").text
+        ws.send_json({"type": "req", "id": 0, "method": "connect"})
+        ws.receive_json()
+        ws.send_json({"type": "req", "id": 1, "method": "session.subscribe", "params": {"agent_id": "default", "session_id": session["id"]}})
+        assert ws.receive_json()["result"]["seq"] == 1
+
+        other_worker.append_event("default", session["id"], {"role": "assistant", "content": "from another worker"})
+        pushed = ws.receive_json()
+        assert (pushed["params"]["event"]["seq"], pushed["params"]["event"]["content"]) == (2, "from another worker")
+
+
+def test_per_worker_config_splits_gateway_wide_limits():
+    config = load_config(str(_EXAMPLE_CONFIG))
+    config.gateway.turn_workers = 16
+    config.gateway.turn_queue_max = 0
+    config.scheduler.max_concurrent_turns = 5
+    config.scheduler.provider_limits = {"openai": 8}
+
+    split = _per_worker_config(config, 4)
+
+    assert (split.gateway.turn_workers, split.gateway.turn_queue_max) == (4, 0)
+    assert split.scheduler.max_concurrent_turns == 2
+    assert split.scheduler.provider_limits == {"openai": 2}
+    assert config.gateway.turn_workers == 16
+    assert _per_worker_config(config, 1) is config
+
+
+def test_session_send_rejects_idempotency_key_reuse_with_a_different_body(monkeypatch, tmp_path):
+    config = load_config(str(_EXAMPLE_CONFIG))
+    config.storage.base_path = str(tmp_path)
+    config.idempotency.disk_path = str(tmp_path / "idem")
+    monkeypatch.setattr("codeclaw.gateway._load_app_config", lambda: config)
+    ran = []
+
+    def _fake_send_turn(store, runtime, turns, config, req, on_event=None, transport="http"):
+        ran.append(req.message)
+        return {"session_id": "s1", "assistant_message": f"did {req.message}"}
+
+    monkeypatch.setattr("codeclaw.gateway._execute_send_turn", _fake_send_turn)
+    client = TestClient(create_app())
+    body = {"agent_id": "default", "message": "a", "idempotency_key": "k1"}
+    first = client.post("/api/session/send", json=body)
+    replay = client.post("/api/session/send", json={**body, "stream_partial": False, "queue_depth": 3})
+    conflict = client.post("/api/session/send", json={**body, "message": "b"})
+
+    assert first.json()["assistant_message"] == "did a"
+    assert replay.json()["idempotent_replay"] is True
+    assert conflict.status_code == 409
+    assert conflict.json()["ok"] is False
+    assert ran == ["a"]
+
+
+def test_session_events_support_etag_and_gzip(monkeypatch, tmp_path):
+    config = load_config(str(_EXAMPLE_CONFIG))
+    config.storage.base_path = str(tmp_path)
+    monkeypatch.setattr("codeclaw.gateway._load_app_config", lambda: config)
+    store = SessionStore(config.storage)
+    session = store.create_session("default", "cli", "local", "hi")
+    store.append_event("default", session["id"], {"role": "user", "content": "x" * 4000})
+    client = TestClient(create_app())
+    params = {"agent_id": "default", "session_id": session["id"]}
+
+    first = client.get("/api/session/events", params=params, headers={"Accept-Encoding": "gzip"})
+    assert first.status_code == 200
+    assert first.headers["content-encoding"] == "gzip"
+    assert first.json()["events"][0]["content"] == "x" * 4000
+
+    etag = first.headers["etag"]
+    unchanged = client.get("/api/session/events", params=params, headers={"If-None-Match": etag})
+    assert unchanged.status_code == 304
+    assert unchanged.content == b""
+
+    store.append_event("default", session["id"], {"role": "assistant", "content": "done"})
+    changed = client.get("/api/session/events", params=params, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert len(changed.json()["events"]) == 2
+
+    listing = client.get("/api/session/list", params={"agent_id": "default"})
+    relisted = client.get("/api/session/list", params={"agent_id": "default"}, headers={"If-None-Match": listing.headers["etag"]})
+    assert relisted.status_code == 304
+
+
+def test_metrics_endpoint_exposes_prometheus_text(monkeypatch, tmp_path):
+    config = load_config(str(_EXAMPLE_CONFIG))
+    config.storage.base_path = str(tmp_path)
+    monkeypatch.setattr("codeclaw.gateway._load_app_config", lambda: config)
+    client = TestClient(create_app())
+    client.get("/api/session/list", params={"agent_id": "default"})
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE codeclaw_turn_duration_seconds histogram" in response.text
+    assert 'codeclaw_storage_op_seconds_count{op="list_sessions"}' in response.text
+    assert "codeclaw_admission_queued 0" in response.text
+
+
+def test_send_batch_streams_results_as_items_complete(monkeypatch, tmp_path):
+    config = load_config(str(_EXAMPLE_CONFIG))
+    config.storage.base_path = str(tmp_path)
+    monkeypatch.setattr("codeclaw.gateway._load_app_config", lambda: config)
+
+    def _fake_execute_send(store, runtime, turns, config, req, on_event=None, transport="http"):
+        if req.message == "slow":
+            time.sleep(0.3)
+        if req.message == "bad":
+            raise RuntimeError("provider down")
+        return {"session_id": f"s-{req.message}", "assistant_message": req.message.upper()}
+
+    monkeypatch.setattr("codeclaw.gateway._execute_send", _fake_execute_send)
+    client = TestClient(create_app())
+    items = [
+        {"agent_id": "default", "message": "slow"},
+        {"agent_id": "default", "message": "fast"},
+        {"agent_id": "default", "message": "bad"},
+        {"message": "missing agent"},
+    ]
+
+    response = client.post("/api/session/send_batch", json={"requests": items})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    by_index = {line["index"]: line for line in lines if line["type"] == "item"}
+    assert by_index[0]["assistant_message"] == "SLOW"
+    assert by_index[1]["assistant_message"] == "FAST"
+    assert by_index[2]["ok"] is False and "provider down" in by_index[2]["error"]
+    assert by_index[3]["ok"] is False
+    order = [line["index"] for line in lines[:-1]]
+    assert order.index(1) < order.index(0)
+    assert lines[-1] == {"type": "batch_done", "total": 4, "succeeded": 2, "failed": 2}
+
+
+def test_send_batch_items_without_a_session_run_concurrently(monkeypatch, tmp_path):
+    config = load_config(str(_EXAMPLE_CONFIG))
+    config.storage.base_path = str(tmp_path)
+    config.gateway.batch_concurrency = 3
+    monkeypatch.setattr("codeclaw.gateway._load_app_config", lambda: config)
+    # Every turn waits until all three are running, which only happens if they do
+    # not queue behind each other on one session.
+    all_running = threading.Barrier(3)
+
+    def _fake_run_turn(self, agent_id, session_id, message, channel, **kwargs):
+        all_running.wait(5)
+        return {"assistant_message": message.upper(), "plan": [], "metrics": {}}
+
+    monkeypatch.setattr("codeclaw.agent.AgentRuntime.run_turn", _fake_run_turn)
+    client = TestClient(create_app())
+    items = [{"agent_id": "default", "message": message, "peer": "eval"} for message in ("a", "b", "c")]
+
+    response = client.post("/api/session/send_batch", json={"requests": items})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    results = [line for line in lines if line["type"] == "item"]
+    assert all(line["ok"] for line in results), results
+    assert len({line["session_id"] for line in results}) == 3
+    assert lines[-1]["succeeded"] == 3
+
+
+def test_jobs_run_in_background_and_report_over_http_and_ws(monkeypatch, tmp_path):
+    config = load_config(str(_EXAMPLE_CONFIG))
+    config.storage.base_path = str(tmp_path / "agents")
+    config.jobs.path = str(tmp_path / "jobs")
+    monkeypatch.setattr("codeclaw.gateway._load_app_config", lambda: config)
+    release = threading.Event()
+
+    def _fake_execute_send(store, runtime, turns, config, req, on_event=None, transport="http"):
+        on_event({"type": "session", "session_id": "s1"})
+        release.wait(5)
+        on_event({"type": "tool_start", "tool": "exec"})
+        return {"session_id": "s1", "assistant_message": "finished"}
+
+    monkeypatch.setattr("codeclaw.gateway._execute_send", _fake_execute_send)
+    client = TestClient(create_app())
+
+    created = client.post("/api/jobs", json={"agent_id": "default", "message": "long"})
+    assert created.status_code == 202
+    job_id = created.json()["job"]["id"]
+    with client.websocket_connect("/ws") as ws:
+        ws.send_json({"type": "req", "id": 0, "method": "connect"})
+        ws.receive_json()
+        ws.send_json({"type": "req", "id": 1, "method": "job.subscribe", "params": {"job_id": job_id}})
+        subscribed = ws.receive_json()["result"]
+        assert subscribed["live"] is True
+        assert subscribed["job"]["status"] in ("queued", "running")
+        release.set()
+        events = []
+        while not events or events[-1]["params"].get("type") != "job" or events[-1]["params"]["job"]["status"] != "succeeded":
+            events.append(ws.receive_json())
+        assert all(event["method"] == "job.event" for event in events)
+        assert any(event["params"].get("event", {}).get("type") == "tool_start" for event in events)
+
+    job = client.get(f"/api/jobs/{job_id}").json()["job"]
+    assert job["status"] == "succeeded"
+    assert job["result"]["assistant_message"] == "finished"
+    assert client.get("/api/jobs/" + "0" * 32).status_code == 404
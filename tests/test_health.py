@@ -0,0 +1,67 @@
+from codeclaw.config import ModelHealthConfig
+from codeclaw.health import CLOSED, HALF_OPEN, OPEN, ModelHealthTracker
+
+
+def test_breaker_opens_after_consecutive_failures_and_skips_model():
+    tracker = ModelHealthTracker(ModelHealthConfig(failure_threshold=2, cooldown_seconds=60))
+    tracker.record_failure("gpt-5", "timeout")
+    # Still closed, but the failing model is demoted behind a healthy one.
+    assert tracker.order(["gpt-5", "gpt-5-mini"]) == ["gpt-5-mini", "gpt-5"]
+    tracker.record_failure("gpt-5", "timeout")
+
+    assert tracker.snapshot()["gpt-5"]["state"] == OPEN
+    assert tracker.order(["gpt-5", "gpt-5-mini"]) == ["gpt-5-mini"]
+    # With every candidate open the turn still gets a model to try.
+    assert tracker.order(["gpt-5"]) == ["gpt-5"]
+
+
+def test_half_open_probe_closes_breaker_on_success():
+    tracker = ModelHealthTracker(ModelHealthConfig(failure_threshold=1, cooldown_seconds=0))
+    tracker.record_failure("gpt-5", "rate_limit")
+    assert tracker.allow("gpt-5") is True
+
+    probe = tracker.begin_attempt("gpt-5")
+    assert probe
+    assert tracker.snapshot()["gpt-5"]["state"] == HALF_OPEN
+    assert tracker.allow("gpt-5") is False
+    tracker.record_success("gpt-5", latency_ms=120, first_token_ms=40, probe=probe)
+
+    snapshot = tracker.snapshot()["gpt-5"]
+    assert snapshot["state"] == CLOSED
+    assert snapshot["latency_ms"]["p50"] == 120
+    assert snapshot["error_rate"] == 0.0
+
+
+def test_probe_slot_is_released_after_a_non_health_error():
+    tracker = ModelHealthTracker(ModelHealthConfig(failure_threshold=1, cooldown_seconds=0, probe_timeout_seconds=180))
+    tracker.record_failure("gpt-5", "timeout")
+    probe = tracker.begin_attempt("gpt-5")
+    assert tracker.allow("gpt-5") is False
+
+    # e.g. a bad request: neither success nor a failover-class failure.
+    tracker.end_attempt("gpt-5", probe)
+
+    assert tracker.snapshot()["gpt-5"]["state"] == HALF_OPEN
+    assert tracker.allow("gpt-5") is True
+
+
+def test_only_the_probe_attempt_settles_a_half_open_breaker():
+    tracker = ModelHealthTracker(ModelHealthConfig(failure_threshold=1, cooldown_seconds=0, probe_timeout_seconds=180))
+    tracker.record_failure("gpt-5", "timeout")
+    probe = tracker.begin_attempt("gpt-5")
+    # Another turn already had gpt-5 in its candidates (or every model was open).
+    bystander = tracker.begin_attempt("gpt-5")
+    assert bystander == 0
+
+    tracker.record_success("gpt-5", latency_ms=50, probe=bystander)
+    tracker.end_attempt("gpt-5", bystander)
+    assert tracker.snapshot()["gpt-5"]["state"] == HALF_OPEN
+    assert tracker.allow("gpt-5") is False
+    tracker.record_failure("gpt-5", "timeout", probe=bystander)
+    tracker.end_attempt("gpt-5", bystander)
+    assert tracker.snapshot()["gpt-5"]["state"] == HALF_OPEN
+    assert tracker.allow("gpt-5") is False
+
+    tracker.record_failure("gpt-5", "timeout", probe=probe)
+    tracker.end_attempt("gpt-5", probe)
+    assert tracker.snapshot()["gpt-5"]["state"] == OPEN
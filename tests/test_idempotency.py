@@ -0,0 +1,112 @@
+import threading
+import time
+
+import pytest
+
+from codeclaw.config import IdempotencyConfig
+from codeclaw.idempotency import IdempotencyConflict, IdempotencyStore
+
+
+def test_duplicate_keys_replay_stored_result_across_restarts(tmp_path):
+    config = IdempotencyConfig(disk_path=str(tmp_path / "idem"))
+    store = IdempotencyStore(config)
+    calls = []
+    key = store.key("default", "telegram:1:100")
+
+    first = store.run(key, lambda: calls.append(1) or {"assistant_message": "hi"})
+    second = store.run(key, lambda: calls.append(2) or {"assistant_message": "again"})
+    restarted = IdempotencyStore(config).run(key, lambda: calls.append(3) or {"assistant_message": "again"})
+
+    assert first == ({"assistant_message": "hi"}, False)
+    assert second == ({"assistant_message": "hi"}, True)
+    assert restarted == ({"assistant_message": "hi"}, True)
+    assert calls == [1]
+
+
+def test_concurrent_duplicate_waits_for_inflight_result(tmp_path):
+    store = IdempotencyStore(IdempotencyConfig(disk_path=""))
+    key = store.key("default", "cli-retry")
+    running = threading.Event()
+    release = threading.Event()
+    results = []
+
+    def turn():
+        running.set()
+        release.wait(5)
+        return {"assistant_message": "once"}
+
+    original = threading.Thread(target=lambda: results.append(store.run(key, turn)))
+    original.start()
+    running.wait(5)
+    duplicate = threading.Thread(target=lambda: results.append(store.run(key, lambda: {"assistant_message": "twice"})))
+    duplicate.start()
+    time.sleep(0.05)
+    assert store.snapshot()["in_flight"] == 1
+    release.set()
+    original.join(5)
+    duplicate.join(5)
+
+    assert sorted(results, key=lambda item: item[1]) == [({"assistant_message": "once"}, False), ({"assistant_message": "once"}, True)]
+
+
+def test_failed_send_is_not_remembered():
+    store = IdempotencyStore(IdempotencyConfig(disk_path=""))
+    key = store.key("default", "k")
+
+    def boom():
+        raise RuntimeError("provider down")
+
+    with pytest.raises(RuntimeError):
+        store.run(key, boom)
+    assert store.run(key, lambda: {"ok": True}) == ({"ok": True}, False)
+
+
+def test_duplicate_in_another_worker_waits_for_inflight_result(tmp_path):
+    # Two stores sharing a disk tier stand in for two gateway worker processes.
+    config = IdempotencyConfig(disk_path=str(tmp_path / "idem"))
+    worker_a, worker_b = IdempotencyStore(config), IdempotencyStore(config)
+    key = worker_a.key("default", "http-retry")
+    running = threading.Event()
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def turn():
+        calls.append("a")
+        running.set()
+        release.wait(5)
+        return {"assistant_message": "once"}
+
+    original = threading.Thread(target=lambda: results.append(worker_a.run(key, turn)))
+    original.start()
+    running.wait(5)
+    duplicate = threading.Thread(
+        target=lambda: results.append(worker_b.run(key, lambda: calls.append("b") or {"assistant_message": "twice"}))
+    )
+    duplicate.start()
+    time.sleep(0.05)
+    assert results == []
+    release.set()
+    original.join(5)
+    duplicate.join(5)
+
+    assert calls == ["a"]
+    assert sorted(results, key=lambda item: item[1]) == [({"assistant_message": "once"}, False), ({"assistant_message": "once"}, True)]
+    assert not list((tmp_path / "idem").glob("*/*.inflight"))
+
+
+def test_key_reused_for_a_different_request_is_rejected(tmp_path):
+    config = IdempotencyConfig(disk_path=str(tmp_path / "idem"))
+    store = IdempotencyStore(config)
+    key = store.key("default", "client-key")
+    calls = []
+    first = store.fingerprint({"message": "deploy staging"})
+    other = store.fingerprint({"message": "deploy production"})
+
+    assert store.run(key, lambda: calls.append(1) or {"ok": True}, first) == ({"ok": True}, False)
+    with pytest.raises(IdempotencyConflict):
+        store.run(key, lambda: calls.append(2) or {"ok": True}, other)
+    with pytest.raises(IdempotencyConflict):
+        IdempotencyStore(config).run(key, lambda: calls.append(3) or {"ok": True}, other)
+    assert store.run(key, lambda: calls.append(4), first) == ({"ok": True}, True)
+    assert calls == [1]
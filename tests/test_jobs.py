@@ -0,0 +1,66 @@
+import json
+import os
+
+from codeclaw.config import JobsConfig
+from codeclaw.jobs import JobStore
+
+
+def test_job_state_is_persisted_and_progress_is_published(tmp_path):
+    jobs = JobStore(JobsConfig(path=str(tmp_path)))
+    seen = []
+    job = jobs.create({"agent_id": "default", "message": "long task"})
+    sub_id = jobs.subscribe(job["id"], seen.append)
+
+    jobs.mark_running(job["id"])
+    jobs.record_event(job["id"], {"type": "session", "session_id": "s1"})
+    jobs.record_event(job["id"], {"type": "tool_start", "tool": "exec"})
+    assert jobs.get(job["id"])["progress"] == {"events": 2, "tool_calls": 1, "last_event": "tool_start"}
+    jobs.finish(job["id"], result={"session_id": "s1", "assistant_message": "done"})
+
+    restarted = JobStore(JobsConfig(path=str(tmp_path)))
+    final = restarted.get(job["id"])
+    assert final["status"] == "succeeded"
+    assert final["session_id"] == "s1"
+    assert final["result"]["assistant_message"] == "done"
+    assert final["progress"]["tool_calls"] == 1
+    assert [event["type"] for event in seen] == ["job", "job", "progress", "progress", "job"]
+    assert jobs.unsubscribe(sub_id) is True
+    assert restarted.get("../etc/passwd") is None
+
+
+def test_recover_interrupts_jobs_of_dead_processes_only(tmp_path):
+    jobs = JobStore(JobsConfig(path=str(tmp_path)))
+    stale = jobs.create({"agent_id": "default", "message": "a"})
+    jobs.mark_running(stale["id"])
+    sibling = jobs.create({"agent_id": "default", "message": "b"})
+    record = json.loads((tmp_path / f"{sibling['id']}.json").read_text())
+    # A record from before owner locks: only the (live) pid is there to go by.
+    record.update(owner_pid=os.getppid(), owner="legacy")
+    (tmp_path / f"{sibling['id']}.json").write_text(json.dumps(record))
+
+    # A restart in this process: the stale job's owner pid is ours but from an earlier instance.
+    jobs.close()
+    restarted = JobStore(JobsConfig(path=str(tmp_path)))
+    assert restarted.recover() == 1
+
+    interrupted = restarted.get(stale["id"])
+    assert interrupted["status"] == "interrupted"
+    assert interrupted["finished_at"]
+    assert restarted.get(sibling["id"])["status"] == "queued"
+
+
+def test_recover_is_not_fooled_by_a_reused_pid(tmp_path):
+    live_owner = JobStore(JobsConfig(path=str(tmp_path)))
+    running = live_owner.create({"agent_id": "default", "message": "still running"})
+    dead_owner = JobStore(JobsConfig(path=str(tmp_path)))
+    orphan = dead_owner.create({"agent_id": "default", "message": "owner crashed"})
+    dead_owner.close()
+    # The dead owner's pid now belongs to some other live process.
+    record = json.loads((tmp_path / f"{orphan['id']}.json").read_text())
+    record["owner_pid"] = os.getppid()
+    (tmp_path / f"{orphan['id']}.json").write_text(json.dumps(record))
+
+    restarted = JobStore(JobsConfig(path=str(tmp_path)))
+    assert restarted.recover() == 1
+    assert restarted.get(orphan["id"])["status"] == "interrupted"
+    assert restarted.get(running["id"])["status"] == "queued"
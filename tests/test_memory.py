@@ -0,0 +1,138 @@
+import threading
+import time
+from datetime import date
+
+from codeclaw.memory import LineOffsetIndex, MemoryIndex, consolidate_memory, load_archive_manifest, memory_lock
+
+
+def test_memory_index_ranks_with_bm25_and_prefix_matches(tmp_path):
+    notes = tmp_path / "MEMORY.md"
+    notes.write_text(
+        "# Durable Memory\n\n"
+        "- deploy checklist lives in docs/release.md\n"
+        "- lunch order: deploy pizza deploy tacos\n"
+        "- deployment window is Tuesday\n"
+    )
+    index = MemoryIndex(tmp_path / "memory.index.json")
+    assert index.refresh([notes]) == 1
+
+    hits = index.search("deploy checklist", limit=5)
+    assert [hit["line"] for hit in hits][:1] == [3]
+    assert {hit["line"] for hit in hits} == {3, 4, 5}
+    assert index.refresh([notes]) == 0
+
+
+def test_memory_index_tracks_appends_and_external_edits(tmp_path):
+    notes = tmp_path / "MEMORY.md"
+    notes.write_text("# Durable Memory\n\n- alpha note\n")
+    index = MemoryIndex(tmp_path / "memory.index.json")
+    index.refresh([notes])
+
+    previous_size = notes.stat().st_size
+    with notes.open("a") as handle:
+        handle.write("- bravo note\n")
+    index.note_append(notes, ["- bravo note"], previous_size)
+    assert index.refresh([notes]) == 0
+    assert index.search("bravo", limit=3)[0]["line"] == 4
+    index.save()
+
+    notes.write_text("# Durable Memory\n\n- charlie replaced everything\n")
+    reloaded = MemoryIndex(tmp_path / "memory.index.json")
+    assert reloaded.refresh([notes]) == 1
+    assert reloaded.search("bravo", limit=3) == []
+    assert reloaded.search("charlie", limit=3)[0]["line"] == 3
+
+
+def test_line_offset_index_slices_windows_and_follows_appends(tmp_path):
+    notes = tmp_path / "MEMORY.md"
+    lines = [f"- note {number}" for number in range(1, 201)]
+    notes.write_text("\n".join(lines) + "\n")
+    index = LineOffsetIndex(notes, stride=16)
+
+    window, total = index.read(150, 5)
+    assert window == lines[149:154]
+    assert total == 200
+    assert (tmp_path / "MEMORY.md.lines").exists()
+
+    with notes.open("a") as handle:
+        handle.write("- note 201\n")
+    assert index.read(199, 10) == (["- note 199", "- note 200", "- note 201"], 201)
+    assert LineOffsetIndex(notes, stride=16).read(201, 1) == (["- note 201"], 201)
+
+
+def test_consolidate_memory_archives_old_days_and_dedupes_notes(tmp_path):
+    daily = tmp_path / "memory"
+    daily.mkdir()
+    (daily / "2026-08-30.md").write_text("# Daily Memory 2026-08-30\n\n- [t] shipped v1\n")
+    (daily / "2026-08-31.md").write_text("# Daily Memory 2026-08-31\n\n- [t] fixed login\n")
+    (daily / "2026-10-18.md").write_text("# Daily Memory 2026-10-18\n\n- [t] recent\n")
+    (tmp_path / "MEMORY.md").write_text("# Durable Memory\n\n- Prefers tabs\n- prefers  tabs\n- Uses uv\n")
+
+    result = consolidate_memory(tmp_path, archive_after_days=30, today=date(2026, 10, 19))
+
+    assert result == {"archived_days": 2, "duplicates_removed": 1, "months": ["2026-08"]}
+    assert sorted(path.name for path in daily.glob("*.md")) == ["2026-10-18.md"]
+    archive_text = (daily / "archive" / "2026-08.md").read_text()
+    assert "## 2026-08-30\n- [t] shipped v1" in archive_text
+    assert "## 2026-08-31\n- [t] fixed login" in archive_text
+    assert load_archive_manifest(daily / "archive")["months"]["2026-08"]["days"] == ["2026-08-30", "2026-08-31"]
+    assert (tmp_path / "MEMORY.md").read_text() == "# Durable Memory\n\n- Prefers tabs\n- Uses uv\n"
+
+
+def test_memory_index_saves_only_changed_file_segments(tmp_path):
+    notes = tmp_path / "MEMORY.md"
+    notes.write_text("# Durable Memory\n\n- alpha note\n")
+    daily = tmp_path / "2026-10-19.md"
+    daily.write_text("# Daily Memory\n\n- [t] bravo\n")
+    index = MemoryIndex(tmp_path / "memory.index.json")
+    index.refresh([notes, daily])
+    index.save()
+    segments = {path.name: path.stat().st_ino for path in (tmp_path / "memory.index.segments").iterdir()}
+    assert len(segments) == 2
+
+    previous_size = daily.stat().st_size
+    with daily.open("a") as handle:
+        handle.write("- [t] charlie\n")
+    index.note_append(daily, ["- [t] charlie"], previous_size)
+    index.save()
+
+    changed = {path.name for path in (tmp_path / "memory.index.segments").iterdir() if path.stat().st_ino != segments.get(path.name)}
+    assert changed == {MemoryIndex._segment_name(str(daily))}
+    reloaded = MemoryIndex(tmp_path / "memory.index.json")
+    assert reloaded.refresh([notes, daily]) == 0
+    assert reloaded.search("charlie", limit=3)[0]["line"] == 4
+
+    daily.unlink()
+    reloaded.refresh([notes])
+    reloaded.save()
+    assert len(list((tmp_path / "memory.index.segments").iterdir())) == 1
+
+
+def test_consolidate_memory_does_not_append_a_day_twice_after_a_crash(tmp_path):
+    daily = tmp_path / "memory"
+    archive = daily / "archive"
+    archive.mkdir(parents=True)
+    (daily / "2026-08-30.md").write_text("# Daily Memory 2026-08-30\n\n- [t] shipped v1\n")
+    # A previous run appended the day but died before writing the manifest.
+    (archive / "2026-08.md").write_text("# Memory Archive 2026-08\n\n## 2026-08-30\n- [t] shipped v1\n")
+
+    consolidate_memory(tmp_path, archive_after_days=30, today=date(2026, 10, 19))
+
+    assert (archive / "2026-08.md").read_text().count("## 2026-08-30") == 1
+    assert load_archive_manifest(archive)["months"]["2026-08"]["days"] == ["2026-08-30"]
+    assert not (daily / "2026-08-30.md").exists()
+
+
+def test_consolidate_memory_waits_for_memory_writers(tmp_path):
+    (tmp_path / "memory").mkdir()
+    (tmp_path / "MEMORY.md").write_text("# Durable Memory\n\n- Uses uv\n- uses uv\n")
+    worker = threading.Thread(target=consolidate_memory, args=(tmp_path, 30, date(2026, 10, 19)))
+    with memory_lock(tmp_path):
+        worker.start()
+        time.sleep(0.1)
+        assert worker.is_alive()
+        with (tmp_path / "MEMORY.md").open("a") as handle:
+            handle.write("- written while locked\n")
+    worker.join(5)
+
+    assert (tmp_path / "MEMORY.md").read_text() == "# Durable Memory\n\n- Uses uv\n- written while locked\n"
@@ -0,0 +1,54 @@
+import pytest
+
+from codeclaw.metrics import TOKENS, TURN_DURATION, MetricsRegistry, _Metric, record_turn
+
+
+def test_histogram_and_counter_render_prometheus_text():
+    registry = MetricsRegistry()
+    latency = registry.histogram("demo_seconds", "Demo latency.", ("agent",), buckets=(0.1, 1.0))
+    calls = registry.counter("demo_total", "Demo calls.", ("agent",))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value, agent="a")
+    calls.inc(agent='quote"d')
+
+    text = registry.render()
+
+    assert "# TYPE demo_seconds histogram" in text
+    assert 'demo_seconds_bucket{agent="a",le="0.1"} 2' in text
+    assert 'demo_seconds_bucket{agent="a",le="1"} 3' in text
+    assert 'demo_seconds_bucket{agent="a",le="+Inf"} 4' in text
+    assert 'demo_seconds_count{agent="a"} 4' in text
+    assert 'demo_total{agent="quote\\"d"} 1' in text
+
+
+def test_record_turn_aggregates_turn_metrics():
+    before = TURN_DURATION.count(agent="metrics-test", model="gpt-5")
+    record_turn(
+        "metrics-test",
+        "http",
+        {"duration_ms": 1200, "gateway_duration_ms": 1300, "model_used": "gpt-5", "input_tokens": 40, "output_tokens": 7},
+    )
+
+    assert TURN_DURATION.count(agent="metrics-test", model="gpt-5") == before + 1
+    assert TOKENS.value(agent="metrics-test", model="gpt-5", direction="input") >= 40
+
+
+def test_metric_without_samples_fails_at_construction():
+    class _Incomplete(_Metric):
+        kind = "gauge"
+
+    with pytest.raises(TypeError):
+        _Incomplete("codeclaw_incomplete", "never rendered")
+
+
+def test_const_labels_are_added_to_every_sample():
+    registry = MetricsRegistry()
+    registry.histogram("demo_seconds", "Demo latency.", ("agent",), buckets=(1.0,)).observe(0.5, agent="a")
+    registry.counter("demo_total", "Demo calls.").inc()
+    registry.set_const_labels(worker=1234)
+
+    text = registry.render()
+
+    assert 'demo_seconds_bucket{agent="a",worker="1234",le="1"} 1' in text
+    assert 'demo_seconds_sum{agent="a",worker="1234"} 0.5' in text
+    assert 'demo_total{worker="1234"} 1' in text
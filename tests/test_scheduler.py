@@ -0,0 +1,161 @@
+import threading
+import time
+
+import pytest
+
+from codeclaw.config import SchedulerConfig
+from codeclaw.scheduler import AdmissionQueue, AdmissionRejected, SchedulerTimeout, SessionTurnCoordinator, TurnScheduler
+
+
+def test_scheduler_interleaves_flows_instead_of_serving_bursts_first():
+    scheduler = TurnScheduler(SchedulerConfig(max_concurrent_turns=1, per_agent_limit=1))
+    blocker = scheduler.acquire("default", "openai", "cli", "warmup")
+    order = []
+    threads = []
+
+    def turn(peer, label):
+        with scheduler.slot("default", "openai", "telegram", peer):
+            order.append(label)
+
+    # A burst of three from one peer is queued before a single turn from another.
+    for label in ["a1", "a2", "a3"]:
+        threads.append(threading.Thread(target=turn, args=("busy", label)))
+        threads[-1].start()
+        time.sleep(0.02)
+    threads.append(threading.Thread(target=turn, args=("quiet", "b1")))
+    threads[-1].start()
+    time.sleep(0.02)
+    assert scheduler.snapshot()["queued"] == 4
+
+    scheduler.release(blocker)
+    for thread in threads:
+        thread.join(timeout=2)
+    assert order == ["a1", "b1", "a2", "a3"]
+
+
+def test_scheduler_enforces_per_agent_cap_and_times_out():
+    scheduler = TurnScheduler(SchedulerConfig(per_agent_limit=1, queue_timeout_seconds=0))
+    held = scheduler.acquire("default", "openai", "cli", "one")
+    other_agent = scheduler.acquire("helper", "openai", "cli", "two")
+    assert other_agent.queue_wait_ms == 0
+    with pytest.raises(SchedulerTimeout):
+        scheduler.acquire("default", "openai", "cli", "three")
+    scheduler.release(held)
+    scheduler.release(other_agent)
+    assert scheduler.snapshot() == {"running": 0, "queued": 0, "running_by_agent": {}, "running_by_provider": {}}
+
+
+def test_admission_queue_rejects_past_workers_plus_queue():
+    admission = AdmissionQueue(workers=1, max_queue=1)
+    release = threading.Event()
+    running = admission.submit(release.wait, 5)
+    queued = admission.submit(lambda: "queued")
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        admission.submit(lambda: "rejected")
+    assert rejected.value.retry_after >= 1
+    snapshot = admission.snapshot()
+    assert (snapshot["running"], snapshot["queued"], snapshot["rejected"]) == (1, 1, 1)
+
+    release.set()
+    assert running.result(timeout=5) is True
+    assert queued.result(timeout=5) == "queued"
+    assert admission.snapshot()["queued"] == 0
+    admission.shutdown()
+
+
+def test_admission_leaves_queueing_to_the_scheduler():
+    scheduler = TurnScheduler(SchedulerConfig(max_concurrent_turns=2, per_agent_limit=1))
+    admission = AdmissionQueue(workers=1, max_queue=2, scheduler=scheduler)
+    release = threading.Event()
+    started = threading.Event()
+
+    def turn(agent_id, hold):
+        with scheduler.slot(agent_id, "openai", "cli", agent_id):
+            started.set()
+            if hold:
+                release.wait(5)
+        return agent_id
+
+    first = admission.submit(turn, "default", True)
+    assert started.wait(5)
+    blocked = admission.submit(turn, "default", False)
+    # A turn for another agent is not stuck behind the one waiting on the per-agent cap.
+    other = admission.submit(turn, "helper", False)
+    assert other.result(timeout=5) == "helper"
+
+    snapshot = admission.snapshot()
+    assert (snapshot["running"], snapshot["queued"], snapshot["workers"]) == (1, 1, 2)
+    with pytest.raises(AdmissionRejected):
+        for _ in range(3):
+            admission.submit(turn, "default", False)
+
+    release.set()
+    assert first.result(timeout=5) == "default"
+    assert blocked.result(timeout=5) == "default"
+    admission.shutdown()
+
+
+def test_session_turns_serialize_and_coalesce_queued_messages():
+    turns = SessionTurnCoordinator(coalesce=True, max_batch=5)
+    first_running = threading.Event()
+    release = threading.Event()
+    batches = []
+    results = {}
+
+    def turn_fn(messages):
+        batches.append(list(messages))
+        if messages == ["one"]:
+            first_running.set()
+            release.wait(5)
+        return "+".join(messages)
+
+    def send(message):
+        results[message] = turns.run(("default", "s1"), message, turn_fn)
+
+    first = threading.Thread(target=send, args=("one",))
+    first.start()
+    first_running.wait(5)
+    followers = [threading.Thread(target=send, args=(message,)) for message in ("two", "three")]
+    for thread in followers:
+        thread.start()
+    while turns.snapshot()["queued_turns"] < 2:
+        time.sleep(0.01)
+    release.set()
+    for thread in [first, *followers]:
+        thread.join(5)
+
+    assert batches == [["one"], ["two", "three"]]
+    assert results == {"one": "one", "two": "two+three", "three": "two+three"}
+    assert turns.snapshot() == {"busy_sessions": 0, "queued_turns": 0}
+
+
+def test_session_turns_never_merge_streaming_callers():
+    turns = SessionTurnCoordinator(coalesce=True, max_batch=5)
+    first_running = threading.Event()
+    release = threading.Event()
+    batches = []
+
+    def turn_fn(messages):
+        batches.append(list(messages))
+        if messages == ["one"]:
+            first_running.set()
+            release.wait(5)
+        return "+".join(messages)
+
+    def send(message, coalescible):
+        turns.run(("default", "s1"), message, turn_fn, coalescible=coalescible)
+
+    threads = [threading.Thread(target=send, args=("one", True))]
+    threads[0].start()
+    first_running.wait(5)
+    for queued, (message, coalescible) in enumerate([("two", True), ("streamed", False), ("four", True)], start=1):
+        threads.append(threading.Thread(target=send, args=(message, coalescible)))
+        threads[-1].start()
+        while turns.snapshot()["queued_turns"] < queued:
+            time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert batches == [["one"], ["two"], ["streamed", "four"]]
@@ -10,3 +10,20 @@ def test_session_store(tmp_path):
     assert events[0]["content"] == "hi"
     sessions = store.list_sessions("agent")
     assert sessions[0]["id"] == session["id"]
+
+
+def test_append_event_assigns_persistent_seq_and_notifies_listeners(tmp_path):
+    store = SessionStore(StorageConfig(base_path=str(tmp_path)))
+    session = store.create_session("default", "cli", "local", "hello")
+    seen = []
+    store.add_listener(lambda agent_id, session_id, event: seen.append((session_id, event["seq"])))
+    store.append_event("default", session["id"], {"role": "user", "content": "one"})
+    store.append_event("default", session["id"], {"role": "assistant", "content": "two"})
+
+    reopened = SessionStore(StorageConfig(base_path=str(tmp_path)))
+    third = reopened.append_event("default", session["id"], {"role": "user", "content": "three"})
+
+    assert seen == [(session["id"], 1), (session["id"], 2)]
+    assert third["seq"] == 3
+    assert [event["seq"] for event in reopened.read_events("default", session["id"])] == [1, 2, 3]
+    assert reopened.get_session("default", session["id"])["last_seq"] == 3
@@ -0,0 +1,45 @@
+from types import SimpleNamespace
+
+from codeclaw.config import ContextConfig, StorageConfig
+from codeclaw.storage import SessionStore
+from codeclaw.summarizer import ContextSummarizer, summarize_events_locally
+
+
+def test_summarize_events_locally_keeps_first_sentences_and_prior_summary():
+    events = [
+        {"role": "summary", "content": "Compacted session summary:\n- User: Deploy uses blue/green."},
+        {"role": "user", "content": "Please rename the service. It is called api-v1 today."},
+        {"role": "assistant", "content": "Renamed it to api-v2. Tests pass."},
+        {"role": "user", "content": "Please rename the service. It is called api-v1 today."},
+        {"role": "metrics", "content": {"duration_ms": 1}},
+    ]
+    summary = summarize_events_locally(events, summary_line_limit=10)
+    assert summary.splitlines() == [
+        "Rolling session summary:",
+        "- User: Deploy uses blue/green.",
+        "- User: Please rename the service.",
+        "- Assistant: Renamed it to api-v2.",
+    ]
+
+
+def test_prepared_summary_is_swapped_in_and_invalidated_by_rewrites(tmp_path):
+    store = SessionStore(StorageConfig(base_path=str(tmp_path)))
+    session = store.create_session("agent", "cli", "peer", "hello")
+    for index in range(10):
+        store.append_event("agent", session["id"], {"role": "user", "content": f"question {index}"})
+    config = SimpleNamespace(context=ContextConfig(keep_recent_events=4, compact_trigger_tokens=0))
+    summarizer = ContextSummarizer(config, store, llm_factory=lambda *_: None)
+
+    assert summarizer.prepare("agent", session["id"])["prepared"] is True
+    store.append_event("agent", session["id"], {"role": "assistant", "content": "answer"})
+    applied = store.apply_prepared_summary("agent", session["id"])
+
+    assert applied == {"compacted": True, "source_events": 6, "kept_events": 5}
+    events = store.read_events("agent", session["id"])
+    assert events[0]["role"] == "summary"
+    assert "question 5" in events[0]["content"]
+    assert events[-1]["content"] == "answer"
+
+    summarizer.prepare("agent", session["id"])
+    store.compact_session_context("agent", session["id"], keep_recent_events=4, summary_line_limit=10)
+    assert store.apply_prepared_summary("agent", session["id"])["reason"] == "stale_prepared_summary"
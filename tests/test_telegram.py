@@ -1,14 +1,26 @@
+import threading
+import time
 from types import SimpleNamespace
 
 import httpx
 
-from codeclaw.telegram import _send_gateway, _transcribe_voice_message, _work_item_from_update
+from codeclaw.telegram import ChatWorker, PartialReply, PollerLeader, WorkItem, _send_gateway, _transcribe_voice_message, _work_item_from_update
 
 
 def _config():
     return SimpleNamespace(gateway=SimpleNamespace(host="127.0.0.1", port=18789))
 
 
+class _Resp:
+    def __init__(self, status_code, payload, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+
 def test_send_gateway_handles_timeout(monkeypatch):
     def _fake_post(*args, **kwargs):  # noqa: ARG001
         raise httpx.ReadTimeout("timed out")
@@ -22,13 +34,8 @@ def test_send_gateway_handles_timeout(monkeypatch):
 
 
 def test_send_gateway_returns_json_payload(monkeypatch):
-    class _Resp:
-        status_code = 200
-
-        def json(self):
-            return {"ok": True, "assistant_message": "ok"}
-
-    monkeypatch.setattr("codeclaw.telegram.httpx.post", lambda *args, **kwargs: _Resp())  # noqa: ARG005
+    resp = _Resp(200, {"ok": True, "assistant_message": "ok"})
+    monkeypatch.setattr("codeclaw.telegram.httpx.post", lambda *args, **kwargs: resp)  # noqa: ARG005
 
     result = _send_gateway(_config(), "default", "hello", None, "peer-1")
 
@@ -36,6 +43,21 @@ def test_send_gateway_returns_json_payload(monkeypatch):
     assert result["assistant_message"] == "ok"
 
 
+def test_send_gateway_waits_out_busy_gateway(monkeypatch):
+    responses = [
+        _Resp(429, {"ok": False, "error": "busy"}, {"Retry-After": "7"}),
+        _Resp(200, {"ok": True, "assistant_message": "ok"}),
+    ]
+    sleeps = []
+    monkeypatch.setattr("codeclaw.telegram.httpx.post", lambda *args, **kwargs: responses.pop(0))  # noqa: ARG005
+    monkeypatch.setattr("codeclaw.telegram.time.sleep", sleeps.append)
+
+    result = _send_gateway(_config(), "default", "hello", None, "peer-1")
+
+    assert result == {"ok": True, "assistant_message": "ok"}
+    assert sleeps == [7.0]
+
+
 def _voice_config(
     *,
     enabled: bool = True,
@@ -126,3 +148,142 @@ def test_transcribe_voice_message_happy_path(monkeypatch):
     assert result["ok"] is True
     assert result["text"] == "turn on the lights"
     assert result["duration_seconds"] == 4
+
+
+def test_send_gateway_streams_events_until_result(monkeypatch):
+    lines = [
+        '{"type": "session", "session_id": "s1"}',
+        '{"type": "delta", "text": "hel"}',
+        '{"type": "delta", "text": "lo"}',
+        '{"type": "result", "ok": true, "session_id": "s1", "assistant_message": "hello"}',
+    ]
+
+    class _StreamResp:
+        status_code = 200
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            return False
+
+        def iter_lines(self):
+            return iter(lines)
+
+    captured = {}
+
+    def _fake_stream(method, url, json=None, timeout=None):  # noqa: ARG001
+        captured["payload"] = json
+        return _StreamResp()
+
+    monkeypatch.setattr("codeclaw.telegram.httpx.stream", _fake_stream)
+    seen = []
+
+    result = _send_gateway(_config(), "default", "hello", None, "peer-1", stream_partial=True, on_event=seen.append)
+
+    assert captured["payload"]["stream_partial"] is True
+    assert [event["text"] for event in seen if event["type"] == "delta"] == ["hel", "lo"]
+    assert result["ok"] is True
+    assert result["assistant_message"] == "hello"
+
+
+def test_chat_worker_coalesces_text_queued_during_a_turn(monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+    processed = []
+
+    def _fake_process(self, item):
+        processed.append((item.update_id, item.text))
+        if item.text == "first":
+            started.set()
+            release.wait(5)
+
+    monkeypatch.setattr(ChatWorker, "_process_item", _fake_process)
+    config = SimpleNamespace(telegram=SimpleNamespace(max_queue_per_chat=10, coalesce_messages=True))
+    worker = ChatWorker(config, chat_id=7, agent_id="default")
+    worker.enqueue(WorkItem(update_id=1, chat_id=7, text="first"))
+    started.wait(5)
+    worker.enqueue(WorkItem(update_id=2, chat_id=7, text="second"))
+    worker.enqueue(WorkItem(update_id=3, chat_id=7, text="third"))
+    release.set()
+    worker.queue.join()
+    worker.stop()
+
+    assert processed == [(1, "first"), (3, "second\n\nthird")]
+
+
+def test_chat_worker_never_coalesces_slash_commands(monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+    processed = []
+
+    def _fake_process(self, item):
+        processed.append((item.update_id, item.text))
+        if item.text == "first":
+            started.set()
+            release.wait(5)
+
+    monkeypatch.setattr(ChatWorker, "_process_item", _fake_process)
+    config = SimpleNamespace(telegram=SimpleNamespace(max_queue_per_chat=10, coalesce_messages=True))
+    worker = ChatWorker(config, chat_id=7, agent_id="default")
+    worker.enqueue(WorkItem(update_id=1, chat_id=7, text="first"))
+    started.wait(5)
+    for update_id, text in [(2, "second"), (3, "/new"), (4, "fourth"), (5, "fifth")]:
+        worker.enqueue(WorkItem(update_id=update_id, chat_id=7, text=text))
+    release.set()
+    worker.queue.join()
+    worker.stop()
+
+    assert processed == [(1, "first"), (2, "second"), (3, "/new"), (5, "fourth\n\nfifth")]
+
+
+def test_poller_leader_election_fails_over(monkeypatch, tmp_path):
+    started = []
+    monkeypatch.setattr("codeclaw.telegram.start_poller_in_background", lambda config: started.append(config.name))
+    monkeypatch.setattr("codeclaw.telegram.stop_active_poller", lambda: None)
+
+    def _leader_config(name):
+        telegram = SimpleNamespace(offset_path=str(tmp_path / "telegram_offset.json"), leader_retry_seconds=0.05)
+        return SimpleNamespace(name=name, telegram=telegram)
+
+    first = PollerLeader(_leader_config("first"))
+    second = PollerLeader(_leader_config("second"))
+    first.start()
+    for _ in range(100):
+        if first.is_leader:
+            break
+        time.sleep(0.01)
+    second.start()
+    time.sleep(0.2)
+    assert (first.is_leader, second.is_leader) == (True, False)
+
+    first.stop()
+    for _ in range(100):
+        if second.is_leader:
+            break
+        time.sleep(0.01)
+    second.stop()
+
+    assert started == ["first", "second"]
+
+
+def test_partial_reply_falls_back_to_a_normal_send_when_the_final_edit_fails(monkeypatch):
+    config = SimpleNamespace(telegram=SimpleNamespace(partial_reply_chunk_chars=80, partial_reply_delay_seconds=0.01))
+    calls = []
+    edit_results = [{"ok": False, "error": "telegram rate limit exceeded"}, {"ok": True}]
+
+    def _fake_post(config, method, payload, timeout_seconds=20.0):  # noqa: ARG001
+        calls.append((method, payload["text"]))
+        if method == "sendMessage":
+            return {"ok": True, "result": {"message_id": 7}}
+        return edit_results.pop(0)
+
+    monkeypatch.setattr("codeclaw.telegram._telegram_api_post", _fake_post)
+    partial = PartialReply(config, chat_id=1)
+    partial.on_event({"type": "delta", "text": "x" * 100})
+
+    assert partial.finish("final answer") is False
+    assert partial.finish("final answer") is True
+    assert partial.finish("final answer") is True
+    assert partial.finish("y" * 5000) is False
+    assert [method for method, _ in calls] == ["sendMessage", "editMessageText", "editMessageText"]
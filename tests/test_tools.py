@@ -1,6 +1,6 @@
 from codeclaw.approvals import ApprovalsStore
 from codeclaw.config import ToolsConfig
-from codeclaw.tools import ToolRegistry, ToolApprovalRequired
+from codeclaw.tools import ArtifactStore, ToolRegistry, ToolApprovalRequired
 
 
 def test_tool_approval_required(tmp_path):
@@ -90,3 +90,26 @@ def test_file_read_prefers_existing_home_relative_path(tmp_path, monkeypatch):
     assert result["ok"] is True
     assert result["path"] == str(target)
     assert result["content"] == "hello"
+
+
+def test_large_tool_output_is_offloaded_to_artifact(tmp_path):
+    approvals = ApprovalsStore(str(tmp_path / "approvals.json"))
+    approvals.allow("exec")
+    config = ToolsConfig(approvals_path=str(tmp_path / "approvals.json"), result_max_chars=100, result_preview_chars=40)
+    registry = ToolRegistry(config, approvals, ArtifactStore(tmp_path / "artifacts"))
+    output = "".join(f"{i:04d}" for i in range(100))
+    result = registry.execute("exec", {"cmd": ["printf", output]}, channel="cli", interactive=False)
+    assert result["ok"] is True
+    assert result["stdout"].startswith(output[:20])
+    assert result["stdout"].endswith(output[-20:])
+    assert len(result["stdout"]) < len(output)
+    handle = result["artifacts"]["stdout"]["handle"]
+    assert result["artifacts"]["stdout"]["chars"] == len(output)
+
+    first = registry.execute("artifact.read", {"handle": handle, "offset": 20, "limit": 300}, channel="cli", interactive=False)
+    assert first["text"] == output[20:320]
+    assert first["next_offset"] == 320
+    rest = registry.execute("artifact.read", {"handle": handle, "offset": 320, "limit": 300}, channel="cli", interactive=False)
+    assert rest["text"] == output[320:]
+    assert rest["next_offset"] is None
+    assert registry.execute("artifact.read", {"handle": "../x"}, channel="cli", interactive=False)["ok"] is False
@@ -0,0 +1,71 @@
+import gzip
+import json
+import threading
+
+import pytest
+
+from codeclaw.tracing import JsonlTraceExporter, TracingPolicy, TurnTrace, add_exporter, export_trace, remove_exporter
+
+
+def test_turn_trace_nests_spans_and_accepts_explicit_parents():
+    trace = TurnTrace("turn", agent_id="default")
+    with trace.span("outer") as outer:
+        with trace.span("inner", step=1):
+            pass
+
+        def work():
+            with trace.span("threaded", parent=outer):
+                pass
+
+        worker = threading.Thread(target=work)
+        worker.start()
+        worker.join()
+    finished = trace.finish()
+
+    assert finished["attrs"] == {"agent_id": "default"}
+    [outer_dict] = finished["children"]
+    assert [child["name"] for child in outer_dict["children"]] == ["inner", "threaded"]
+    assert outer_dict["children"][0]["attrs"] == {"step": 1}
+    assert outer_dict["duration_ms"] >= outer_dict["children"][0]["duration_ms"]
+
+
+def test_export_trace_isolates_failing_exporters():
+    received = []
+
+    def broken(_trace):
+        raise RuntimeError("boom")
+
+    add_exporter(broken)
+    add_exporter(received.append)
+    try:
+        export_trace({"name": "turn"})
+    finally:
+        remove_exporter(broken)
+        remove_exporter(received.append)
+    assert received == [{"name": "turn"}]
+
+
+def test_tracing_policy_parses_modes_and_filters_traces():
+    assert TracingPolicy.parse("off").should_export({"duration_ms": 10}) is False
+    assert TracingPolicy.parse("sampled:1").should_export({}) is True
+    assert TracingPolicy.parse("sampled:0").should_export({}) is False
+    errors_only = TracingPolicy.parse("errors_only")
+    assert errors_only.should_export({"children": [{"attrs": {"error": "TimeoutError"}}]}) is True
+    assert errors_only.should_export({"children": [{"attrs": {}}]}) is False
+    slow_only = TracingPolicy.parse("slow_only:500")
+    assert slow_only.should_export({"duration_ms": 750}) is True
+    assert slow_only.should_export({"duration_ms": 20}) is False
+    with pytest.raises(ValueError):
+        TracingPolicy.parse("sampled:2")
+
+
+def test_jsonl_trace_exporter_writes_gzip_batches(tmp_path):
+    exporter = JsonlTraceExporter(str(tmp_path), batch_size=2, flush_seconds=60)
+    for index in range(3):
+        exporter({"name": "turn", "index": index})
+    exporter.close()
+
+    [path] = tmp_path.glob("traces-*.jsonl.gz")
+    with gzip.open(path, "rt") as handle:
+        records = [json.loads(line) for line in handle]
+    assert [record["index"] for record in records] == [0, 1, 2]
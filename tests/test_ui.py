@@ -1,6 +1,6 @@
 import tomllib
 
-from codeclaw.ui import _completed_plan_durations, _llm_requests, _save_telegram_settings
+from codeclaw.ui import _completed_plan_durations, _llm_requests, _request_json, _save_telegram_settings
 
 
 def test_llm_requests_are_reverse_chronological():
@@ -80,3 +80,47 @@ def test_save_telegram_settings_rejects_invalid_interval(tmp_path):
     ok, err = _save_telegram_settings(config_path, "token", 0)
     assert ok is False
     assert "at least 1" in err
+
+
+class _Resp:
+    def __init__(self, status_code, payload=None, etag=None):
+        self.status_code = status_code
+        self.headers = {"etag": etag} if etag else {}
+        self._payload = payload
+        self.text = ""
+
+    def json(self):
+        if self._payload is None:
+            raise ValueError("no body")
+        return self._payload
+
+
+def test_request_json_revalidates_with_etag(monkeypatch):
+    sent_headers = []
+    responses = [_Resp(200, {"ok": True, "sessions": ["s1"]}, etag='"v1"'), _Resp(304)]
+
+    def _fake_request(method, url, **kwargs):
+        sent_headers.append(dict(kwargs.get("headers") or {}))
+        return responses.pop(0)
+
+    monkeypatch.setattr("codeclaw.ui.httpx.request", _fake_request)
+    url = "http://gateway.test/api/session/list"
+    first = _request_json("GET", url, params={"agent_id": "etag-test"})
+    second = _request_json("GET", url, params={"agent_id": "etag-test"})
+
+    assert first == second == {"ok": True, "sessions": ["s1"]}
+    assert "If-None-Match" not in sent_headers[0]
+    assert sent_headers[1]["If-None-Match"] == '"v1"'
+
+
+def test_request_json_cached_payload_is_not_shared(monkeypatch):
+    responses = [_Resp(200, {"ok": True, "sessions": ["s1"]}, etag='"v1"'), _Resp(304), _Resp(304)]
+    monkeypatch.setattr("codeclaw.ui.httpx.request", lambda method, url, **kwargs: responses.pop(0))
+    url = "http://gateway.test/api/session/list"
+    first = _request_json("GET", url, params={"agent_id": "etag-copy"})
+    first["sessions"].append("mutated")
+    second = _request_json("GET", url, params={"agent_id": "etag-copy"})
+    second["sessions"].append("mutated-again")
+    third = _request_json("GET", url, params={"agent_id": "etag-copy"})
+
+    assert third == {"ok": True, "sessions": ["s1"]}